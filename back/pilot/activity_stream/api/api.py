@@ -14,7 +14,7 @@ from pilot.notifications.notify import process_notifications_when_comment_is_upd
 from pilot.utils import api as api_utils
 
 
-class ActivityPagination(api_utils.PilotPageNumberPagination):
+class ActivityPagination(api_utils.PilotKeysetPagination):
     page_size = 10
 
 
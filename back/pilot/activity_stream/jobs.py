@@ -9,6 +9,36 @@ from pilot.pilot_users.models import PilotUser
 logger = logging.getLogger(__name__)
 
 
+def make_activity(actor, desk, verb, target=None, target_str='',
+                  action_object=None, action_object_str='',
+                  diff=None):
+    """
+    Returns an unsaved Activity instance
+    """
+    activity = Activity(
+        desk=desk,
+        verb=verb,
+        target=target,
+        target_str=target_str,
+        action_object=action_object,
+        action_object_str=action_object_str,
+        diff=diff
+    )
+
+    if isinstance(actor, PilotUser):
+        activity.actor = actor
+    elif actor in Activity.NON_DB_USERS:
+        activity.actor_identifier = actor
+    else:
+        try:
+            validate_email(actor)
+            activity.actor_email = actor
+        except ValidationError:
+            raise ValueError("Actor must be a PilotUser instance or a NON_DB_USERS or an email.")
+
+    return activity
+
+
 def create_activity(actor, desk, verb, target=None, target_str='',
                     action_object=None, action_object_str='',
                     diff=None):
@@ -18,27 +48,14 @@ def create_activity(actor, desk, verb, target=None, target_str='',
     28/01/19 : Activity creation is now always synchroneous until we can fix issues with lost jobs
     """
     try:
-        activity = Activity(
-            desk=desk,
-            verb=verb,
+        activity = make_activity(
+            actor, desk, verb,
             target=target,
             target_str=target_str,
             action_object=action_object,
             action_object_str=action_object_str,
             diff=diff
         )
-
-        if isinstance(actor, PilotUser):
-            activity.actor = actor
-        elif actor in Activity.NON_DB_USERS:
-            activity.actor_identifier = actor
-        else:
-            try:
-                validate_email(actor)
-                activity.actor_email = actor
-            except ValidationError:
-                raise ValueError("Actor must be a PilotUser instance or a NON_DB_USERS or an email.")
-
         activity.save()
 
         # De-activated for now
@@ -49,3 +66,16 @@ def create_activity(actor, desk, verb, target=None, target_str='',
 
     except Exception as e:
         logger.error('Error while trying to create an Activity', exc_info=True)
+
+
+def bulk_create_activities(activities):
+    """
+    Save the activities made with `make_activity`, with a single insert
+    """
+    try:
+        for activity in activities:
+            activity.fill_display_strings()
+        return Activity.objects.bulk_create(activities)
+
+    except Exception as e:
+        logger.error('Error while trying to create Activities', exc_info=True)
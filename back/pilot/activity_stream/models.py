@@ -3,6 +3,7 @@ import logging
 from django.contrib.contenttypes.models import ContentType
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 from django.utils.encoding import force_text
 from django.utils.translation import ugettext_lazy as _
@@ -24,55 +25,20 @@ class ActivityManager(models.Manager):
         if not user.permissions.is_restricted_editor:
             return super(ActivityManager, self).get_queryset().filter(desk=desk)
 
-        # Else, restrict the visible activities
-        permitted_activities = []
-
-        def add_activities_for_content_type(content_type, permitted_pks):
-            permitted_activities.extend(Activity.objects.filter(
-                desk=desk,
-                target_content_type=content_type,
-                target_object_id__in=permitted_pks
-            ).values_list('id', flat=True))
-
-        # Get objects restricted user has access to
-        permitted_items = list(
-            Item
-            .accessible_objects
-            .filter(desk=desk)
-            .filter_by_permissions(user)
-            .values_list('pk', flat=True)
-
-        )
-
-        permitted_projects = list(
-            Project
-            .objects
-            .filter(desk=desk)
-            .filter_by_permissions(user)
-            .values_list('pk', flat=True)
-        )
-
-        permitted_channels = list(
-            Channel
-            .objects
-            .filter(desk=desk)
-            .filter_by_permissions(user)
-            .values_list('pk', flat=True)
-        )
-
-        # Get the activities related to the items
-        item_content_type = ContentType.objects.get_for_model(Item)
-        add_activities_for_content_type(item_content_type, permitted_items)
-
-        # Get the activities related to the projects
-        project_content_type = ContentType.objects.get_for_model(Project)
-        add_activities_for_content_type(project_content_type, permitted_projects)
-
-        # Get the activities related to the channels
-        channel_content_type = ContentType.objects.get_for_model(Channel)
-        add_activities_for_content_type(channel_content_type, permitted_channels)
-
-        return super(ActivityManager, self).get_queryset().filter(desk=desk, id__in=permitted_activities)
+        # Else, restrict the visible activities to those of the objects the restricted user has access to,
+        # with subqueries instead of materializing the lists of pk
+        permitted_targets = Q()
+        for model, permitted_objects in (
+            (Item, Item.accessible_objects.filter(desk=desk).filter_by_permissions(user)),
+            (Project, Project.objects.filter(desk=desk).filter_by_permissions(user)),
+            (Channel, Channel.objects.filter(desk=desk).filter_by_permissions(user)),
+        ):
+            permitted_targets |= Q(
+                target_content_type=ContentType.objects.get_for_model(model),
+                target_object_id__in=permitted_objects.order_by().values('pk')
+            )
+
+        return super(ActivityManager, self).get_queryset().filter(permitted_targets, desk=desk)
 
 
 class Activity(models.Model):
@@ -277,17 +243,20 @@ class Activity(models.Model):
     def save(self, *args, **kwargs):
         # Creation
         if not self.pk:
-            if self.target and not self.target_str:
-                self.target_str = self.generate_target_str()
-
-            if self.action_object and not self.action_object_str:
-                action_object_display = self.generate_action_object_str()
-                if len(action_object_display) > 1000:
-                    action_object_display = action_object_display[:1000]
-                self.action_object_str = action_object_display
+            self.fill_display_strings()
 
         super(Activity, self).save(*args, **kwargs)
 
+    def fill_display_strings(self):
+        if self.target and not self.target_str:
+            self.target_str = self.generate_target_str()
+
+        if self.action_object and not self.action_object_str:
+            action_object_display = self.generate_action_object_str()
+            if len(action_object_display) > 1000:
+                action_object_display = action_object_display[:1000]
+            self.action_object_str = action_object_display
+
     @property
     def is_comment(self):
         return self.verb == Activity.VERB_COMMENTED
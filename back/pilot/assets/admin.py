@@ -11,7 +11,7 @@ class AssetAdmin(admin.ModelAdmin):
     ordering = ('-created_at',)
     search_fields = ('title', 'file', 'url', 'size','items__id',)
     readonly_fields = ('file',)
-    exclude = ('search_vector', 'partial_search_document')
+    exclude = ('search_vector', 'partial_search_document', 'search_document_digest')
     list_per_page = 400
 
     def item_linked(self, instance):
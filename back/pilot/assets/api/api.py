@@ -30,7 +30,7 @@ from pilot.utils.s3 import get_s3_signature_v4
 logger = logging.getLogger(__name__)
 
 
-class AssetListPagination(api_utils.PilotPageNumberPagination):
+class AssetListPagination(api_utils.PilotKeysetPagination):
     page_size = 30
 
 
@@ -57,5 +57,5 @@ class ChannelViewSet(ProjelViewSet):
         channel = self.get_object()
         item_ids = request.data.get('itemIds')
         channel.items.remove(*item_ids)
-        HierarchyConsistencyJob.launch_r(self.request, channel)
+        HierarchyConsistencyJob.launch_r(self.request, channel, item_ids=item_ids)
         return Response(status=HTTP_202_ACCEPTED)
@@ -10,7 +10,7 @@ from pilot.organizations.models import Organization
 from pilot.pilot_users.models import PilotUser
 from pilot.demo.config import get_dump_path_for_model, DEMO_MODELS, ORGANIZATION_DUMP_PATH, \
     DESK_DUMP_PATH, USERS_DUMP_PATH, ANCHOR_DATE, SUBSCRIPTION_PLAN_DUMP_PATH, TEAMS_DUMP_PATH
-from pilot.utils.search import FullTextSearchModel, UnaccentFunc
+from pilot.utils.search import FullTextSearchModel, UnaccentFunc, get_search_document_digest
 
 
 def wipe_all_data():
@@ -49,6 +49,7 @@ def deserialize_instances(dump_path):
         if isinstance(instance, FullTextSearchModel):
             instance.search_vector = instance.get_search_vector()
             search_document = instance.get_search_document()
+            instance.search_document_digest = get_search_document_digest(search_document)
             # With big search content, there's a weird error with postgres that appears only when loading demo data.
             # The db complains that the GIN index is too big.
             # Surprinsingly, this error does not show up when saving the items with the web server.
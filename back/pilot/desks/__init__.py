@@ -0,0 +1 @@
+default_app_config = 'pilot.desks.apps.DeskAppConfig'
@@ -0,0 +1,25 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+
+class DeskAppConfig(AppConfig):
+    name = 'pilot.desks'
+    verbose_name = 'Desks'
+
+    def ready(self):
+        from pilot.desks.models import Desk
+        from pilot.desks import signals
+        from pilot.organizations.models import Organization
+        from pilot.pilot_users.models import PilotUser, UserInDesk, UserInOrganization
+
+        # The cached desk connections ( and the compiled SavedFilter plans )
+        # depend on the memberships of the users, and on the desk and organization
+        for membership_model in (UserInDesk, UserInOrganization):
+            post_save.connect(signals.invalidate_user_memberships, sender=membership_model)
+            post_delete.connect(signals.invalidate_user_memberships, sender=membership_model)
+
+        for m2m_field in (PilotUser.desks, PilotUser.organizations):
+            m2m_changed.connect(signals.invalidate_members_memberships, sender=m2m_field.through)
+
+        post_save.connect(signals.invalidate_desk_memberships, sender=Desk)
+        post_save.connect(signals.invalidate_organization_memberships, sender=Organization)
@@ -1,18 +1,26 @@
 import hashlib
+import io
+import json
 import tempfile
 import threading
 import zipfile
 import logging
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import arrow
 
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import Count, Max
 from django.template.loader import render_to_string
 from django.urls import reverse
 
 from pilot.activity_stream.comment import get_comments_queryset
 from pilot.assets.models import Asset
+from pilot.comments.models import Comment
+from pilot.item_types.models import ItemType
 from pilot.items.export_item import ItemContentExporter
 from pilot.items.models import Item
 from pilot.notifications.const import NotificationType
@@ -24,14 +32,27 @@ from pilot.queue.rq_setup import low_priority_queue
 from pilot.utils import export_utils
 from pilot.utils.alpha import to_alpha
 from pilot.utils.prosemirror.prosemirror import prosemirror_json_to_html
-from pilot.utils.s3 import upload_s3_file_multipart, download_s3_file, s3_file_exists
-from pilot.utils.stream_zipfile import BufferedZipFile
+from pilot.utils.s3 import download_s3_file, s3_file_exists, get_s3_file_metadata, \
+    upload_private_s3_file, download_s3_file_range, S3MultipartUploadWriter
+from pilot.utils.stream_zipfile import BufferedZipFile, ByteBudget, StageTimings, ZipWriterPipeline, \
+    get_compress_type, make_file_entry, read_compressed_entries
 
 logger = logging.getLogger(__name__)
 
 MAX_FILE_NAME_LENGTH = 80
 THREAD_POOL_SIZE = 20
 THREAD_POOL_SIZE_ASSET_DOWNLOAD = 2
+# Assets archiving with ranged downloads ( see AssetExportJob.export_assets_with_ranged_downloads )
+THREAD_POOL_SIZE_ASSET_EXPORT = 8
+THREAD_POOL_SIZE_ASSET_PART_DOWNLOAD = 16
+ASSET_DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+# The downloaded assets waiting to be written in the archive, on disk and in RAM
+ASSET_EXPORT_MAX_BYTES_IN_FLIGHT = 1024 * 1024 * 1024
+ASSET_EXPORT_MAX_BYTES_IN_MEMORY = 64 * 1024 * 1024
+# Bigger assets are always downloaded into a temporary file
+ASSET_EXPORT_MAX_FILE_SIZE_IN_MEMORY = 8 * 1024 * 1024
+# Increment to invalidate all the cached item exports, when their format change
+ITEM_EXPORT_CACHE_VERSION = 2
 
 
 def launch_desk_export(request):
@@ -78,6 +99,78 @@ def annual_asset_zip_s3_key(desk, year):
     )
 
 
+def item_export_cache_s3_key(item):
+    return 'export/{deskId}/cache/items/{itemId}.zip'.format(
+        deskId=item.desk_id,
+        itemId=item.id
+    )
+
+
+def get_comment_watermarks(desk):
+    """
+    The count and the last submit/edition dates of the comments of each item of a desk,
+    which change whenever a comment is added, edited or deleted,
+    and the usernames of the commenters, which are rendered in the comments.
+    """
+    watermarks = (Comment.objects
+        .filter(
+            desk=desk,
+            content_type=ContentType.objects.get_for_model(Item)
+        )
+        .values('object_id')
+        .annotate(
+            count=Count('id'),
+            last_submit_date=Max('submit_date'),
+            last_edition_date=Max('edition_date'),
+            usernames=ArrayAgg('user__username', distinct=True)
+        )
+        .order_by()
+    )
+    return {
+        watermark['object_id']: [
+            watermark['count'],
+            watermark['last_submit_date'],
+            watermark['last_edition_date'],
+            sorted(username for username in watermark['usernames'] if username)
+        ]
+        for watermark in watermarks
+    }
+
+
+def get_content_schema_hashes(desk):
+    """
+    The hash of the content schema of the item types of a desk, whose field labels are rendered in the content
+    """
+    item_types = ItemType.objects.filter(
+        id__in=Item.objects.filter(desk=desk).order_by().values('item_type_id')
+    ).values_list('id', 'content_schema')
+    return {
+        item_type_id: hashlib.sha1(json.dumps(content_schema, sort_keys=True).encode()).hexdigest()
+        for item_type_id, content_schema in item_types
+    }
+
+
+def get_item_export_fingerprint(item, comment_watermark, content_schema_hash):
+    """
+    The cached export of an item is valid as long as the item, its last session, its comments and their authors,
+    and the content schema of its item type did not change
+    """
+    last_session = item.last_session
+    return hashlib.sha1(json.dumps([
+        ITEM_EXPORT_CACHE_VERSION,
+        item.id,
+        item.updated_at,
+        last_session.id if last_session else None,
+        last_session.updated_at if last_session else None,
+        comment_watermark,
+        content_schema_hash
+    ], default=str).encode()).hexdigest()
+
+
+def get_asset_compress_type(asset):
+    return get_compress_type(extension=asset.extension, mime=asset.mime, filetype=asset.filetype)
+
+
 def get_asset_paths(asset):
     format_kwargs = dict(
         id=asset.id,
@@ -98,29 +191,33 @@ class BaseExport(object):
         super(BaseExport, self).__init__(*args, **kwargs)
         self.zip_write_lock = threading.Lock()
         self.zip_file = None
-        self.temp_file = None
+        self.upload_writer = None
 
-    def open_zip_file(self):
-        self.temp_file = tempfile.NamedTemporaryFile()
-        self.zip_file = BufferedZipFile(self.temp_file, mode='w', compression=zipfile.ZIP_DEFLATED)
+    def open_zip_file(self, s3_key, file_name):
+        """
+        The archive is uploaded to S3 while it's written, without a temporary file
+        """
+        self.upload_writer = S3MultipartUploadWriter(s3_key, file_name)
+        self.zip_file = BufferedZipFile(self.upload_writer, mode='w', compression=zipfile.ZIP_DEFLATED)
 
-    def finalize_and_upload_zip_file(self, s3_key, file_name):
+    def finalize_zip_file(self):
         # Finalize the zip archive
         self.zip_file.close()
-        # Rewind the temporary file storage to the beginning
-        self.temp_file.seek(0)
-        # Upload the archive to S3
-        upload_s3_file_multipart(s3_key, self.temp_file.file, file_name)
-        # Close the temporary file
-        self.temp_file.close()
-
-    def thread_safe_write_to_zip(self, file_path, file, is_stream=False):
-        self.zip_write_lock.acquire()
-        if is_stream:
-            self.zip_file.write_s3_streaming_body(file_path, file)
-        else:
-            self.zip_file.writestr(file_path, file)
-        self.zip_write_lock.release()
+        # Upload the last part and complete the upload
+        self.upload_writer.close()
+
+    def abort_zip_file(self):
+        self.upload_writer.abort()
+
+    def thread_safe_write_to_zip(self, file_path, file, is_stream=False, compress_type=None):
+        with self.zip_write_lock:
+            if is_stream:
+                self.zip_file.write_s3_streaming_body(file_path, file, compress_type=compress_type)
+            else:
+                self.zip_file.writestr(file_path, file, compress_type=compress_type)
+
+    def write_to_zip(self, file_path, data):
+        self.thread_safe_write_to_zip(file_path, data)
 
     def export_metadata(self, instance, metadata_path, metadata_fields):
         metadata_list = [
@@ -135,14 +232,14 @@ class BaseExport(object):
             'instance': instance,
             'metadata_list': metadata_list
         })
-        self.thread_safe_write_to_zip(metadata_path, metadata_file.encode())
+        self.write_to_zip(metadata_path, metadata_file.encode())
 
 
 class AssetExportJob(BaseExport, Job):
     job_type = jobs_registar.JOB_TYPE_ASSET_EXPORT
     queue = low_priority_queue
 
-    def run(self, year):
+    def run(self, year, ranged_downloads=True):
         s3_key = annual_asset_zip_s3_key(self.job_tracker.desk, year)
 
         # The asset zip already exists, and is not the current year, don't generate it again
@@ -151,32 +248,159 @@ class AssetExportJob(BaseExport, Job):
 
         self.year = year
 
-        self.open_zip_file()
-
-        self.export_assets_for_year()
-
-        # Finalize and upload the zip archive
-        file_name = annual_asset_zip_name(year)
-        self.finalize_and_upload_zip_file(s3_key, file_name)
+        self.open_zip_file(s3_key, annual_asset_zip_name(year))
+        try:
+            if ranged_downloads:
+                self.export_assets_with_ranged_downloads()
+            else:
+                self.export_assets_for_year()
 
-    def export_assets_for_year(self):
-        # Use a thread pool for I/O bound operations (db connections & AWS connections )
-        thread_pool = SelfCleaningThreadPool(THREAD_POOL_SIZE_ASSET_DOWNLOAD)
+            # Finalize the zip archive and complete its upload
+            self.finalize_zip_file()
+        except:
+            self.abort_zip_file()
+            raise
 
+    def get_assets_for_year(self):
         # Iterate only on assets which have an actual file associated (exclude UrlAsset)
-        for asset in (Asset.objects
+        return (Asset.objects
             .filter(desk=self.job_tracker.desk)
             .filter(created_at__year=self.year)
             .exclude(file="")
             .order_by('-id')
             .iterator()
-        ):
+        )
+
+    def export_assets_for_year(self):
+        # Use a thread pool for I/O bound operations (db connections & AWS connections )
+        thread_pool = SelfCleaningThreadPool(THREAD_POOL_SIZE_ASSET_DOWNLOAD)
+
+        for asset in self.get_assets_for_year():
             thread_pool.apply_async(self.export_one_asset, [asset])
 
         thread_pool.close()
         thread_pool.join()
 
+    def export_assets_with_ranged_downloads(self):
+        """
+        Each asset file is downloaded with parallel ranged GETs, into the RAM if it's small enough,
+        or else into a temporary file.
+        The downloaded files are then appended to the archive by the single writer thread of a ZipWriterPipeline.
+        The images, videos, pdf, ... are already compressed, they are stored without compression.
+        The other files are compressed by the download threads ( see get_compress_type ).
+
+        The size of the files downloaded but not written yet is bounded, on disk and in RAM,
+        so the downloads wait for the writer when the disk is slower than the network.
+        """
+        self.timings = StageTimings()
+        self.memory_budget = ByteBudget(ASSET_EXPORT_MAX_BYTES_IN_MEMORY)
+        self.zip_pipeline = ZipWriterPipeline(
+            self.zip_file,
+            max_bytes_in_flight=ASSET_EXPORT_MAX_BYTES_IN_FLIGHT,
+            timings=self.timings
+        )
+        self.zip_pipeline.start()
+        # The parts are downloaded without any db access, no need to clean the connections
+        self.part_thread_pool = ThreadPool(THREAD_POOL_SIZE_ASSET_PART_DOWNLOAD)
+
+        thread_pool = SelfCleaningThreadPool(THREAD_POOL_SIZE_ASSET_EXPORT)
+        for asset in self.get_assets_for_year():
+            thread_pool.apply_async(self.download_one_asset, [asset])
+
+        thread_pool.close()
+        thread_pool.join()
+        self.part_thread_pool.close()
+        self.part_thread_pool.join()
+
+        # Wait for the downloaded files to be written
+        self.zip_pipeline.close()
+
+        logger.info("[AssetExportJob] Assets of {} of desk {} exported, stage timings : {}".format(
+            self.year,
+            self.job_tracker.desk.id,
+            self.timings.as_dict()
+        ))
+
+    def download_one_asset(self, asset):
+        try:
+            file_path = get_asset_paths(asset)['file_path']
+            s3_key = asset.originalpath
+
+            # The first part gives the size of the file
+            first_part, file_size = download_s3_file_range(s3_key, 0, ASSET_DOWNLOAD_PART_SIZE - 1)
+
+            with self.timings.stage('backpressure'):
+                self.zip_pipeline.budget.acquire(file_size)
+
+            in_memory = (
+                file_size <= ASSET_EXPORT_MAX_FILE_SIZE_IN_MEMORY and
+                self.memory_budget.acquire(file_size, blocking=False)
+            )
+            if in_memory:
+                file = io.BytesIO()
+                on_close = lambda: self.memory_budget.release(file_size)
+            else:
+                file = tempfile.TemporaryFile()
+                on_close = None
+
+            try:
+                with self.timings.stage('download'):
+                    self.download_asset_file(s3_key, first_part, file_size, file)
+
+                with self.timings.stage('compress'):
+                    entry = make_file_entry(file_path, file, get_asset_compress_type(asset), on_close=on_close)
+            except:
+                file.close()
+                if on_close:
+                    on_close()
+                self.zip_pipeline.budget.release(file_size)
+                raise
+
+            self.timings.increment('downloaded_assets')
+            self.zip_pipeline.put(entry, file_size)
+        except:
+            logger.error("[AssetExportJob Error]\nAsset ID : {}".format(asset.id), exc_info=True)
+            raise
+
+    def download_asset_file(self, s3_key, first_part, file_size, file):
+        """
+        Download the parts of the file concurrently, and write them at their offset in `file`
+        """
+        file_lock = threading.Lock()
+
+        def copy_part(body, offset):
+            while True:
+                data = body.read(1024 * 1024)
+                if not data:
+                    break
+                with file_lock:
+                    file.seek(offset)
+                    file.write(data)
+                offset += len(data)
+
+        def download_part(start):
+            body, _ = download_s3_file_range(s3_key, start, min(start + ASSET_DOWNLOAD_PART_SIZE, file_size) - 1)
+            copy_part(body, start)
+
+        part_results = [
+            self.part_thread_pool.apply_async(download_part, [start])
+            for start in range(ASSET_DOWNLOAD_PART_SIZE, file_size, ASSET_DOWNLOAD_PART_SIZE)
+        ]
+        copy_part(first_part, 0)
+        # Wait for all the parts before re-raising a download error, so none is written after the file is closed
+        for part_result in part_results:
+            part_result.wait()
+        for part_result in part_results:
+            part_result.get()
+
+        file.seek(0, io.SEEK_END)
+        if file.tell() != file_size:
+            raise IOError("Downloaded {} bytes of {}, expected {}".format(file.tell(), s3_key, file_size))
+
     def export_one_asset(self, asset):
+        """
+        Previous archiving, used when `ranged_downloads` is False
+        """
         try:
             asset_paths = get_asset_paths(asset)
 
@@ -188,7 +412,12 @@ class AssetExportJob(BaseExport, Job):
             # This is not optimized at all, because only one thread at a time can write to the zip file.
             # But we need to limit our RAM usage because the Heroku worker have a low RAM usage limit.
             # If we let 20 threads load all the stream into the RAM, we would quickly exceed our 500Mo limit.
-            self.thread_safe_write_to_zip(file_path, s3_file_stream, is_stream=True)
+            self.thread_safe_write_to_zip(
+                file_path,
+                s3_file_stream,
+                is_stream=True,
+                compress_type=get_asset_compress_type(asset)
+            )
 
             # Here we do not directly push the stream into the zipfile.
             # Instead, all threads download concurrently their file data in-memory,
@@ -205,6 +434,21 @@ class DeskExportFinalizeJob(BaseExport, Job):
 
     This job heavily use tasks that are I/O bound : db calls and S3 downloads.
     We use a ThreadPool to efficiently add concurrency around those I/O bound operations.
+
+    The rendered files are compressed by the render threads, then appended to the archive
+    by the single writer thread of a ZipWriterPipeline.
+
+    When `incremental` is True, the content, docx and comments of the items are cached in S3 ( compressed ),
+    and only the items that changed since the previous export are rendered again.
+    The durations of the stages are logged and saved in the JobTracker data :
+        - render : cumulated time of the render threads, compression and backpressure included
+        - compress : cumulated time spent compressing the entries
+        - backpressure : cumulated time the render threads waited for the writer
+        - write : time of the writer thread
+        - cache_download, cache_upload : cumulated time spent reading and writing the items cache
+        - export_assets, export_items, export_projects, bundle_assets : wall-clock time of each phase
+        - upload : wall-clock time to complete the upload, the archive being uploaded while it's written
+    Along with the count of rendered_items and cached_items.
     """
     job_type = jobs_registar.JOB_TYPE_DESK_EXPORT
     queue = low_priority_queue
@@ -213,33 +457,15 @@ class DeskExportFinalizeJob(BaseExport, Job):
     email_subject = export_utils.BaseXLSExportJob.email_subject
     notification_message = export_utils.BaseXLSExportJob.notification_message
 
-    def run(self, bundle_assets=True):
+    def run(self, bundle_assets=True, incremental=True):
+        self.incremental = incremental
         self.index_files = {
             'assets': OrderedDict(),
             'projects': OrderedDict(),
             'items': OrderedDict()
         }
 
-        self.open_zip_file()
-
-        # The order here is important :
-        # The items need their linkedAssets
-        # Then the project need their linkedItems & linkedAssets
-        self.export_assets()
-        self.export_items()
-        self.export_projects()
-
-        if bundle_assets:
-            for year in get_years_since_desk_creation(self.job_tracker.desk):
-                asset_zip_name = annual_asset_zip_name(year)
-                s3_zip_streamed = download_s3_file(annual_asset_zip_s3_key(self.job_tracker.desk, year))
-                self.thread_safe_write_to_zip(asset_zip_name, s3_zip_streamed, is_stream=True)
-
-        # Main index file
-        main_index = render_to_string("desk_export/index.html", {
-            'index_files': self.index_files
-        })
-        self.zip_file.writestr("index.html", main_index.encode())
+        self.timings = StageTimings()
 
         s3_key = 'export/{deskId}/{uuid}'.format(
             deskId=self.job_tracker.desk.id,
@@ -249,18 +475,70 @@ class DeskExportFinalizeJob(BaseExport, Job):
             date=arrow.get(self.job_tracker.created_at.isoformat()).format('YYYY-MM-DD')
         )
 
-        # Finalize and upload the zip archive
-        self.finalize_and_upload_zip_file(s3_key, file_name)
+        self.open_zip_file(s3_key, file_name)
+        try:
+            self.build_archive(bundle_assets)
+
+            # Finalize the zip archive and complete its upload
+            with self.timings.stage('upload'):
+                self.finalize_zip_file()
+        except:
+            self.abort_zip_file()
+            raise
+
+        timings = self.timings.as_dict()
+        logger.info("[DeskExportFinalizeJob] Desk {} exported, stage timings : {}".format(
+            self.job_tracker.desk.id,
+            timings
+        ))
 
         # Save the result in the JobTracker
         self.job_tracker.data = {
             'result_file_name': file_name,
-            'result_url': settings.AWS_S3_BASE_URL + s3_key
+            'result_url': settings.AWS_S3_BASE_URL + s3_key,
+            'timings': timings
         }
         self.job_tracker.save()
         # Notify the user that the export is finished
         self.notify_desk_export_completed()
 
+    def build_archive(self, bundle_assets):
+        self.zip_pipeline = ZipWriterPipeline(self.zip_file, timings=self.timings)
+        self.zip_pipeline.start()
+
+        # The order here is important :
+        # The items need their linkedAssets
+        # Then the project need their linkedItems & linkedAssets
+        with self.timings.stage('export_assets'):
+            self.export_assets()
+        with self.timings.stage('export_items'):
+            self.export_items()
+        with self.timings.stage('export_projects'):
+            self.export_projects()
+
+        # Wait for the rendered files to be written
+        self.zip_pipeline.close()
+
+        if bundle_assets:
+            with self.timings.stage('bundle_assets'):
+                for year in get_years_since_desk_creation(self.job_tracker.desk):
+                    asset_zip_name = annual_asset_zip_name(year)
+                    s3_zip_streamed = download_s3_file(annual_asset_zip_s3_key(self.job_tracker.desk, year))
+                    self.thread_safe_write_to_zip(asset_zip_name, s3_zip_streamed, is_stream=True)
+
+        # Main index file
+        main_index = render_to_string("desk_export/index.html", {
+            'index_files': self.index_files
+        })
+        self.zip_file.writestr("index.html", main_index.encode())
+
+    def write_to_zip(self, file_path, data):
+        self.zip_pipeline.write(file_path, data)
+
+    def render_one(self, export_one, instance):
+        with self.timings.stage('render'):
+            export_one(instance)
+
     def export_assets(self):
         # Use a thread pool for I/O bound operations (db connections & AWS connections )
         thread_pool = SelfCleaningThreadPool(THREAD_POOL_SIZE)
@@ -276,7 +554,7 @@ class DeskExportFinalizeJob(BaseExport, Job):
             )
             .iterator()
         ):
-            thread_pool.apply_async(self.export_one_asset, [asset])
+            thread_pool.apply_async(self.render_one, [self.export_one_asset, asset])
 
         thread_pool.close()
         thread_pool.join()
@@ -296,7 +574,7 @@ class DeskExportFinalizeJob(BaseExport, Job):
                 'file_path': asset_paths['file_path'],
                 'metadata_path': metadata_path
             })
-            self.thread_safe_write_to_zip(index_path, index_file.encode())
+            self.write_to_zip(index_path, index_file.encode())
             self.index_files['assets'][asset.id] = {
                 'path': index_path,
                 'name': asset.name
@@ -324,7 +602,7 @@ class DeskExportFinalizeJob(BaseExport, Job):
             )
             .iterator()
         ):
-            thread_pool.apply_async(self.export_one_project, [project])
+            thread_pool.apply_async(self.render_one, [self.export_one_project, project])
 
         thread_pool.close()
         thread_pool.join()
@@ -348,9 +626,9 @@ class DeskExportFinalizeJob(BaseExport, Job):
             metadata_path = "{path}/{name}-metadata.html".format(**format_kwargs)
             self.export_metadata(project, metadata_path, export_utils.PROJECT_METADATA_FIELDS)
             # Linked assets
-            self.thread_safe_write_to_zip("{path}/linkedAssets.txt".format(**format_kwargs), assets_export)
+            self.write_to_zip("{path}/linkedAssets.txt".format(**format_kwargs), assets_export)
             # Linked items
-            self.thread_safe_write_to_zip("{path}/linkedItems.txt".format(**format_kwargs), items_export)
+            self.write_to_zip("{path}/linkedItems.txt".format(**format_kwargs), items_export)
 
             # Index file
             index_path = "{path}/index.html".format(**format_kwargs)
@@ -362,7 +640,7 @@ class DeskExportFinalizeJob(BaseExport, Job):
                 'linked_assets_indicies': linked_assets_indicies,
                 'linked_items_indicies': linked_items_indicies
             })
-            self.thread_safe_write_to_zip(index_path, index_file.encode())
+            self.write_to_zip(index_path, index_file.encode())
             self.index_files['projects'][project.id] = {
                 'path': index_path,
                 'name': "#{} {}".format(project.id, project.name)
@@ -372,6 +650,9 @@ class DeskExportFinalizeJob(BaseExport, Job):
             raise
 
     def export_items(self):
+        self.comment_watermarks = get_comment_watermarks(self.job_tracker.desk)
+        self.content_schema_hashes = get_content_schema_hashes(self.job_tracker.desk)
+
         # Use a thread pool for I/O bound operations (db connections & AWS connections )
         thread_pool = SelfCleaningThreadPool(THREAD_POOL_SIZE)
 
@@ -390,7 +671,7 @@ class DeskExportFinalizeJob(BaseExport, Job):
             )
             .iterator()
         ):
-            thread_pool.apply_async(self.export_one_item, [item])
+            thread_pool.apply_async(self.render_one, [self.export_one_item, item])
 
         thread_pool.close()
         thread_pool.join()
@@ -404,24 +685,25 @@ class DeskExportFinalizeJob(BaseExport, Job):
             path = 'items/{id}-{name}'.format(**format_kwargs)
             format_kwargs['path'] = path
 
-            item_exporter = ItemContentExporter(item)
             assets_ids = item.assets.values_list('id', flat=True)
             assets_export = '\n'.join([str(id) for id in assets_ids])
 
-            # Item content in html
+            # Item content in html and docx, and comments
             html_content_path = "{path}/{name}.html".format(**format_kwargs)
-            self.thread_safe_write_to_zip(html_content_path, item_exporter.export_to_html().encode())
-            # Item content in docx
             docx_content_path = "{path}/{name}.docx".format(**format_kwargs)
-            self.thread_safe_write_to_zip(docx_content_path, item_exporter.export_to_docx())
-            # Item metadata in html
+            comments_path = "{path}/{name}-comments.html".format(**format_kwargs)
+            self.export_item_content(item, {
+                'content.html': html_content_path,
+                'content.docx': docx_content_path,
+                'comments.html': comments_path,
+            })
+            # Item metadata in html.
+            # Not cached, because it depends on related objects ( owners, channels, ... )
+            # whose changes do not update the item.
             metadata_path = "{path}/{name}-metadata.html".format(**format_kwargs)
             self.export_metadata(item, metadata_path, export_utils.ITEM_METADATA_FIELDS)
-            # Comments
-            comments_path = "{path}/{name}-comments.html".format(**format_kwargs)
-            self.thread_safe_write_to_zip(comments_path, self.export_item_comments(item).encode())
             # Linked assets
-            self.thread_safe_write_to_zip("{path}/linkedAssets.txt".format(**format_kwargs), assets_export)
+            self.write_to_zip("{path}/linkedAssets.txt".format(**format_kwargs), assets_export)
 
 
             # Index file
@@ -435,7 +717,7 @@ class DeskExportFinalizeJob(BaseExport, Job):
                 'comments_path': comments_path,
                 'linked_assets_indicies': linked_assets_indicies
             })
-            self.thread_safe_write_to_zip(index_path, index_file.encode())
+            self.write_to_zip(index_path, index_file.encode())
             self.index_files['items'][item.id] = {
                 'path': index_path,
                 'name': "#{} {}".format(item.id, item.title)
@@ -444,6 +726,77 @@ class DeskExportFinalizeJob(BaseExport, Job):
             logger.error("[DeskExportFinalizeJob Error]\nItem ID : {}".format(item.id), exc_info=True)
             raise
 
+    def export_item_content(self, item, content_paths):
+        """
+        Write the rendered files of an item, from the cache of the previous exports when the item did not change.
+
+        Args:
+            content_paths: the archive paths, by name of the rendered files
+        """
+        fingerprint = get_item_export_fingerprint(
+            item,
+            self.comment_watermarks.get(item.id),
+            self.content_schema_hashes.get(item.item_type_id)
+        )
+        cache_key = item_export_cache_s3_key(item)
+
+        cached_entries = self.load_cached_item_content(cache_key, fingerprint) if self.incremental else None
+        # Checked before writing anything, so the archive never get a part of the cached files
+        if cached_entries and not content_paths.keys() <= cached_entries.keys():
+            logger.warning("[DeskExportFinalizeJob] Incomplete cached export {}".format(cache_key))
+            cached_entries = None
+        if cached_entries:
+            self.timings.increment('cached_items')
+            for name, path in content_paths.items():
+                # Already compressed, appended as is
+                self.zip_pipeline.write_compressed(cached_entries[name].copy(path))
+            return
+
+        self.timings.increment('rendered_items')
+        item_exporter = ItemContentExporter(item)
+        rendered_files = {
+            'content.html': item_exporter.export_to_html().encode(),
+            'content.docx': item_exporter.export_to_docx(),
+            'comments.html': self.export_item_comments(item).encode(),
+        }
+        entries = {
+            name: self.zip_pipeline.write(content_paths[name], data)
+            for name, data in rendered_files.items()
+        }
+
+        if self.incremental:
+            self.save_cached_item_content(cache_key, fingerprint, entries)
+
+    def load_cached_item_content(self, cache_key, fingerprint):
+        """
+        Returns: the cached CompressedEntry by name, or None if the cache is missing or outdated
+        """
+        with self.timings.stage('cache_download'):
+            try:
+                # A HEAD request first, so the outdated caches are not downloaded
+                metadata, etag = get_s3_file_metadata(cache_key)
+                if metadata is None or metadata.get('fingerprint') != fingerprint:
+                    return None
+                # Fails if the cache has been replaced since the HEAD request
+                body = download_s3_file(cache_key, if_match=etag)
+                return read_compressed_entries(io.BytesIO(body.read()))
+            except Exception:
+                # The cache is only an optimization, render the item again
+                logger.warning("[DeskExportFinalizeJob] Cannot read the cached export {}".format(cache_key), exc_info=True)
+                return None
+
+    def save_cached_item_content(self, cache_key, fingerprint, entries):
+        with self.timings.stage('cache_upload'):
+            try:
+                cache_file = io.BytesIO()
+                with BufferedZipFile(cache_file, mode='w', compression=zipfile.ZIP_DEFLATED) as cache_zip_file:
+                    for name, entry in entries.items():
+                        cache_zip_file.write_compressed(entry.copy(name))
+                cache_file.seek(0)
+                upload_private_s3_file(cache_key, cache_file, {'fingerprint': fingerprint})
+            except Exception:
+                logger.warning("[DeskExportFinalizeJob] Cannot write the cached export {}".format(cache_key), exc_info=True)
+
     def export_item_comments(self, item):
         comments = get_comments_queryset(item)
 
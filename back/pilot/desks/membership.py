@@ -0,0 +1,122 @@
+import pickle
+
+from cacheout import LRUCache
+from django.db import transaction
+
+from pilot.desks.models import Desk
+from pilot.pilot_users.models import UserInDesk, UserInOrganization
+from pilot.utils.redis import redis_client
+
+__doc__ = '''
+Cache of the desk memberships, read on every request by the PilotMiddleware.
+
+A DeskConnection is the snapshot of a user membership on a desk : the desk, its organization,
+and the UserInOrganization and UserInDesk of the user, which hold its permissions.
+
+The snapshots are versioned by two counters in Redis, one for the user and one for the desk,
+incremented by the signals of the membership models, Desk and Organization ( see invalidate_memberships ).
+They are cached in Redis, shared by all the processes, and in an in-process LRU,
+so the common case is a single Redis MGET of the versions, without any SQL query.
+
+The snapshots are cached pickled, so each request get its own instances, which it may modify.
+'''
+
+MEMBERSHIP_VERSION_REDIS_KEY = 'pilot:membership_version:{}:{}'
+DESK_CONNECTION_REDIS_KEY = 'pilot:desk_connection:{}:{}'
+DESK_CONNECTION_TTL = 24 * 60 * 60
+
+# The pickled snapshots of the current process, by (user id, desk id)
+_connections_cache = LRUCache(maxsize=1024)
+
+
+class DeskConnection:
+    def __init__(self, desk, user_in_organization, user_in_desk):
+        self.desk = desk
+        self.user_in_organization = user_in_organization
+        self.user_in_desk = user_in_desk
+
+    @property
+    def organization(self):
+        return self.desk.organization
+
+    @classmethod
+    def load(cls, user_id, desk_id):
+        """
+        Returns None if the user is not a member of the desk and its organization
+        """
+        desk = Desk.objects.select_related('organization').filter(id=desk_id).first()
+        if not desk:
+            return None
+
+        user_in_organization = UserInOrganization.objects.filter(
+            user_id=user_id,
+            organization_id=desk.organization_id
+        ).first()
+        user_in_desk = UserInDesk.objects.filter(user_id=user_id, desk=desk).first()
+        if not user_in_organization or not user_in_desk:
+            return None
+
+        return cls(desk, user_in_organization, user_in_desk)
+
+
+def get_membership_versions(user_id, desk_id):
+    return tuple(redis_client.mget(
+        MEMBERSHIP_VERSION_REDIS_KEY.format('user', user_id),
+        MEMBERSHIP_VERSION_REDIS_KEY.format('desk', desk_id),
+    ))
+
+
+def increment_membership_versions(user_id=None, desk_id=None):
+    if user_id:
+        redis_client.incr(MEMBERSHIP_VERSION_REDIS_KEY.format('user', user_id))
+    if desk_id:
+        redis_client.incr(MEMBERSHIP_VERSION_REDIS_KEY.format('desk', desk_id))
+
+
+def invalidate_memberships(user_id=None, desk_id=None):
+    """
+    Invalidate the cached memberships of a user, or on a desk, in all the processes.
+
+    Once now, for the current transaction, and once committed,
+    for a snapshot loaded meanwhile by another process from the previous state of the database.
+    """
+    increment_membership_versions(user_id, desk_id)
+    transaction.on_commit(lambda: increment_membership_versions(user_id, desk_id))
+
+
+def load_desk_connection(user_id, desk_id):
+    versions = get_membership_versions(user_id, desk_id)
+    cache_key = (user_id, desk_id)
+
+    cached = _connections_cache.get(cache_key)
+    if cached is None or cached[0] != versions:
+        redis_key = DESK_CONNECTION_REDIS_KEY.format(user_id, desk_id)
+        pickled = redis_client.get(redis_key)
+        cached = pickle.loads(pickled) if pickled else None
+
+        if cached is None or cached[0] != versions:
+            # The versions are read before the database,
+            # so a change made meanwhile invalidates this snapshot right away
+            cached = (versions, pickle.dumps(DeskConnection.load(user_id, desk_id)))
+            redis_client.set(redis_key, pickle.dumps(cached), ex=DESK_CONNECTION_TTL)
+
+        _connections_cache.set(cache_key, cached)
+
+    return pickle.loads(cached[1])
+
+
+def get_desk_connection(user, desk_id, session=None):
+    """
+    Returns the DeskConnection of the user on the desk, or None if the user is not a member.
+    When the session is given, also cached on it for the current request.
+    """
+    if session is None:
+        return load_desk_connection(user.id, desk_id)
+
+    request_cache = getattr(session, '_desk_connections', None)
+    if request_cache is None:
+        request_cache = session._desk_connections = {}
+    cache_key = (user.id, desk_id)
+    if cache_key not in request_cache:
+        request_cache[cache_key] = load_desk_connection(user.id, desk_id)
+    return request_cache[cache_key]
@@ -0,0 +1,35 @@
+from pilot.desks.models import Desk
+from pilot.desks.membership import invalidate_memberships
+from pilot.organizations.models import Organization
+from pilot.pilot_users.models import PilotUser
+
+
+def invalidate_user_memberships(sender, instance, **kwargs):
+    """
+    The desk or organization membership of a user has been modified ( UserInDesk, UserInOrganization )
+    """
+    invalidate_memberships(user_id=instance.user_id)
+
+
+def invalidate_desk_memberships(sender, instance, **kwargs):
+    invalidate_memberships(desk_id=instance.id)
+
+
+def invalidate_organization_memberships(sender, instance, **kwargs):
+    for desk_id in instance.desks.values_list('id', flat=True):
+        invalidate_memberships(desk_id=desk_id)
+
+
+def invalidate_members_memberships(sender, instance, action, **kwargs):
+    """
+    Handle the PilotUser.desks and PilotUser.organizations m2m, from both sides
+    """
+    if not action.startswith('post_'):
+        return
+
+    if isinstance(instance, PilotUser):
+        invalidate_memberships(user_id=instance.id)
+    elif isinstance(instance, Desk):
+        invalidate_desk_memberships(sender, instance)
+    elif isinstance(instance, Organization):
+        invalidate_organization_memberships(sender, instance)
@@ -0,0 +1,83 @@
+import io
+from multiprocessing.pool import ThreadPool
+
+import mock
+from django.test import SimpleTestCase
+
+from pilot.desks import jobs
+from pilot.desks.jobs import AssetExportJob, DeskExportFinalizeJob
+from pilot.utils.stream_zipfile import StageTimings
+
+
+class FakeBody(object):
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def read(self, size):
+        return self.stream.read(size)
+
+
+class AssetExportJobTests(SimpleTestCase):
+    def setUp(self):
+        self.file_data = bytes(range(256)) * 1000
+
+        def download_s3_file_range(key, start, end):
+            return FakeBody(self.file_data[start:end + 1]), len(self.file_data)
+
+        patcher = mock.patch('pilot.desks.jobs.download_s3_file_range', side_effect=download_s3_file_range)
+        self.mock_download = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch.object(jobs, 'ASSET_DOWNLOAD_PART_SIZE', 10000)
+    def test_download_asset_file_by_ranges(self):
+        job = AssetExportJob(rq_job=None, job_tracker=None)
+        job.part_thread_pool = ThreadPool(4)
+
+        first_part, file_size = jobs.download_s3_file_range('key', 0, jobs.ASSET_DOWNLOAD_PART_SIZE - 1)
+        file = io.BytesIO()
+        job.download_asset_file('key', first_part, file_size, file)
+        job.part_thread_pool.close()
+
+        self.assertEqual(file.getvalue(), self.file_data)
+        # The first part, then 25 parallel ranges
+        self.assertEqual(self.mock_download.call_count, 26)
+
+
+class DeskExportFinalizeJobTests(SimpleTestCase):
+    def setUp(self):
+        self.job = DeskExportFinalizeJob.__new__(DeskExportFinalizeJob)
+        self.job.incremental = True
+        self.job.comment_watermarks = {}
+        self.job.content_schema_hashes = {}
+        self.job.timings = StageTimings()
+        self.job.zip_pipeline = mock.Mock()
+        self.job.export_item_comments = mock.Mock(return_value='')
+        self.job.save_cached_item_content = mock.Mock()
+        self.content_paths = {name: f'items/1/{name}' for name in ('content.html', 'content.docx', 'comments.html')}
+
+        for name in ('get_item_export_fingerprint', 'item_export_cache_s3_key', 'ItemContentExporter'):
+            patcher = mock.patch.object(jobs, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_cached_item_content(self):
+        self.job.load_cached_item_content = mock.Mock(
+            return_value={name: mock.Mock() for name in self.content_paths}
+        )
+        self.job.export_item_content(mock.Mock(id=1), self.content_paths)
+
+        self.assertEqual(self.job.zip_pipeline.write_compressed.call_count, 3)
+        self.job.zip_pipeline.write.assert_not_called()
+        self.assertEqual(self.job.timings.counters['cached_items'], 1)
+
+    def test_incomplete_cached_item_content(self):
+        # The docx is missing, the item is rendered again
+        self.job.load_cached_item_content = mock.Mock(
+            return_value={'content.html': mock.Mock(), 'comments.html': mock.Mock()}
+        )
+        self.job.export_item_content(mock.Mock(id=1), self.content_paths)
+
+        self.job.zip_pipeline.write_compressed.assert_not_called()
+        self.assertEqual(self.job.zip_pipeline.write.call_count, 3)
+        self.assertEqual(self.job.timings.counters['rendered_items'], 1)
+        self.job.save_cached_item_content.assert_called_once()
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.test import TestCase
+
+from pilot.desks.membership import DESK_CONNECTION_REDIS_KEY, get_desk_connection
+from pilot.desks.utils import connect_to_desk, get_current_desk
+from pilot.pilot_users.models import PERMISSION_RESTRICTED_EDITORS, UserInDesk
+from pilot.pilot_users.tests import factories as pilot_users_factories
+from pilot.utils.redis import redis_client
+from pilot.utils.test import PilotAdminUserMixin
+
+
+class Session(dict):
+    pass
+
+
+class DeskConnectionCacheTest(PilotAdminUserMixin, TestCase):
+    def tearDown(self):
+        redis_client.delete(DESK_CONNECTION_REDIS_KEY.format(self.user.id, self.desk.id))
+
+    def connect(self):
+        # A new session object, as for a new request
+        session = Session({settings.SESSION_CURRENT_DESK_ID: self.desk.id})
+        desk = get_current_desk(self.user, session)
+        connect_to_desk(desk, user=self.user, session=session)
+        return desk
+
+    def test_cached_connection(self):
+        self.connect()
+
+        with self.assertNumQueries(0):
+            desk = self.connect()
+        self.assertEqual(desk, self.desk)
+        self.assertTrue(self.user.permissions.is_admin)
+
+    def test_invalidated_on_permission_change(self):
+        self.connect()
+
+        user_in_desk = UserInDesk.objects.get(user=self.user, desk=self.desk)
+        user_in_desk.permission = PERMISSION_RESTRICTED_EDITORS
+        user_in_desk.save()
+
+        self.connect()
+        self.assertTrue(self.user.permissions.is_restricted_editor)
+
+    def test_not_a_member(self):
+        other_user = pilot_users_factories.PilotUserFactory.create()
+        self.assertIsNone(get_desk_connection(other_user, self.desk.id))
@@ -1,11 +1,11 @@
 from django.utils.translation import ugettext as _
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
+from django.core.exceptions import PermissionDenied
 from django.http import Http404
 from django.contrib.auth import logout as auth_logout
 
+from pilot.desks.membership import get_desk_connection
 from pilot.items.models import EditSession
-from pilot.pilot_users.models import UserInOrganization, UserInDesk
 
 
 class DeskNotFound(Exception):
@@ -28,20 +28,14 @@ def connect_to_desk(desk, request=None, user=None, session=None):
         user = request.user
         session = request.session
 
-    organization = desk.organization
-
-    try:
-        user_in_organization = UserInOrganization.objects.get(
-            user=user,
-            organization=organization
-        )
-        user_in_desk = UserInDesk.objects.get(
-            user=user,
-            desk=desk
-        )
-    except ObjectDoesNotExist:
+    # The membership, cached across the requests ( see pilot.desks.membership )
+    connection = get_desk_connection(user, desk.id, session)
+    if connection is None:
         raise PermissionDenied(_("Cet utilisateur n'est pas autorisé à se connecter à ce desk"))
 
+    desk = connection.desk
+    organization = connection.organization
+
     if not organization.is_active:
         auth_logout(request)
         raise PermissionDenied(_("Ce compte est inactif"))
@@ -50,15 +44,17 @@ def connect_to_desk(desk, request=None, user=None, session=None):
         auth_logout(request)
         raise PermissionDenied(_("Ce compte est inactif"))
 
-    user.set_desk_connection(user_in_organization, user_in_desk)
+    user.set_desk_connection(connection.user_in_organization, connection.user_in_desk)
 
     if request:
-        request.organization = desk.organization
+        request.organization = organization
         request.desk = desk
 
     # If the connection is succesful, we must update the session key
-    # to continue to connect to this desk in subsequent requests
-    session[settings.SESSION_CURRENT_DESK_ID] = desk.id
+    # to continue to connect to this desk in subsequent requests.
+    # Only when it changes, to not save the session on every request.
+    if session.get(settings.SESSION_CURRENT_DESK_ID) != desk.id:
+        session[settings.SESSION_CURRENT_DESK_ID] = desk.id
 
 
 def get_current_desk(user, session):
@@ -67,11 +63,10 @@ def get_current_desk(user, session):
     """
     current_desk_id = session.get(settings.SESSION_CURRENT_DESK_ID)
     if current_desk_id:
-        try:
-            return user.desks.get(id=current_desk_id)
-        except ObjectDoesNotExist:
-            # User may have lost access to this desk. We'll fall back on the first desk
-            pass
+        connection = get_desk_connection(user, current_desk_id, session)
+        if connection:
+            return connection.desk
+        # User may have lost access to this desk. We'll fall back on the first desk
 
     # Default to returning the first active desk we find
     return user.desks.order_by('pk').filter(is_active=True).first()
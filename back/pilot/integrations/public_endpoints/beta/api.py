@@ -7,7 +7,7 @@ from pilot.channels.models import Channel
 from pilot.item_types.models import ItemType
 from pilot.items.models import Item
 from pilot.projects.models import Project
-from pilot.utils.api import PilotPageNumberPagination
+from pilot.utils.api import PilotKeysetPagination
 
 from pilot.integrations import authentication
 from pilot.integrations import throttling
@@ -16,7 +16,7 @@ from pilot.utils.projel.hierarchy import get_items_paths
 from pilot.workflow.models import WorkflowState
 
 
-class IntegrationsPagination(PilotPageNumberPagination):
+class IntegrationsPagination(PilotKeysetPagination):
     page_size = 10
     max_page_size = 100
     page_size_query_param = 'page_size'
@@ -214,7 +214,8 @@ class ItemContentValueConverter(object):
         self.is_asset = self.content_field.type == ASSET_TYPE
 
         # Optimize multiple calls by caching conversion result.
-        # Currently, this is only used in the desk export feature
+        # Currently, this is only used in the desk export feature.
+        # The prosemirror conversions are also cached across instances, see pilot.utils.prosemirror.cache
         self._serialization_cache = {}
 
     def __str__(self):
@@ -41,7 +41,7 @@ class ItemAdmin(admin.ModelAdmin):
         'item_type__name',
     )
     ordering = ['-updated_at']
-    exclude = ('search_vector', 'partial_search_document')
+    exclude = ('search_vector', 'partial_search_document', 'search_document_digest')
     raw_id_fields = (
         'copied_from',
         'created_by',
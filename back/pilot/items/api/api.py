@@ -1,10 +1,7 @@
-import datetime
-
 from django.contrib.postgres.fields.jsonb import KeyTextTransform
 from django.db import transaction
 from django.db.models import Q, Prefetch
 from django.utils import timezone
-from django.utils.dateparse import parse_date
 from django.utils.translation import ugettext as _
 
 from rest_framework import generics, status, viewsets, mixins
@@ -17,27 +14,32 @@ from rest_framework.decorators import action
 from pilot.accounts.usage_limit import ItemUsageLimit, UsageLimitReached
 from pilot.activity_stream.comment import create_comment_and_activity
 from pilot.item_types.models import ItemType
-from pilot.items.api.filters import ItemFilter
+from pilot.items.api.filters import ItemFilter, filter_on_task_date, limit_queryset_in_time
 from pilot.items.api.light_serializers import EditSessionLightSerializer
 from pilot.items.api.serializers import EditSessionSerializer, ItemCalendarSerializer, ItemInaccessibleSerializer, \
     ItemListSerializer, \
     ItemSerializer
 from pilot.items.jobs import AllItemsXLSExportJob
 from pilot.items.models import EditSession, Item
-from pilot.itemsfilters.models import SavedFilter
 
+from pilot.activity_stream.jobs import bulk_create_activities, make_activity
 from pilot.activity_stream.models import Activity
+from pilot.items.signals import reindex_items
+from pilot.items.visibility import refresh_items_visibilities
+from pilot.notifications.jobs import schedule_notify_saved_filter_bulk
 from pilot.notifications.models import Reminder
 from pilot.pilot_users.api.serializers import PilotUserLightSerializer
 from pilot.realtime.broadcasting import broadcaster
-from pilot.realtime.items import ItemContentUpdater
+from pilot.realtime.items import ItemContentUpdater, item_changes_compacted
+from pilot.realtime.oplog import apply_pending_changes
 from pilot.utils import api as api_utils, diff, states
 from pilot.utils.copy_utils import copy_item
-from pilot.utils.perms.private_items import user_can_access_item
-from pilot.utils.projel.hierarchy import HierarchyConsistencyJob, apply_picked_channels, projels_for_item
+from pilot.utils.perms.private_items import filter_accessible_items, user_can_access_item
+from pilot.utils.projel.hierarchy import HierarchyConsistencyJob, apply_picked_channels, get_projel_key, \
+    merge_hierarchy_changes, projels_for_item
 
 
-class ItemPagination(api_utils.PilotPageNumberPagination):
+class ItemPagination(api_utils.PilotKeysetPagination):
     page_size = 30
     page_size_query_param = 'page_size'
 
@@ -189,7 +191,13 @@ class ItemViewSet(api_utils.ActivityModelMixin,
             ))
             self.activity_update_verb = Activity.VERB_UNFROZEN
 
-        serializer.save(**update_kwargs)
+        # Live-edit changes not compacted yet must be applied before, so they're not lost or applied on top
+        if {'content', 'annotations', 'field_versions'} & set(serializer.validated_data):
+            with item_changes_compacted(item.id):
+                item.refresh_from_db(fields=['json_content', 'annotations', 'field_versions'])
+                serializer.save(**update_kwargs)
+        else:
+            serializer.save(**update_kwargs)
 
         apply_picked_channels(item, self.request.data.get('picked_channels'))
 
@@ -199,7 +207,7 @@ class ItemViewSet(api_utils.ActivityModelMixin,
         # Make a symmetric difference between the two sets, to update only the affected projels ( added or removed )
         affected_projels = projels_before ^ projels_after
         if affected_projels:
-            HierarchyConsistencyJob.launch_r(self.request, affected_projels)
+            HierarchyConsistencyJob.launch_r(self.request, affected_projels, item_ids=[item.id])
 
         # Fetch a fresh Item instance, so the serializer have up to date data for its nested serializers
         # which may have been updated.
@@ -214,7 +222,10 @@ class ItemViewSet(api_utils.ActivityModelMixin,
         We can retrieve any accessible items : idea, trash, confirmed...
         '''
         self.base_queryset = Item.accessible_objects
-        return super(ItemViewSet, self).retrieve(request, *args, **kwargs)
+        item = self.get_object()
+        # Include the live-edit changes not compacted yet
+        apply_pending_changes(item)
+        return Response(self.get_serializer(item).data)
 
     @action(detail=False, base_queryset=Item.in_trash_objects)
     def trash_list(self, request, *args, **kwargs):
@@ -356,13 +367,16 @@ class ItemViewSet(api_utils.ActivityModelMixin,
             item=item
         )
 
-        with transaction.atomic():
-            item.restore_session(request.user, session)
-            self.create_activity(
-                verb=Activity.VERB_RESTORED,
-                target=item,
-                action_object=session
-            )
+        with item_changes_compacted(item.id):
+            # Reload the content after the compaction
+            item = self.get_object()
+            with transaction.atomic():
+                item.restore_session(request.user, session)
+                self.create_activity(
+                    verb=Activity.VERB_RESTORED,
+                    target=item,
+                    action_object=session
+                )
 
         broadcaster.broadcast_item(
             item_id=item.id,
@@ -383,6 +397,12 @@ class ItemViewSet(api_utils.ActivityModelMixin,
             'copy': self.action_copy,
         }
 
+    def get_bulk_queryset_action_handlers(self):
+        return {
+            'trash': self.bulk_action_trash,
+            'update': self.bulk_action_update,
+        }
+
     def action_trash(self, item, params={}):
         if not user_can_access_item(self.request, item):
             return
@@ -433,86 +453,149 @@ class ItemViewSet(api_utils.ActivityModelMixin,
         copy_item(item=item, created_by=self.request.user)
 
     # ===================
-    # Helpers
+    # Set-wise bulk actions
     # ===================
 
-    def filter_on_task_date(self, queryset, start=None, end=None, on=None):
+    # The params of a bulk update that can be applied set-wise, with their serializer source
+    bulk_update_foreign_keys = {'project_id': 'project_id'}
+    bulk_update_m2m_fields = {'channels_id': 'channels', 'owners_id': 'owners', 'tags_id': 'tags', 'targets_id': 'targets'}
+
+    def get_bulk_items(self, queryset, *prefetch_lookups):
         """
-        Helper function that generate the filtering on dates depending on :
-           * The state dates on which to apply the lookup (depends on self.is_calendar)
-           * The start, end, on date
+        The accessible items of a bulk action, fetched without the prefetches of the detail API
         """
-        if on:
-            # We have an exact date, so it will be an exact day lookup
-            lookup_type = "exact"
-            lookup_value = on
-
-        if start and end:
-            # We have a start and an end, so it will be a date range lookup
-            lookup_type = "range"
-            lookup_value = (start, end)
-        elif start:
-            # We have a start only, so it will be a greater than lookup
-            lookup_type = "gte"
-            lookup_value = start
-        elif end:
-            # We have a end only, so it will be a lesser than lookup
-            lookup_type = "lte"
-            lookup_value = end
-
-        query = Q(**{'tasks__deadline__date__' + lookup_type: lookup_value})
-
-        # Decide on which kind of task we should filter
-        if self.is_calendar:
-            # Any task
-            return queryset.filter(query)
-        else:
-            # Publication task only
-            return queryset.filter(query, tasks__is_publication=True)
+        item_ids = list(
+            filter_accessible_items(self.request, queryset)
+            .prefetch_related(None)
+            .order_by()
+            .values_list('id', flat=True)
+        )
+        return list(
+            Item.all_the_objects
+            .filter(id__in=item_ids)
+            .select_related('project')
+            .prefetch_related('channels', *prefetch_lookups)
+        )
 
-    def limit_queryset_in_time(self, queryset):
+    def after_bulk_action(self, items, activities, hierarchy_changes):
         """
-        Limit the queryset in time.
-        Searches for `start`,`end`, `period`, `on` parameters in the query string.
+        The side effects of the saves, batched for all the items updated set-wise
+        """
+        item_ids = [item.id for item in items]
+        bulk_create_activities(activities)
+        schedule_notify_saved_filter_bulk(Item, item_ids)
+        reindex_items(item_ids)
+        # The project, channels and owners are updated without any signal
+        refresh_items_visibilities(item_ids)
+        HierarchyConsistencyJob.launch_changes(self.request.desk, self.request.user, hierarchy_changes)
+
+    def bulk_action_trash(self, queryset, params={}):
+        items = self.get_bulk_items(queryset)
+        Item._base_manager.filter(id__in=[item.id for item in items]).update(
+            in_trash=True,
+            updated_by=self.request.user,
+            updated_at=timezone.now()
+        )
 
-        The `start`, `end` and `on` parameters must be '%Y-%m-%d' formatted:
-            start: str, '%Y-%m-%d' formatted, e.g. 2013-11-10
-            end: str, '%Y-%m-%d' formatted, e.g. 2013-11-10
+        activities = []
+        hierarchy_changes = {}
+        for item in items:
+            activities.append(
+                make_activity(self.get_actor(), self.request.desk, Activity.VERB_PUT_IN_TRASH, target=item)
+            )
+            for projel in projels_for_item(item):
+                merge_hierarchy_changes(hierarchy_changes, get_projel_key(projel), [item.id])
+
+        self.after_bulk_action(items, activities, hierarchy_changes)
+
+    def bulk_action_update(self, queryset, params={}):
+        supported_params = set(self.bulk_update_foreign_keys) | set(self.bulk_update_m2m_fields)
+        if not set(params) <= supported_params:
+            return False
+
+        serializer = self.get_serializer(data=params, partial=True)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+
+        m2m_fields = [
+            Item._meta.get_field(source)
+            for param, source in self.bulk_update_m2m_fields.items()
+            if param in params
+        ]
+        items = self.get_bulk_items(queryset, *[field.name for field in m2m_fields])
+        item_ids = [item.id for item in items]
+
+        # The state before the update, for the activities and the hierarchies
+        projels_before = {item.id: projels_for_item(item) for item in items}
+        project_before = {item.id: item.project for item in items}
+        m2m_before = {
+            (item.id, field.name): list(getattr(item, field.name).all())
+            for item in items
+            for field in m2m_fields
+        }
+
+        update_kwargs = dict(updated_by=self.request.user, updated_at=timezone.now())
+        if 'project_id' in validated_data:
+            update_kwargs['project_id'] = validated_data['project_id']
+        Item._base_manager.filter(id__in=item_ids).update(**update_kwargs)
+
+        # Same as a M2M set() on each item : remove the other relations, add the missing ones
+        m2m_after = {}
+        for field in m2m_fields:
+            related_ids = validated_data.get(field.name) or []
+            through = field.remote_field.through
+            item_column = field.m2m_field_name()
+            related_column = field.m2m_reverse_field_name()
+            (
+                through.objects
+                .filter(**{f'{item_column}_id__in': item_ids})
+                .exclude(**{f'{related_column}_id__in': related_ids})
+                .delete()
+            )
+            through.objects.bulk_create(
+                [
+                    through(**{f'{item_column}_id': item_id, f'{related_column}_id': related_id})
+                    for item_id in item_ids
+                    for related_id in related_ids
+                ],
+                ignore_conflicts=True
+            )
+            m2m_after[field.name] = list(field.related_model._base_manager.filter(id__in=related_ids))
+
+        activities = []
+        hierarchy_changes = {}
+        for item in Item.all_the_objects.filter(id__in=item_ids).select_related('project').prefetch_related('channels'):
+            item_diff = [
+                diff.get_related_field_diff('project', project_before[item.id], item.project)
+            ] if 'project_id' in validated_data else []
+            item_diff += [
+                diff.get_related_field_diff(field.name, m2m_before[(item.id, field.name)], m2m_after[field.name])
+                for field in m2m_fields
+            ]
+            activities.append(make_activity(
+                self.get_actor(),
+                self.request.desk,
+                self.activity_update_verb,
+                target=item,
+                diff=[field_diff for field_diff in item_diff if field_diff]
+            ))
 
-        The `period` parameter must be an integer and must be in hours.
+            # Only the projels the item has been added to or removed from
+            for projel in projels_before[item.id] ^ projels_for_item(item):
+                merge_hierarchy_changes(hierarchy_changes, get_projel_key(projel), [item.id])
 
-        If `start` and `end` are found, limits the queryset to items between start and end.
-        If `on` is found, limits the queryset to items which happens on that day.
-        If `period` is found, limits the queryset to now + timedelta(hours=period)
-        If none of `start`, `end` or `on` are found, and `self.is_calendar` is True,
-        will default to the current month
-        """
-        start = parse_date(self.request.query_params.get('start', ''))
-        end = parse_date(self.request.query_params.get('end', ''))
-        on = parse_date(self.request.query_params.get('on', ''))
-
-        if start or end or on:
-            return self.filter_on_task_date(queryset, start, end, on)
-        elif self.is_calendar:
-            # Fallback to the current month range when fallback_to_month is True
-            # and start/end are not both specified
-            today = datetime.date.today()
-            start = today.replace(day=1)
-            end = start + datetime.timedelta(days=31)
-            return self.filter_on_task_date(queryset, start, end)
+        self.after_bulk_action(items, activities, hierarchy_changes)
+        broadcaster.broadcast_items(item_ids, self.request.user.id)
 
-        try:
-            period_in_hours = int(self.request.query_params.get('period', None))
-        except (TypeError, ValueError):
-            return queryset
+    # ===================
+    # Helpers
+    # ===================
 
-        allowed_hours = [choice[0] for choice in SavedFilter.PERIOD_CHOICES if choice[0]]
-        if period_in_hours and period_in_hours in allowed_hours:
-            start = datetime.date.today()
-            end = start + datetime.timedelta(hours=period_in_hours)
-            return self.filter_on_task_date(queryset, start, end)
+    def filter_on_task_date(self, queryset, start=None, end=None, on=None):
+        return filter_on_task_date(queryset, start, end, on, is_calendar=self.is_calendar)
 
-        return queryset
+    def limit_queryset_in_time(self, queryset):
+        return limit_queryset_in_time(queryset, self.request.query_params, is_calendar=self.is_calendar)
 
 
 class SharedItemViewSet(api_utils.SharedApiMixin,
@@ -1,7 +1,10 @@
+import datetime
 import json
 
 from django.contrib.postgres.fields.jsonb import KeyTextTransform
+from django.db.models import Q
 from django.db.models.expressions import OuterRef, Subquery
+from django.utils.dateparse import parse_date
 from django.utils.translation import ugettext_lazy as _
 
 import django_filters
@@ -11,6 +14,7 @@ from django_filters.constants import EMPTY_VALUES
 from pilot.channels.models import Channel
 from pilot.item_types.models import ItemType
 from pilot.items.models import Item
+from pilot.itemsfilters.models import SavedFilter
 from pilot.labels.models import Label
 from pilot.pilot_users.models import PilotUser
 from pilot.projects.models import Project
@@ -176,3 +180,83 @@ class ItemFilter(SearchFilterSetMixin, FilterSet):
         folder_path = json.loads(value)
         item_ids = get_items_in_folder(projel.hierarchy, folder_path)
         return queryset.filter(id__in=item_ids)
+
+
+def filter_on_task_date(queryset, start=None, end=None, on=None, is_calendar=False):
+    """
+    Helper function that generate the filtering on dates depending on :
+       * The state dates on which to apply the lookup (depends on is_calendar)
+       * The start, end, on date
+    """
+    if on:
+        # We have an exact date, so it will be an exact day lookup
+        lookup_type = "exact"
+        lookup_value = on
+
+    if start and end:
+        # We have a start and an end, so it will be a date range lookup
+        lookup_type = "range"
+        lookup_value = (start, end)
+    elif start:
+        # We have a start only, so it will be a greater than lookup
+        lookup_type = "gte"
+        lookup_value = start
+    elif end:
+        # We have a end only, so it will be a lesser than lookup
+        lookup_type = "lte"
+        lookup_value = end
+
+    query = Q(**{'tasks__deadline__date__' + lookup_type: lookup_value})
+
+    # Decide on which kind of task we should filter
+    if is_calendar:
+        # Any task
+        return queryset.filter(query)
+    else:
+        # Publication task only
+        return queryset.filter(query, tasks__is_publication=True)
+
+
+def limit_queryset_in_time(queryset, query_params, is_calendar=False):
+    """
+    Limit the queryset in time.
+    Searches for `start`,`end`, `period`, `on` parameters in the query string.
+
+    The `start`, `end` and `on` parameters must be '%Y-%m-%d' formatted:
+        start: str, '%Y-%m-%d' formatted, e.g. 2013-11-10
+        end: str, '%Y-%m-%d' formatted, e.g. 2013-11-10
+
+    The `period` parameter must be an integer and must be in hours.
+
+    If `start` and `end` are found, limits the queryset to items between start and end.
+    If `on` is found, limits the queryset to items which happens on that day.
+    If `period` is found, limits the queryset to now + timedelta(hours=period)
+    If none of `start`, `end` or `on` are found, and `is_calendar` is True,
+    will default to the current month
+    """
+    start = parse_date(query_params.get('start', ''))
+    end = parse_date(query_params.get('end', ''))
+    on = parse_date(query_params.get('on', ''))
+
+    if start or end or on:
+        return filter_on_task_date(queryset, start, end, on, is_calendar)
+    elif is_calendar:
+        # Fallback to the current month range when fallback_to_month is True
+        # and start/end are not both specified
+        today = datetime.date.today()
+        start = today.replace(day=1)
+        end = start + datetime.timedelta(days=31)
+        return filter_on_task_date(queryset, start, end, is_calendar=is_calendar)
+
+    try:
+        period_in_hours = int(query_params.get('period', None))
+    except (TypeError, ValueError):
+        return queryset
+
+    allowed_hours = [choice[0] for choice in SavedFilter.PERIOD_CHOICES if choice[0]]
+    if period_in_hours and period_in_hours in allowed_hours:
+        start = datetime.date.today()
+        end = start + datetime.timedelta(hours=period_in_hours)
+        return filter_on_task_date(queryset, start, end, is_calendar=is_calendar)
+
+    return queryset
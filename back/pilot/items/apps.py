@@ -1,4 +1,4 @@
-from django.db.models.signals import post_save, m2m_changed
+from django.db.models.signals import post_init, post_save, pre_delete, m2m_changed
 from django.apps import AppConfig
 
 
@@ -7,9 +7,22 @@ class ItemAppConfig(AppConfig):
     verbose_name = 'Items'
 
     def ready(self):
+        from pilot.channels.models import Channel
         from pilot.items.models import Item
-        from pilot.items import signals
+        from pilot.items import signals, visibility
+        from pilot.projects.models import Project
         post_save.connect(signals.reindex_item, sender=Item)
 
         for m2m_field in (Item.targets, Item.assets, Item.owners, Item.tags):
             m2m_changed.connect(signals.reindex_item, sender=m2m_field.through)
+
+        # The ItemVisibility table, used to filter the items of the restricted editors
+        post_init.connect(visibility.record_item_visibility_columns, sender=Item)
+        post_save.connect(visibility.refresh_on_item_saved, sender=Item)
+        m2m_changed.connect(visibility.refresh_on_item_owners_changed, sender=Item.owners.through)
+        m2m_changed.connect(visibility.refresh_on_item_channels_changed, sender=Item.channels.through)
+        for m2m_field in (Project.owners, Project.members):
+            m2m_changed.connect(visibility.refresh_on_project_users_changed, sender=m2m_field.through)
+        m2m_changed.connect(visibility.refresh_on_channel_users_changed, sender=Channel.owners.through)
+        for projel_model in (Project, Channel):
+            pre_delete.connect(visibility.refresh_on_projel_deleted, sender=projel_model)
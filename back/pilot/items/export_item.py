@@ -3,6 +3,7 @@ from io import BytesIO
 
 from docx import Document as DocxDocument
 
+from django.db.models import prefetch_related_objects
 from django.utils.translation import ugettext_lazy as _
 from django.http import HttpResponse, HttpResponseServerError
 from django.shortcuts import get_object_or_404
@@ -115,6 +116,23 @@ class ItemContentExporter(object):
         return response
 
 
+def prefetch_last_sessions(items):
+    """
+    Fill the Item.last_session cache of the items with a single query
+    """
+    sessions = (
+        EditSession.objects
+        .filter(item__in=items)
+        .select_related('created_by', 'restored_from', 'item_type_snapshot')
+        # The latest session of each item ( DISTINCT ON is postgres-specific )
+        .order_by('item_id', '-created_at')
+        .distinct('item_id')
+    )
+    sessions_by_item_id = {session.item_id: session for session in sessions}
+    for item in items:
+        item.__dict__['last_session'] = sessions_by_item_id.get(item.id)
+
+
 class ItemXLSExporter(export_utils.BaseXLSExporter):
     model = Item
     metadata_fields = export_utils.ITEM_METADATA_FIELDS
@@ -152,6 +170,12 @@ class ItemXLSExporter(export_utils.BaseXLSExporter):
             yield export_utils.format_date(item.publication_task.deadline)
             yield export_utils.format_date_time(item.publication_task.done_at)
 
+    def prepare_chunk(self, items):
+        # publication_task will look into the prefetched tasks
+        prefetch_related_objects(items, 'tasks')
+        if self.with_content:
+            prefetch_last_sessions(items)
+
     def add_style(self):
         # Wrap the content/title column, and shift other wrapped columns by 1
         self.wrapped_columns = [1] + [i+1 for i in self.wrapped_columns]
@@ -25,8 +25,8 @@ class AllItemsXLSExportJob(export_utils.BaseXLSExportJob):
             .filter(desk=desk)
             .filter_by_permissions(user)
             .order_by('id')
-            .select_related('project', 'created_by',  'workflow_state')
-            .prefetch_related('channels', 'tasks', 'targets', 'owners', 'item_type', 'tags')
+            .select_related('project', 'created_by', 'updated_by', 'workflow_state', 'item_type')
+            .prefetch_related('channels', 'tasks', 'targets', 'owners', 'tags')
         )
         ItemXLSExporter(items, temp_file).do_export()
 
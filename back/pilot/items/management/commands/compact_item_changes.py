@@ -0,0 +1,23 @@
+import logging
+import sys
+
+from django.core.management.base import BaseCommand
+
+from pilot.realtime.items import compact_all_item_changes
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Compact the live-edit changes whose compaction has failed or has been lost
+    """
+
+    help = "Compact the live-edit changes of all the items still having a log"
+
+    def handle(self, *args, **options):
+        logger.info(f"[Cron Command Start] {' '.join(sys.argv[1:])}")
+
+        stats = compact_all_item_changes()
+
+        logger.info(f"[Cron Command End] {' '.join(sys.argv[1:])} {stats}")
@@ -0,0 +1,38 @@
+import logging
+import sys
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pilot.desks.models import Desk
+from pilot.items.visibility import reconcile_desk_visibilities
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Recompute the ItemVisibility table, to repair the changes made without signals
+    """
+
+    help = "Recompute the visibility of the items for the restricted editors"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desk',
+            type=int, nargs='+', dest='desk_ids',
+            help='Only reconcile these desks')
+
+    def handle(self, *args, **options):
+        logger.info(f"[Cron Command Start] {' '.join(sys.argv[1:])}")
+
+        desk_ids = options['desk_ids'] or Desk.objects.order_by('id').values_list('id', flat=True)
+        total_added = total_removed = 0
+        for desk_id in desk_ids:
+            with transaction.atomic():
+                added, removed = reconcile_desk_visibilities(desk_id)
+            if added or removed:
+                logger.warning(f"Item visibility of desk {desk_id} : {added} rows added, {removed} rows removed")
+            total_added += added
+            total_removed += removed
+
+        logger.info(f"[Cron Command End] {' '.join(sys.argv[1:])} {total_added} rows added, {total_removed} rows removed")
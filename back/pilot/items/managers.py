@@ -1,6 +1,6 @@
 from django.apps import apps
 from django.contrib.postgres.fields.jsonb import KeyTextTransform
-from django.db.models import Manager, OuterRef, Q, Subquery, Value
+from django.db.models import Manager, OuterRef, Subquery, Value
 from django.db.models.functions import Concat
 from django.db.models.query import QuerySet
 
@@ -29,9 +29,9 @@ class ItemQuerySet(QuerySet):
 
     def filter_by_permissions(self, user):
         if user.is_authenticated and user.permissions.is_restricted_editor:
-            return self.filter(
-                Q(created_by=user) | Q(project__owners=user) | Q(project__members=user) | Q(channels__owners=user) | Q(owners=user)
-            ).distinct()
+            # The items related to the user ( creator, owner, project owner or member, channel owner ),
+            # materialized in ItemVisibility ( see pilot.items.visibility ), so no OR of five joins and DISTINCT
+            return self.filter(visibilities__user=user)
 
         return self
 
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.14 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0029_delete_itemhistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='search_document_digest',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.14 on 2026-10-18 10:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+VISIBILITY_PATHS = ('created_by', 'owners', 'project__owners', 'project__members', 'channels__owners')
+
+
+def fill_item_visibility(apps, schema_editor):
+    Item = apps.get_model('items', 'Item')
+    ItemVisibility = apps.get_model('items', 'ItemVisibility')
+
+    for path in VISIBILITY_PATHS:
+        rows = (
+            Item._base_manager
+            .filter(**{f'{path}__isnull': False})
+            .order_by()
+            .values_list(path, 'desk_id', 'id')
+            .distinct()
+        )
+        ItemVisibility.objects.bulk_create(
+            (ItemVisibility(user_id=user_id, desk_id=desk_id, item_id=item_id) for user_id, desk_id, item_id in rows),
+            batch_size=5000,
+            ignore_conflicts=True
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('channels', '0014_channel_search_document_digest'),
+        ('desks', '0005_auto_20201030_1111'),
+        ('projects', '0011_project_search_document_digest'),
+        ('items', '0030_item_search_document_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemVisibility',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('desk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='desks.Desk')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visibilities', to='items.Item')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'item')},
+            },
+        ),
+        migrations.RunPython(fill_item_visibility, migrations.RunPython.noop),
+    ]
@@ -49,7 +49,8 @@ class Item(ItemContentMixin,
         'history',  # History is not part of the metadata
         # Search fields doesn't need to be serialized
         'search_vector',
-        'partial_search_document'
+        'partial_search_document',
+        'search_document_digest',
     )
 
     desk = models.ForeignKey(
@@ -328,6 +329,11 @@ class Item(ItemContentMixin,
 
         return search_values
 
+    @classmethod
+    def get_search_vector_update_queryset(cls):
+        # get_search_values needs the content schema of the item type
+        return cls._base_manager.select_related('item_type')
+
     def create_session(self, timestamp=None, created_by_id=None, restored_from=None):
         if not timestamp:
             timestamp = timezone.now()
@@ -575,3 +581,32 @@ class ItemStats(models.Model):
 
     def __str__(self):
         return "#{0}".format(self.items_created_num)
+
+
+class ItemVisibility(models.Model):
+    """
+    The users related to an item : its creator, its owners, the owners and members of its project,
+    and the owners of its channels.
+    A restricted editor can only access those items ( see ItemQuerySet.filter_by_permissions ).
+
+    Maintained by pilot.items.visibility, on the changes of these relations.
+    """
+    user = models.ForeignKey(
+        PilotUser,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    desk = models.ForeignKey(
+        Desk,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    item = models.ForeignKey(
+        Item,
+        on_delete=models.CASCADE,
+        related_name='visibilities'
+    )
+
+    class Meta:
+        # Also the index of the filtering join
+        unique_together = ('user', 'item')
@@ -1,21 +1,22 @@
-import logging
+from pilot.items.models import Item
+from pilot.search.indexing import schedule_es_indexing
 
-from django.conf import settings
 
-from pilot.search.api.serializers import ItemSearchDocTypeSerializer
-
-logger = logging.getLogger(__name__)
+def reindex_item(sender, instance, **kwargs):
+    # For the M2M changes, only once they're done
+    action = kwargs.get('action')
+    if action and not action.startswith('post_'):
+        return
 
+    # A M2M change made from the other side, e.g. tag.items_by_tags.add(item) : the items are in pk_set
+    if kwargs.get('reverse'):
+        schedule_es_indexing(Item, kwargs.get('pk_set') or [])
+    else:
+        schedule_es_indexing(Item, [instance.id])
 
-def reindex_item(sender, instance, **kwargs):
-    if not settings.ES_DISABLED:
-        item = instance
 
-        try:
-            settings.ES_CLIENT.index(settings.ES_ITEM_INDEX,
-                                     ItemSearchDocTypeSerializer(item).data,
-                                     id=item.id)
-        except:
-            logger.error("[ES Indexing Error] Could not index Item (id={})"
-                         "".format(item.id),
-                         exc_info=True)
+def reindex_items(item_ids):
+    """
+    Reindex the items updated without a save ( queryset update ), which don't send the post_save signal
+    """
+    schedule_es_indexing(Item, item_ids)
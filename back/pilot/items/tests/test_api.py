@@ -1,17 +1,22 @@
 import datetime
 import json
 
+import mock
 from django.urls import reverse
 from django.db.models import Min, Max
 from django.utils import timezone
 from django.utils.timezone import make_naive
-from rest_framework.test import APITestCase
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
 
 from pilot.projects.tests import factories as projects_factories
 from pilot.channels.tests import factories as channels_factories
 from pilot.desks.tests import factories as desks_factories
 from pilot.desks.models import Desk
 from pilot.item_types.tests import factories as item_types_factories
+from pilot.items.api.api import ItemPagination
+from pilot.items.models import Item
 from pilot.items.tests import factories as items_factories
 from pilot.pilot_users.tests import factories as pilot_users_factories
 from pilot.targets.tests import factories as targets_factories
@@ -23,6 +28,7 @@ from pilot.item_types.tests.testing_item_type_definition import SIMPLE_TEST_SCHE
 
 API_ITEMS_DETAIL_URL = 'api-items-detail'
 API_ITEMS_LIST_URL = 'api-items-list'
+API_ITEMS_BULK_ACTION_URL = 'api-items-bulk-action'
 
 class ItemAPIMixin(object):
     ITEM_API_READ_ONLY_FIELDS = (
@@ -382,6 +388,61 @@ class ItemApiTest(ItemAPIMixin, PilotAdminUserMixin, WorkflowStateTestingMixin,
         self.assertFalse(item.is_private)
 
 
+@mock.patch('pilot.items.api.api.broadcaster')
+class ItemBulkActionApiTest(PilotAdminUserMixin, APITestCase):
+    def setUp(self):
+        super(ItemBulkActionApiTest, self).setUp()
+        self.project = projects_factories.ProjectFactory.create(desk=self.desk)
+        self.items = items_factories.ItemFactory.create_batch(3, desk=self.desk, project=self.project)
+
+    def bulk_action(self, action, params={}):
+        return self.client.post(
+            reverse(API_ITEMS_BULK_ACTION_URL),
+            data={'ids': [item.id for item in self.items], 'action': action, 'params': params},
+            format='json'
+        )
+
+    def test_bulk_trash(self, mock_broadcaster):
+        response = self.bulk_action('trash')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Item.in_trash_objects.filter(id__in=[item.id for item in self.items]).count(), 3)
+        self.assertEqual(
+            Activity.objects.filter(verb=Activity.VERB_PUT_IN_TRASH, target_object_id__in=[item.id for item in self.items]).count(),
+            3
+        )
+
+    def test_bulk_update(self, mock_broadcaster):
+        other_project = projects_factories.ProjectFactory.create(desk=self.desk)
+        channels = channels_factories.ChannelFactory.create_batch(2, desk=self.desk)
+        self.items[0].channels.set([channels[0]])
+
+        response = self.bulk_action('update', {
+            'project_id': other_project.id,
+            'channels_id': [channel.id for channel in channels],
+        })
+        self.assertEqual(response.status_code, 204)
+
+        for item in Item.objects.filter(id__in=[item.id for item in self.items]):
+            self.assertEqual(item.project_id, other_project.id)
+            self.assertEqual(set(item.channels.all()), set(channels))
+
+        activity = Activity.objects.filter(verb=Activity.VERB_UPDATED, target_object_id=self.items[0].id).get()
+        diff_by_field = {field_diff['field_name']: field_diff for field_diff in activity.diff}
+        self.assertEqual(diff_by_field['project']['after']['id'], other_project.id)
+        self.assertEqual([channel['id'] for channel in diff_by_field['channels']['before']], [channels[0].id])
+        mock_broadcaster.broadcast_items.assert_called_once()
+
+    def test_bulk_update_fallback(self, mock_broadcaster):
+        # Not handled set-wise, updated item by item
+        response = self.bulk_action('update', {'language': 'en_US'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            set(Item.objects.filter(id__in=[item.id for item in self.items]).values_list('language', flat=True)),
+            {'en_US'}
+        )
+        mock_broadcaster.broadcast_items.assert_not_called()
+
+
 class ItemListApiTest(ItemAPIMixin, PilotAdminUserMixin,
                       WorkflowStateTestingMixin, ItemTypeTestingMixin, APITestCase):
     """ Test the API for lists of Items """
@@ -469,6 +530,60 @@ class ItemListApiTest(ItemAPIMixin, PilotAdminUserMixin,
         content = json.loads(response.content)
         self.assertTrue('language' in content['objects'][0])
 
+    def test_api_items_list_keyset_pagination(self):
+        response = self.client.get(reverse(API_ITEMS_LIST_URL), format='json')
+        expected_ids = [item['id'] for item in json.loads(response.content)['objects']]
+
+        # The first page, with an exact count
+        response = self.client.get(reverse(API_ITEMS_LIST_URL), {'cursor': '', 'page_size': 5, 'count': 'exact'})
+        content = json.loads(response.content)
+        self.assertEqual((content['count'], content['num_pages']), (17, 4))
+        self.assertIsNone(content['previous'])
+        pages = [[item['id'] for item in content['objects']]]
+
+        while content['next']:
+            response = self.client.get(reverse(API_ITEMS_LIST_URL), {'cursor': content['next'], 'page_size': 5})
+            content = json.loads(response.content)
+            self.assertIsNone(content['count'])
+            pages.append([item['id'] for item in content['objects']])
+
+        self.assertEqual([len(page) for page in pages], [5, 5, 5, 2])
+        self.assertEqual([item_id for page in pages for item_id in page], expected_ids)
+
+        # Back to the third page
+        response = self.client.get(reverse(API_ITEMS_LIST_URL), {'cursor': content['previous'], 'page_size': 5})
+        self.assertEqual([item['id'] for item in json.loads(response.content)['objects']], pages[2])
+
+        response = self.client.get(reverse(API_ITEMS_LIST_URL), {'cursor': 'invalid', 'page_size': 5})
+        self.assertEqual(response.status_code, 404)
+
+    def test_token_page_number_pagination_without_count(self):
+        queryset = Item.objects.filter(desk=self.desk).order_by('-id')
+        expected_ids = list(queryset.values_list('id', flat=True))
+
+        def paginate(page):
+            django_request = APIRequestFactory().get('/', {'page': page, 'page_size': 5})
+            force_authenticate(django_request, user=self.user, token=mock.Mock())
+            request = Request(django_request)
+            pagination = ItemPagination()
+            # A single query for the page, without any COUNT(*)
+            with self.assertNumQueries(1):
+                objects = pagination.paginate_queryset(queryset, request)
+            return [item.id for item in objects], pagination.get_paginated_response([]).data
+
+        ids, content = paginate(2)
+        self.assertEqual(ids, expected_ids[5:10])
+        self.assertEqual((content['count'], content['num_pages']), (None, None))
+        self.assertEqual((content['previous'], content['next']), (1, 3))
+
+        last_page = (len(expected_ids) - 1) // 5 + 1
+        ids, content = paginate(last_page)
+        self.assertEqual(ids, expected_ids[(last_page - 1) * 5:])
+        self.assertIsNone(content['next'])
+
+        with self.assertRaises(NotFound):
+            paginate(last_page + 1)
+
     def test_api_trash_list(self):
         """Test the 'api_trash_list' method for items in trash."""
 
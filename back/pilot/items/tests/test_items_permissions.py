@@ -1,13 +1,18 @@
 import json
 
+import mock
+from django.test import TestCase
 from django.urls import reverse
 from rest_framework.test import APITestCase
 
 from pilot.items.tests.test_api import API_ITEMS_DETAIL_URL, API_ITEMS_LIST_URL
 from pilot.projects.tests import factories as projects_factories
 from pilot.channels.tests import factories as channels_factories
+from pilot.items.models import Item, ItemVisibility
 from pilot.items.tests import factories as items_factories
-from pilot.utils.test import PilotRestrictedEditorUserMixin, prosemirror_body
+from pilot.items.visibility import reconcile_desk_visibilities
+from pilot.pilot_users.tests import factories as pilot_users_factories
+from pilot.utils.test import PilotAdminUserMixin, PilotRestrictedEditorUserMixin, prosemirror_body
 
 
 class ItemsUiTestRestrictedEditorPermsTest(PilotRestrictedEditorUserMixin, APITestCase):
@@ -175,3 +180,82 @@ class ItemsUiTestRestrictedEditorPermsDefaultTest(ItemsUiTestRestrictedEditorPer
             url = reverse(view, kwargs={'item_pk': self.item.pk})
             response = self.client.get(url)
             self.assertEqual(response.status_code, 404)
+
+
+class ItemVisibilityTest(PilotAdminUserMixin, TestCase):
+    def setUp(self):
+        super(ItemVisibilityTest, self).setUp()
+        self.other_user = pilot_users_factories.PilotUserFactory.create()
+        self.project = projects_factories.ProjectFactory.create(desk=self.desk)
+        self.channel = channels_factories.ChannelFactory.create(desk=self.desk)
+        self.item = items_factories.ItemFactory.create(desk=self.desk, created_by=self.user)
+
+    def get_visible_users(self):
+        return set(ItemVisibility.objects.filter(item=self.item).values_list('user_id', flat=True))
+
+    def test_visibility_maintenance(self):
+        self.assertEqual(self.get_visible_users(), {self.user.id})
+
+        # Project membership, from both sides
+        self.item.project = self.project
+        self.item.save()
+        self.other_user.projects_by_members.add(self.project)
+        self.assertEqual(self.get_visible_users(), {self.user.id, self.other_user.id})
+        self.project.members.clear()
+        self.assertEqual(self.get_visible_users(), {self.user.id})
+
+        # Channel ownership, and item in the channel
+        self.channel.owners.add(self.other_user)
+        self.item.channels.add(self.channel)
+        self.assertEqual(self.get_visible_users(), {self.user.id, self.other_user.id})
+        self.channel.items.clear()
+        self.assertEqual(self.get_visible_users(), {self.user.id})
+
+        # Item ownership
+        self.item.owners.add(self.other_user)
+        self.assertEqual(self.get_visible_users(), {self.user.id, self.other_user.id})
+
+        # Nothing to repair
+        self.assertEqual(reconcile_desk_visibilities(self.desk.id), (0, 0))
+
+    def test_refresh_only_when_creator_or_project_changed(self):
+        with mock.patch('pilot.items.visibility.refresh_items_visibilities') as mock_refresh:
+            # Unrelated changes, on a loaded and on a fresh instance
+            self.item.title = 'Updated'
+            self.item.save()
+            Item.objects.get(id=self.item.id).save()
+            self.assertFalse(mock_refresh.called)
+
+            item = Item.objects.get(id=self.item.id)
+            item.project = self.project
+            item.save()
+            self.assertEqual(mock_refresh.call_count, 1)
+
+            # The new project is now the recorded one
+            item.save()
+            self.assertEqual(mock_refresh.call_count, 1)
+
+            item.created_by = self.other_user
+            item.save(update_fields=['created_by'])
+            self.assertEqual(mock_refresh.call_count, 2)
+
+    def test_project_remove_items(self):
+        self.item.project = self.project
+        self.item.save()
+        self.project.members.add(self.other_user)
+        self.assertEqual(self.get_visible_users(), {self.user.id, self.other_user.id})
+
+        response = self.client.put(
+            reverse('api-projects-remove-items', kwargs={'pk': self.project.id}),
+            json.dumps({'itemIds': [self.item.id]}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.get_visible_users(), {self.user.id})
+
+    def test_reconcile(self):
+        ItemVisibility.objects.all().delete()
+        ItemVisibility.objects.create(user=self.other_user, desk=self.desk, item=self.item)
+
+        self.assertEqual(reconcile_desk_visibilities(self.desk.id), (1, 1))
+        self.assertEqual(self.get_visible_users(), {self.user.id})
@@ -0,0 +1,187 @@
+from django.db import transaction
+from django.db.models import DEFERRED
+
+from pilot.items.models import Item, ItemVisibility
+from pilot.projects.models import Project
+
+__doc__ = '''
+Maintenance of the ItemVisibility table, from which the restricted editors get their items.
+
+An item is visible to the users related to it through one of the VISIBILITY_PATHS.
+The rows of the items or users concerned by a change are recomputed in a single query,
+and only the differences are written.
+The `reconcile_item_visibility` command repairs the changes made without signals ( raw SQL, cascades... ).
+'''
+
+VISIBILITY_PATHS = ('created_by', 'owners', 'project__owners', 'project__members', 'channels__owners')
+# The columns of the Item on which the visibility depends
+VISIBILITY_COLUMNS = ('created_by_id', 'project_id')
+
+
+def compute_visibilities(items, user_ids=None):
+    """
+    Returns the set of (user_id, desk_id, item_id) of the users related to the items,
+    optionally restricted to `user_ids`
+    """
+    querysets = []
+    for path in VISIBILITY_PATHS:
+        queryset = items.order_by()
+        if user_ids is None:
+            queryset = queryset.filter(**{f'{path}__isnull': False})
+        else:
+            queryset = queryset.filter(**{f'{path}__in': user_ids})
+        querysets.append(queryset.values_list(path, 'desk_id', 'id'))
+
+    return set(querysets[0].union(*querysets[1:]))
+
+
+def sync_visibilities(existing, expected):
+    """
+    Update the `existing` ItemVisibility rows to the `expected` set of (user_id, desk_id, item_id)
+
+    Returns: the number of rows added and removed
+    """
+    existing_ids = {
+        (user_id, desk_id, item_id): visibility_id
+        for visibility_id, user_id, desk_id, item_id in existing.values_list('id', 'user_id', 'desk_id', 'item_id')
+    }
+
+    stale_ids = [visibility_id for key, visibility_id in existing_ids.items() if key not in expected]
+    if stale_ids:
+        ItemVisibility.objects.filter(id__in=stale_ids).delete()
+
+    missing = expected - existing_ids.keys()
+    ItemVisibility.objects.bulk_create(
+        [ItemVisibility(user_id=user_id, desk_id=desk_id, item_id=item_id) for user_id, desk_id, item_id in missing],
+        ignore_conflicts=True
+    )
+    return len(missing), len(stale_ids)
+
+
+def refresh_visibilities(items, user_ids=None):
+    """
+    Recompute the visibility of the items, for all the users or only for `user_ids`
+    """
+    existing = ItemVisibility.objects.filter(item__in=items)
+    if user_ids is not None:
+        existing = existing.filter(user_id__in=user_ids)
+    return sync_visibilities(existing, compute_visibilities(items, user_ids))
+
+
+def refresh_items_visibilities(item_ids):
+    return refresh_visibilities(Item._base_manager.filter(id__in=item_ids))
+
+
+def reconcile_desk_visibilities(desk_id):
+    existing = ItemVisibility.objects.filter(desk_id=desk_id)
+    expected = compute_visibilities(Item._base_manager.filter(desk_id=desk_id))
+    return sync_visibilities(existing, expected)
+
+
+# ===================
+# Signals
+# ===================
+
+
+def get_visibility_columns(instance):
+    # Without loading the deferred columns
+    return tuple(instance.__dict__.get(column, DEFERRED) for column in VISIBILITY_COLUMNS)
+
+
+def record_item_visibility_columns(sender, instance, **kwargs):
+    """
+    post_init of an Item : the loaded creator and project, to know on save if they changed
+    """
+    instance._visibility_columns = get_visibility_columns(instance)
+
+
+def refresh_on_item_saved(sender, instance, created, update_fields=None, **kwargs):
+    """
+    post_save of an Item : only when the creator or the project changed
+    """
+    if update_fields is not None and not {'created_by', 'project'} & set(update_fields):
+        return
+
+    visibility_columns = get_visibility_columns(instance)
+    if created or visibility_columns != getattr(instance, '_visibility_columns', None):
+        refresh_items_visibilities([instance.id])
+    instance._visibility_columns = visibility_columns
+
+
+def get_visible_items(user):
+    # Before a clear on the user side, the items which may be concerned
+    return Item._base_manager.filter(visibilities__user=user)
+
+
+def refresh_on_item_owners_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Item.owners, from both sides
+    """
+    if not action.startswith('post_'):
+        return
+
+    if reverse:
+        items = Item._base_manager.filter(id__in=pk_set) if pk_set is not None else get_visible_items(instance)
+        refresh_visibilities(items, [instance.id])
+    else:
+        refresh_visibilities(Item._base_manager.filter(id=instance.id), pk_set)
+
+
+def refresh_on_item_channels_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Item.channels, from both sides
+    """
+    if not action.startswith('post_'):
+        return
+
+    if reverse:
+        if pk_set is not None:
+            refresh_items_visibilities(pk_set)
+        else:
+            # The items have been removed from the channel : the visibility its owners gave may be lost
+            owner_ids = list(instance.owners.values_list('id', flat=True))
+            refresh_visibilities(Item._base_manager.filter(desk_id=instance.desk_id), owner_ids)
+    else:
+        refresh_items_visibilities([instance.id])
+
+
+def refresh_on_projel_users_changed(items_lookup, instance, action, reverse, pk_set):
+    """
+    `items_lookup` is the lookup of the items of the projel
+    """
+    if not action.startswith('post_'):
+        return
+
+    if reverse:
+        if pk_set is not None:
+            items = Item._base_manager.filter(**{f'{items_lookup}__in': pk_set})
+        else:
+            items = get_visible_items(instance)
+        refresh_visibilities(items, [instance.id])
+    else:
+        refresh_visibilities(Item._base_manager.filter(**{items_lookup: instance.id}), pk_set)
+
+
+def refresh_on_project_users_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Project.owners and Project.members, from both sides
+    """
+    refresh_on_projel_users_changed('project', instance, action, reverse, pk_set)
+
+
+def refresh_on_channel_users_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Channel.owners, from both sides
+    """
+    refresh_on_projel_users_changed('channels', instance, action, reverse, pk_set)
+
+
+def refresh_on_projel_deleted(sender, instance, **kwargs):
+    """
+    pre_delete of a Project or Channel : its items lose their link to it without any signal
+    """
+    lookup = 'project' if isinstance(instance, Project) else 'channels'
+    item_ids = list(Item._base_manager.filter(**{lookup: instance.id}).values_list('id', flat=True))
+    if item_ids:
+        transaction.on_commit(lambda: refresh_items_visibilities(item_ids))
+
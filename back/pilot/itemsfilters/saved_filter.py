@@ -1,57 +1,157 @@
+from cacheout import LRUCache
+from django.http import QueryDict
 
-from django.core.exceptions import PermissionDenied
-from django.http import QueryDict, HttpRequest
-from rest_framework.exceptions import ValidationError
-
-from rest_framework.request import Request
-
-from pilot.desks.utils import connect_to_desk
+from pilot.desks.membership import get_desk_connection, get_membership_versions
 from pilot.items.api.api import ItemViewSet
+from pilot.items.api.filters import ItemFilter, limit_queryset_in_time
 from pilot.items.export_item import ItemXLSExporter
 from pilot.items.models import Item
 
+# The compiled plans of the current process, by SavedFilter id
+_plans_cache = LRUCache(maxsize=512)
+
+
+class SavedFilterRequest:
+    """
+    The only part of the request used by ItemFilter ( see ItemFilter.filter_id )
+    """
+    def __init__(self, query_dict):
+        self.GET = query_dict
+
 
-def get_items_ids_in_saved_filter(saved_filter):
+class SavedFilterPlan:
     """
-    We cannot simply directly use ItemFilter to execute the SafedFilter filtering,
-    because the ViewSet.filter_queryset() method add additionnal filtering,
-    like restricted_editor or ItemViewSet.limit_queryset_in_time.
-    We need to simulate an actual request on the ViewSet to get a correct result.
+    The query of a SavedFilter, parsed and validated once,
+    along with the permissions of its owner on the desk.
+
+    The plan reproduce the filtering of the items list API ( ItemViewSet.get_queryset and filter_queryset ),
+    and can be applied to any Item queryset, without simulating a request on the ItemViewSet.
 
     Thus, the global filtering process is :
-        - django_filter.Filter filtering
         - restricted editor filtering
-        - additionnal manual filtering in filter_queryset()
-    """
-    http_request = HttpRequest()
-    http_request.method = 'GET'
-    # QueryDict expect an encoded query string, not an unicode string
-    encoding = 'utf-8'
-    query_string = saved_filter.query.encode(encoding)
-    http_request.GET = QueryDict(query_string, encoding=encoding)
-    drf_request = Request(http_request)
-    drf_request.user = saved_filter.user
-    drf_request.session = {}
-    try:
-        connect_to_desk(saved_filter.desk, drf_request)
-    except PermissionDenied:
-        # This may happen if the saved filter has been created by a deactivated user
-        return []
-
-    viewset = ItemViewSet() # For now, only Items are concerned
-    viewset.request = drf_request
-    viewset.action = 'list'
-
-    try:
-        queryset = viewset.filter_queryset(viewset.get_queryset())
-    except ValidationError:
-        # This may happen if an object referenced by the filter query params does not exists anymore ( deleted/hidden )
-        return []
+        - time filtering ( ItemViewSet.limit_queryset_in_time )
+        - django_filter.Filter filtering
+    """
+    def __init__(self, saved_filter, versions):
+        self.query = saved_filter.query
+        self.updated_at = saved_filter.updated_at
+        self.versions = versions
+        self.desk_id = saved_filter.desk_id
+
+        # QueryDict expect an encoded query string, not an unicode string
+        encoding = 'utf-8'
+        self.query_dict = QueryDict(self.query.encode(encoding), encoding=encoding)
+
+        self.user = saved_filter.user
+        self.user_connected = self.connect_user(saved_filter.desk_id)
+
+        self.filterset = ItemFilter(data=self.query_dict, request=SavedFilterRequest(self.query_dict))
+        # This may be invalid if an object referenced by the filter query params does not exists anymore
+        # ( deleted/hidden )
+        self.is_valid = self.filterset.is_valid()
+
+        # Same fallback on the partial search than SearchFilterSetMixin
+        self.partial_filterset = None
+        if self.query_dict.get('q'):
+            partial_query_dict = self.query_dict.copy()
+            partial_query_dict['q_partial'] = partial_query_dict['q']
+            del partial_query_dict['q']
+            self.partial_filterset = ItemFilter(data=partial_query_dict, request=SavedFilterRequest(partial_query_dict))
+            self.partial_filterset.is_valid()
+
+    def connect_user(self, desk_id):
+        """
+        Same checks than connect_to_desk, without a request nor a session
+        """
+        connection = get_desk_connection(self.user, desk_id)
+        if connection is None:
+            # This may happen if the saved filter has been created by a deactivated user
+            return False
+
+        if not connection.desk.is_active or not connection.organization.is_active:
+            return False
+
+        self.user.set_desk_connection(connection.user_in_organization, connection.user_in_desk)
+        return True
+
+    def is_up_to_date(self, saved_filter, versions):
+        return (
+            self.query == saved_filter.query and
+            self.updated_at == saved_filter.updated_at and
+            self.versions == versions
+        )
+
+    def filter_queryset(self, queryset):
+        """
+        Apply only the query params of the SavedFilter on the queryset
+        """
+        filtered_queryset = self.filterset.filter_queryset(queryset)
+
+        # If the full-text search did not return any results,
+        # let's try a partial match with the trigram index
+        if self.partial_filterset and not filtered_queryset.exists():
+            filtered_queryset = self.partial_filterset.filter_queryset(queryset)
+
+        return filtered_queryset
+
+    def apply(self, queryset=None):
+        """
+        Returns the items of the SavedFilter, as listed to its owner by the items API
+        """
+        if queryset is None:
+            queryset = Item.objects.all()
+
+        if not self.user_connected or not self.is_valid:
+            return queryset.none()
+
+        queryset = queryset.filter(desk_id=self.desk_id).filter_by_permissions(self.user)
+        queryset = queryset.order_by(ItemViewSet.default_ordering)
+        queryset = limit_queryset_in_time(queryset, self.query_dict)
+        return self.filter_queryset(queryset)
+
+
+def get_saved_filter_plan_versions(saved_filter):
+    """
+    The versions of the owner membership and of the desk, which are part of the plan validity
+    """
+    return get_membership_versions(saved_filter.user_id, saved_filter.desk_id)
+
+
+def get_saved_filter_plan(saved_filter):
+    versions = get_saved_filter_plan_versions(saved_filter)
+
+    # Not saved yet, nothing to cache
+    if saved_filter.id is None:
+        return SavedFilterPlan(saved_filter, versions)
+
+    plan = _plans_cache.get(saved_filter.id)
+    if plan is None or not plan.is_up_to_date(saved_filter, versions):
+        plan = SavedFilterPlan(saved_filter, versions)
+        _plans_cache.set(saved_filter.id, plan)
+    return plan
+
+
+def get_items_ids_in_saved_filter(saved_filter, item_ids=None):
+    """
+    Returns the ids of the items in the SavedFilter.
+    When `item_ids` is given, only those items are evaluated against the filter.
+    """
+    queryset = get_saved_filter_plan(saved_filter).apply()
+
+    if item_ids is not None:
+        queryset = queryset.filter(id__in=item_ids)
 
     return list(queryset.values_list('id', flat=True))
 
 
 def export_saved_filter_to_xls(saved_filter, output_file):
-    items_ids = get_items_ids_in_saved_filter(saved_filter)
-    items = Item.objects.filter(desk=saved_filter.desk, id__in=items_ids).order_by('id')
+    # Use a subquery instead of materializing all the ids
+    items_in_saved_filter = get_saved_filter_plan(saved_filter).apply().order_by().values('id')
+    items = (
+        Item.objects
+        .filter(desk=saved_filter.desk, id__in=items_in_saved_filter)
+        .order_by('id')
+        .select_related('project', 'created_by', 'updated_by', 'workflow_state', 'item_type')
+        .prefetch_related('channels', 'tasks', 'targets', 'owners', 'tags')
+    )
     ItemXLSExporter(items, output_file, with_content=True).do_export()
@@ -14,6 +14,9 @@ from pilot.projects.tests import factories as projects_factories
 from pilot.items.tests import factories as items_factories
 from pilot.item_types import initial_item_types
 from pilot.items.api import filters as items_filters
+from pilot.itemsfilters.models import SavedFilter
+from pilot.itemsfilters.saved_filter import get_saved_filter_plan, get_items_ids_in_saved_filter
+from pilot.pilot_users.models import UserInDesk, PERMISSION_RESTRICTED_EDITORS
 from pilot.pilot_users.tests import factories as pilot_users_factories
 from pilot.utils.test import PilotAdminUserMixin
 
@@ -573,6 +576,46 @@ class CustomCalendarUiTest(PilotAdminUserMixin, TestCase):
         with self.assertRaises(PublicSharedFilter.DoesNotExist):
             PublicSharedFilter.objects.get(pk=shared_filter.pk)
 
+class SavedFilterPlanTest(PilotAdminUserMixin, TestCase):
+    def setUp(self):
+        super(SavedFilterPlanTest, self).setUp()
+        other_user = pilot_users_factories.PilotUserFactory.create()
+        self.item_fr = items_factories.ItemFactory.create(desk=self.desk, language='fr', created_by=other_user)
+        self.item_en = items_factories.ItemFactory.create(desk=self.desk, language='en', created_by=other_user)
+        self.saved_filter = SavedFilter.objects.create(
+            desk=self.desk,
+            user=self.user,
+            title='French',
+            query='language=fr',
+            type=SavedFilter.TYPE_LIST
+        )
+
+    def test_plan_is_reused(self):
+        plan = get_saved_filter_plan(self.saved_filter)
+        self.assertIs(get_saved_filter_plan(SavedFilter.objects.get(id=self.saved_filter.id)), plan)
+        self.assertEqual(get_items_ids_in_saved_filter(self.saved_filter), [self.item_fr.id])
+        self.assertEqual(get_items_ids_in_saved_filter(self.saved_filter, item_ids=[self.item_en.id]), [])
+
+    def test_plan_invalidated_on_query_change(self):
+        plan = get_saved_filter_plan(self.saved_filter)
+
+        self.saved_filter.query = 'language=en'
+        self.saved_filter.save()
+
+        self.assertIsNot(get_saved_filter_plan(self.saved_filter), plan)
+        self.assertEqual(get_items_ids_in_saved_filter(self.saved_filter), [self.item_en.id])
+
+    def test_plan_invalidated_on_permission_change(self):
+        self.assertEqual(get_items_ids_in_saved_filter(self.saved_filter), [self.item_fr.id])
+
+        user_in_desk = UserInDesk.objects.get(user=self.user, desk=self.desk)
+        user_in_desk.permission = PERMISSION_RESTRICTED_EDITORS
+        user_in_desk.save()
+
+        # The items have been created by another user, they are not visible anymore to a restricted editor
+        self.assertEqual(get_items_ids_in_saved_filter(self.saved_filter), [])
+
+
 class CustomListItemsSeleniumTest(SeleniumTest):
     NB_STANDARD_ITEM = 20
     NB_TWEET_ITEM = 50
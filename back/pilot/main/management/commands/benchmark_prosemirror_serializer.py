@@ -0,0 +1,47 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from pilot.utils.prosemirror.prosemirror import call_nodejs_serialize_prosemirror_document
+from pilot.utils.prosemirror.serializer import serialize_prosemirror_document, GOLDEN_CORPUS_PATH
+
+OUTPUT_FORMATS = ('html', 'markdown', 'text')
+
+
+class Command(BaseCommand):
+    help = 'Compare the throughput (documents/second) of the python and node.js Prosemirror serializers, ' \
+           'on the documents of the golden corpus'
+
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations',
+            type=int, dest='iterations', default=20,
+            help='Number of passes over the corpus for the python serializer')
+
+        parser.add_argument('--nodejs-iterations',
+            type=int, dest='nodejs_iterations', default=1,
+            help='Number of passes over the corpus for the node.js serializer')
+
+    def handle(self, *args, **options):
+        with open(GOLDEN_CORPUS_PATH) as corpus_file:
+            documents = [entry['document'] for entry in json.load(corpus_file)]
+
+        for output_format in OUTPUT_FORMATS:
+            python_rate = self.measure(serialize_prosemirror_document, documents, output_format, options['iterations'])
+            nodejs_rate = self.measure(
+                call_nodejs_serialize_prosemirror_document, documents, output_format, options['nodejs_iterations']
+            )
+            self.stdout.write(
+                f'{output_format:<10} python: {python_rate:>10.1f} docs/sec    '
+                f'node.js: {nodejs_rate:>8.1f} docs/sec    '
+                f'speedup: x{python_rate / nodejs_rate:.1f}'
+            )
+
+    def measure(self, serialize, documents, output_format, iterations):
+        start = time.perf_counter()
+        for i in range(iterations):
+            for document in documents:
+                serialize(document, output_format)
+        return len(documents) * iterations / (time.perf_counter() - start)
@@ -0,0 +1,100 @@
+import resource
+import tempfile
+import time
+import zipfile
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from openpyxl import Workbook
+from openpyxl.styles import Alignment
+from openpyxl.writer.excel import ExcelWriter
+
+from pilot.utils.export_utils import BaseXLSExporter
+
+
+class SyntheticQueryset(object):
+    def __init__(self, row_count):
+        self.row_count = row_count
+
+    def iterator(self):
+        return iter(range(self.row_count))
+
+
+class SyntheticXLSExporter(BaseXLSExporter):
+    """
+    Export generated rows, with a wrapped column as the M2M columns of the actual exporters
+    """
+    def __init__(self, queryset, output_file, column_count):
+        super(SyntheticXLSExporter, self).__init__(queryset, output_file)
+        self.synthetic_column_count = column_count
+
+    def get_header(self):
+        self.wrapped_columns = [2]
+        for column_index in range(self.synthetic_column_count):
+            yield f'Column {column_index}'
+
+    def get_row(self, i, instance):
+        yield instance
+        yield 'Tag 1\nTag 2\nTag 3'
+        for column_index in range(2, self.synthetic_column_count):
+            yield f'Value {instance}-{column_index}'
+
+
+def export_in_memory(row_count, column_count, output_file):
+    """
+    The previous implementation of BaseXLSExporter.do_export, for comparison
+    """
+    exporter = SyntheticXLSExporter(SyntheticQueryset(row_count), output_file, column_count)
+    workbook = Workbook()
+    worksheet = workbook.active
+    worksheet.append(list(exporter.get_header()))
+    for i in range(row_count):
+        worksheet.append(exporter.get_row(i, i))
+    for row_index in range(2, worksheet.max_row + 1):
+        worksheet.cell(row_index, 2).alignment = Alignment(wrap_text=True)
+
+    archive = zipfile.ZipFile(output_file, mode='w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+    ExcelWriter(workbook, archive).write_data()
+    archive.close()
+
+
+def export_streaming(row_count, column_count, output_file):
+    SyntheticXLSExporter(SyntheticQueryset(row_count), output_file, column_count).do_export()
+
+
+def measure(args):
+    """
+    Run in a fresh process, so the peak RSS is not polluted by the previous runs
+    """
+    export, row_count, column_count = args
+    start = time.perf_counter()
+    with tempfile.TemporaryFile() as output_file:
+        export(row_count, column_count, output_file)
+    duration = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, duration
+
+
+class Command(BaseCommand):
+    help = 'Compare the peak memory (RSS) and the duration of the streaming xlsx export ' \
+           'and of an in-memory workbook, on generated rows'
+
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows',
+            type=int, nargs='+', dest='rows', default=[10000, 100000],
+            help='Number of exported rows, one run for each')
+
+        parser.add_argument('--columns',
+            type=int, dest='columns', default=20,
+            help='Number of exported columns')
+
+    def handle(self, *args, **options):
+        for row_count in options['rows']:
+            for label, export in (('in-memory', export_in_memory), ('streaming', export_streaming)):
+                with Pool(processes=1, maxtasksperchild=1) as pool:
+                    peak_rss, duration = pool.apply(measure, [(export, row_count, options['columns'])])
+                self.stdout.write(
+                    f'{row_count:>8} rows  {label:<10} peak RSS: {peak_rss:>8.1f} MB    duration: {duration:>6.1f} s'
+                )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from pilot.utils.prosemirror.cache import get_conversion_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Display the hit/miss counters of the Prosemirror conversion cache, summed over all the processes'
+
+    requires_system_checks = False
+
+    def handle(self, *args, **options):
+        stats = get_conversion_cache_stats()['shared']
+
+        hits = stats.get('local_hits', 0) + stats.get('redis_hits', 0)
+        lookups = hits + stats.get('misses', 0)
+        for counter, count in sorted(stats.items()):
+            self.stdout.write(f'{counter:<20} {count:>12}')
+        if lookups:
+            self.stdout.write(f"{'hit ratio':<20} {hits / lookups:>12.1%}")
@@ -4,15 +4,20 @@ from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.utils.encoding import force_text
+from django.utils.html import escape
 from django.utils.translation import ugettext_lazy as _
 from django.urls import reverse
-from postmark import PMMail
+from postmark import PMMail, PMBatchMail
 
 from pilot.sharings.models import SharingType
 from pilot.utils.url import get_fully_qualified_url
 
 logger = logging.getLogger(__name__)
 
+# The values of the default template which are specific to each recipient, see send_default_template_batch
+RECIPIENT_FIELDS = ('button_action_url', 'notifications_settings_url')
+RECIPIENT_PLACEHOLDER = '[[recipient:{}]]'
+
 # ===================
 # Low-level helpers
 # ===================
@@ -98,6 +103,36 @@ def send_postmark(recipient, subject, text_message, html_message=None, reply_to=
         raise
 
 
+def send_postmark_batch(messages):
+    """
+    Send many emails with the Postmark batch endpoint, by requests of 500 messages at most
+
+    Args:
+        messages: a list of dicts with the arguments of `send`
+    """
+    try:
+        batch = PMBatchMail(messages=[
+            PMMail(
+                to=message['recipient'],
+                # Force translation to occur, see send_postmark
+                subject=force_text(message['subject']),
+                text_body=message['text_message'],
+                html_body=message.get('html_message'),
+                sender=settings.DEFAULT_FROM_EMAIL,
+                reply_to=message.get('reply_to'),
+                metadata=message.get('metadata')
+            )
+            for message in messages
+        ])
+        batch.send()
+    except Exception as e:
+        logger.error(
+            'Error while sending a batch of {} emails'.format(len(messages)),
+            exc_info=True
+        )
+        raise
+
+
 def send(recipient, subject, text_message, html_message=None, reply_to=None, metadata=None):
     """
     Low-level helper, that can send any kind of email :
@@ -113,6 +148,28 @@ def send(recipient, subject, text_message, html_message=None, reply_to=None, met
         send_postmark(recipient, subject, text_message, html_message, reply_to, metadata)
 
 
+def send_batch(messages):
+    """
+    Send many emails at once, see `send`
+
+    Args:
+        messages: a list of dicts with the arguments of `send`
+    """
+    # Send the messages to the console in dev environment
+    if settings.EMAIL_BACKEND == 'django.core.mail.backends.console.EmailBackend':
+        for message in messages:
+            send_smtp(
+                recipient=message['recipient'],
+                subject=message['subject'],
+                text_message=message['text_message'],
+                html_message=message.get('html_message'),
+                reply_to=message.get('reply_to')
+            )
+    # In other env, route the mails through the postmark batch endpoint
+    else:
+        send_postmark_batch(messages)
+
+
 def send_template(recipient, subject, context, text_template, html_template=None, reply_to=None, metadata=None):
     send(
         recipient=recipient,
@@ -124,15 +181,11 @@ def send_template(recipient, subject, context, text_template, html_template=None
     )
 
 
-def send_default_template(recipient, subject,
-                          content_title_template=None,
-                          content_body_template=None,
-                          button_action_text=None,
-                          button_action_url=None,
-                          context=None,
-                          reply_to=None,
-                          metadata=None):
-    context = context or {}
+def get_default_template_context(context,
+                                 content_title_template=None,
+                                 content_body_template=None,
+                                 button_action_text=None,
+                                 button_action_url=None):
     if content_title_template:
         context['content_title'] = render_to_string(content_title_template, context)
     if content_body_template:
@@ -141,6 +194,24 @@ def send_default_template(recipient, subject,
         context['button_action_text'] = button_action_text.format(**context)
     if button_action_url:
         context['button_action_url'] = button_action_url
+    return context
+
+
+def send_default_template(recipient, subject,
+                          content_title_template=None,
+                          content_body_template=None,
+                          button_action_text=None,
+                          button_action_url=None,
+                          context=None,
+                          reply_to=None,
+                          metadata=None):
+    context = get_default_template_context(
+        context or {},
+        content_title_template,
+        content_body_template,
+        button_action_text,
+        button_action_url
+    )
     send_template(
         recipient=recipient,
         subject=subject,
@@ -151,6 +222,65 @@ def send_default_template(recipient, subject,
         metadata=metadata
     )
 
+def send_default_template_batch(recipients, subject,
+                                content_title_template=None,
+                                content_body_template=None,
+                                button_action_text=None,
+                                context=None):
+    """
+    Send the default template to many recipients at once.
+    The template is rendered only once per group of recipients having the same RECIPIENT_FIELDS set,
+    with placeholders for these fields, which are then substituted with the values of each recipient.
+    The fields which are not set are left out of the context, so the template conditions on them still apply.
+
+    Args:
+        recipients: a list of dicts with the `recipient` email address, the values of the RECIPIENT_FIELDS,
+                    and optionally the `reply_to` and `metadata` of the email
+    """
+    if not recipients:
+        return
+
+    recipients_by_fields = {}
+    for recipient in recipients:
+        fields = tuple(field for field in RECIPIENT_FIELDS if recipient.get(field))
+        recipients_by_fields.setdefault(fields, []).append(recipient)
+
+    def substitute(message, recipient, escape_values=False):
+        for field in RECIPIENT_FIELDS:
+            value = recipient.get(field) or ''
+            message = message.replace(RECIPIENT_PLACEHOLDER.format(field), escape(value) if escape_values else value)
+        return message
+
+    messages = []
+    for fields, group_recipients in recipients_by_fields.items():
+        group_context = dict(context or {})
+        for field in fields:
+            group_context[field] = RECIPIENT_PLACEHOLDER.format(field)
+        group_context = get_default_template_context(
+            group_context,
+            content_title_template,
+            content_body_template,
+            button_action_text
+        )
+
+        group_subject = force_text(subject).format(**group_context)
+        text_message = render_to_string('notifications/email_templates/default.txt', group_context)
+        html_message = render_to_string('notifications/email_templates/default.html', group_context)
+
+        messages.extend(
+            {
+                'recipient': recipient['recipient'],
+                'subject': group_subject,
+                'text_message': substitute(text_message, recipient),
+                'html_message': substitute(html_message, recipient, escape_values=True),
+                'reply_to': recipient.get('reply_to'),
+                'metadata': recipient.get('metadata'),
+            }
+            for recipient in group_recipients
+        )
+
+    send_batch(messages)
+
 # ===================
 # Anonymous Emailing (without in-app notification)
 # ===================
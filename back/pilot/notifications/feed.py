@@ -98,41 +98,115 @@ def notify_saved_filter(feed, instance_id, action):
     )
 
 
-def update_saved_filters_and_notify(desk, updated_instances):
-    # Update only SavedFilters which are associated to a NotificationFeed
-    feeds = NotificationFeed.objects.filter(
-        desk=desk,
-        feed_type=NotificationFeed.FEED_TYPE_ITEM_SAVED_FILTER,
-    )
+def get_impacted_item_ids(updated_instances):
+    """
+    The ids of the items whose membership in a SavedFilter may have changed.
+    A Task impacts the SavedFilter through its item ( publication date, ... )
+    """
+    item_ids = set()
+    for updated_instance in updated_instances:
+        if isinstance(updated_instance, Item):
+            item_ids.add(updated_instance.id)
+        elif getattr(updated_instance, 'item_id', None):
+            item_ids.add(updated_instance.item_id)
+    return item_ids
+
+
+def patch_saved_filter_membership(saved_filter_id, item_ids=None):
+    """
+    Update saved_filter.notification_feed_instance_ids.
+
+    When `item_ids` is given, only those items are evaluated against the filter,
+    and the stored ids are patched with the delta.
+    Otherwise, the whole filter is evaluated (see reconcile_saved_filters_and_notify).
+
+    Returns: a tuple of sets (entered_ids, exited_ids, kept_ids)
+    """
+    # We need a transaction + a select_for_update()
+    # to ensure that concurrent jobs won't tinker concurrently with saved_filter.notification_feed_instance_ids
+    with transaction.atomic():
+        saved_filter = SavedFilter.objects.select_for_update().get(id=saved_filter_id)
+        old_ids = set(saved_filter.notification_feed_instance_ids)
+        matching_ids = set(get_items_ids_in_saved_filter(saved_filter, item_ids=item_ids))
+
+        if item_ids is None:
+            new_ids = matching_ids
+        else:
+            new_ids = (old_ids - set(item_ids)) | matching_ids
+
+        # Update the id list if it has been updated.
+        # Don't use saved_filter.save(), which would evaluate the whole filter again.
+        if old_ids != new_ids:
+            SavedFilter.objects.filter(id=saved_filter_id).update(notification_feed_instance_ids=sorted(new_ids))
+
+    return new_ids - old_ids, old_ids - new_ids, old_ids & matching_ids
+
+
+def notify_saved_filter_feeds(feeds, entered_ids, exited_ids, updated_ids):
     for feed in feeds:
         try:
-            # We need a transaction + a select_for_update()
-            # to ensure that concurrent jobs won't tinker concurrently with saved_filter.notification_feed_instance_ids
-            with transaction.atomic():
-                saved_filter = SavedFilter.objects.select_for_update().get(id=feed.saved_filter_id)
-                old_ids = set(saved_filter.notification_feed_instance_ids)
-                new_ids_list = get_items_ids_in_saved_filter(saved_filter)
-                new_ids = set(new_ids_list)
-
-                # Update the id list if it has been updated
-                if old_ids != new_ids:
-                    saved_filter.notification_feed_instance_ids = new_ids_list
-                    saved_filter.save()
-
-            for updated_instance in updated_instances:
-                # We notify for updated model if :
-                # 1/ The updated model is actually an Item (not a Task)
-                # 2/ The updated id were into the filter before AND after the update
-                if isinstance(updated_instance, Item) and updated_instance.id in (old_ids & new_ids):
-                    # Notify item update
-                    notify_saved_filter(feed, updated_instance.id, SAVED_FILTER_UPDATED)
-
-                for instance_id in (new_ids - old_ids):
-                    # Notify item enter
-                    notify_saved_filter(feed, instance_id, SAVED_FILTER_ENTERED)
-
-                for instance_id in (old_ids - new_ids):
-                    # Notify item exit
-                    notify_saved_filter(feed, instance_id, SAVED_FILTER_EXITED)
+            for instance_id in updated_ids:
+                notify_saved_filter(feed, instance_id, SAVED_FILTER_UPDATED)
+
+            for instance_id in entered_ids:
+                notify_saved_filter(feed, instance_id, SAVED_FILTER_ENTERED)
+
+            for instance_id in exited_ids:
+                notify_saved_filter(feed, instance_id, SAVED_FILTER_EXITED)
         except:
-            logger.error(f"Failed to update and notify SavedFilter {feed.saved_filter_id} on NotificationFeed {feed.id}", exc_info=True)
+            logger.error(f"Failed to notify SavedFilter {feed.saved_filter_id} on NotificationFeed {feed.id}", exc_info=True)
+
+
+def get_saved_filter_feeds(desk=None):
+    """
+    The NotificationFeeds watching a SavedFilter, grouped by SavedFilter id
+    """
+    feeds = NotificationFeed.objects.filter(feed_type=NotificationFeed.FEED_TYPE_ITEM_SAVED_FILTER)
+    if desk:
+        feeds = feeds.filter(desk=desk)
+
+    feeds_by_saved_filter_id = {}
+    for feed in feeds.select_related('saved_filter', 'desk'):
+        feeds_by_saved_filter_id.setdefault(feed.saved_filter_id, []).append(feed)
+    return feeds_by_saved_filter_id
+
+
+def update_saved_filters_and_notify(desk, updated_instances):
+    """
+    Evaluate only the updated items against the SavedFilters associated to a NotificationFeed,
+    and notify the items that entered, exited or were updated inside the filters.
+    """
+    impacted_item_ids = get_impacted_item_ids(updated_instances)
+    if not impacted_item_ids:
+        return
+
+    # We notify updates only for the actual Items (not a Task)
+    updated_item_ids = {instance.id for instance in updated_instances if isinstance(instance, Item)}
+
+    for saved_filter_id, feeds in get_saved_filter_feeds(desk).items():
+        try:
+            entered_ids, exited_ids, kept_ids = patch_saved_filter_membership(saved_filter_id, impacted_item_ids)
+        except:
+            logger.error(f"Failed to update SavedFilter {saved_filter_id}", exc_info=True)
+            continue
+
+        # The updated items must be into the filter before AND after the update
+        notify_saved_filter_feeds(feeds, entered_ids, exited_ids, kept_ids & updated_item_ids)
+
+
+def reconcile_saved_filters_and_notify(desk=None):
+    """
+    Evaluate the whole SavedFilters associated to a NotificationFeed.
+
+    update_saved_filters_and_notify only sees the items that have been saved,
+    this periodic pass catches the other changes, like the items entering a sliding period
+    or the permissions of the filter owner.
+    """
+    for saved_filter_id, feeds in get_saved_filter_feeds(desk).items():
+        try:
+            entered_ids, exited_ids, kept_ids = patch_saved_filter_membership(saved_filter_id)
+        except:
+            logger.error(f"Failed to reconcile SavedFilter {saved_filter_id}", exc_info=True)
+            continue
+
+        notify_saved_filter_feeds(feeds, entered_ids, exited_ids, set())
@@ -2,12 +2,12 @@ import logging
 
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
+from django.db import DatabaseError, models, transaction
 
 from pilot.utils.redis import redis_client
 
 from pilot.queue import jobs_registar
-from pilot.queue.jobs import Job
+from pilot.queue.jobs import Job, thread_local
 from pilot.queue.rq_setup import high_priority_queue
 
 logger = logging.getLogger(__name__)
@@ -19,11 +19,43 @@ NOTIFY_SAVED_FILTER_REDIS_KEY = 'pilot:notify_saved_filter'
 class NotifyJob(Job):
     job_type = jobs_registar.JOB_TYPE_NOTIFY
     queue = high_priority_queue
-    delete_tracker_on_success = True
+    tracked = False
+
+    @classmethod
+    def launch_batched(cls, desk, **notify_kwargs):
+        """
+        Add the notification to the pending NotifyJob of the desk, if there's one,
+        so all the notifications made before the pending jobs are flushed
+        are sent by a single job, instead of a JobTracker and a RQ job for each one.
+
+        The pending jobs are flushed on commit, so the notifications are only batched inside a transaction.
+        The requests run in autocommit, so a view must open a `transaction.atomic()` block around its
+        notifications to get them batched ; otherwise each one is sent by its own job, as with `launch`.
+        """
+        for pending_job in getattr(thread_local, 'pending_jobs', []):
+            if pending_job.job_class is cls and pending_job.kwargs.get('batch_desk_id') == desk.id:
+                pending_job.kwargs['notifications'].append(notify_kwargs)
+                return
+
+        cls.launch(desk, batch_desk_id=desk.id, notifications=[notify_kwargs])
 
     def run(self, *args, **kwargs):
         from pilot.notifications.notify import notify_sync
-        kwargs['desk'] = self.job_tracker.desk
+
+        # The jobs launched with launch_batched
+        if 'notifications' in kwargs:
+            for notify_kwargs in kwargs['notifications']:
+                # A savepoint for each notification, so a database error does not leave the transaction
+                # of the whole batch unusable. notify_sync logs its errors without raising them,
+                # the error is then raised when the savepoint is released, and rolled back to it.
+                try:
+                    with transaction.atomic():
+                        notify_sync(desk=self.desk, **notify_kwargs)
+                except DatabaseError:
+                    logger.error(f"[NotifyJob] Error in a batched notification {notify_kwargs}", exc_info=True)
+            return
+
+        kwargs['desk'] = self.desk
         notify_sync(*args, **kwargs)
 
 
@@ -52,6 +84,20 @@ def schedule_notify_saved_filter(instance):
     )
 
 
+def schedule_notify_saved_filter_bulk(model, instance_ids):
+    """
+    Same as schedule_notify_saved_filter, for instances updated without a save ( queryset update )
+    """
+    if not instance_ids:
+        return
+
+    content_type_id = ContentType.objects.get_for_model(model).id
+    redis_client.sadd(
+        NOTIFY_SAVED_FILTER_REDIS_KEY,
+        *[f"{content_type_id},{instance_id}" for instance_id in instance_ids]
+    )
+
+
 def run_notify_saved_filter():
     from pilot.notifications.feed import update_saved_filters_and_notify
 
@@ -79,6 +125,7 @@ def run_notify_saved_filter():
                     f"Deleted instance in run_saved_filter_notification (element_to_update={element_to_update})",
                     exc_info=True
                 )
+                continue
 
             instances_by_desk.setdefault(instance.desk, []).append(instance)
 
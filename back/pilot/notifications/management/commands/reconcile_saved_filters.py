@@ -0,0 +1,23 @@
+import logging
+import sys
+
+from django.core.management.base import BaseCommand
+
+from pilot.notifications.feed import reconcile_saved_filters_and_notify
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    """
+    Evaluate the whole saved filters watched by a notification feed,
+    and notify users about the items which entered or exited them since the last pass
+    """
+
+    help = "Evaluate the whole saved filters watched by a notification feed, and notify the changes"
+
+    def handle(self, *args, **options):
+        logger.info(f"[Cron Command Start] {' '.join(sys.argv[1:])}")
+
+        reconcile_saved_filters_and_notify()
+
+        logger.info(f"[Cron Command End] {' '.join(sys.argv[1:])}")
@@ -1,4 +1,4 @@
-from collections import namedtuple
+from collections import Counter, namedtuple
 
 import arrow
 from datetime import timedelta
@@ -136,6 +136,30 @@ class Notification(models.Model):
 
         super(Notification, self).save(*args, **kwargs)
 
+    @staticmethod
+    def bulk_create_with_tokens(notifications):
+        """
+        Insert many notifications with a single query.
+        As in save(), the tokens are unique, but they are checked all at once.
+        """
+        for notification in notifications:
+            notification.token = generate_token()
+
+        while True:
+            tokens = [notification.token for notification in notifications]
+            duplicated_tokens = set(
+                Notification.objects.filter(token__in=tokens).values_list('token', flat=True)
+            )
+            duplicated_tokens.update(token for token, count in Counter(tokens).items() if count > 1)
+            if not duplicated_tokens:
+                break
+
+            for notification in notifications:
+                if notification.token in duplicated_tokens:
+                    notification.token = generate_token()
+
+        return Notification.objects.bulk_create(notifications)
+
     def get_absolute_url(self):
         # If we cannot redirect to the target, then this notification should not have a goto url
         if not self.get_target_url():
@@ -40,15 +40,15 @@ def notify_sync(desk, type, to_users, message, email_subject,
     """
     Low-level helper, that put together the steps of a notification :
     - Render the text message
-    - Create the Notification object
-    - Check user preferences, and send an email accordingly, with a link to this notification
+    - Create the Notification objects, with a single insert
+    - Check user preferences, and send the emails accordingly, with a link to each notification.
+      The email is rendered once for all the recipients, and sent with a single batch request.
 
     WARNING : this is a synchronous operation, and should not be used directly from the web server.
     Use the "notify" function instead, which will launch an async job in the queue.
     """
+    notifications_sent = []
     try:
-        notifications_sent = []
-
         # Default text for the action button
         if not button_action_text:
             button_action_text = _('Voir le détail')
@@ -69,71 +69,94 @@ def notify_sync(desk, type, to_users, message, email_subject,
         if data is None:
             data = {}
 
+        notifications_to_email = []
         # Ensure that the user is actually associated to the desk
         for to_user in desk.users.filter(id__in=[u.id for u in to_users]):
-            try:
-                # When there's a preference to check,
-                # the user only get the notifications (email and app) if its preference are set accordingly
-                if preference_to_check:
-                    user_preferences = to_user.notification_preferences.get(preference_to_check, {})
-                    send_email = user_preferences.get('email', True)
-                    display_in_app = user_preferences.get('app', True)
-
-                notification = Notification.objects.create(
-                    desk=desk,
-                    type=type,
-                    send_by=send_by,
-                    to=to_user,
-                    content=message,
-                    linked_object=linked_object,
-                    target_url=target_url,
-                    source_feed=source_feed,
-                    data=data,
-                    is_read=(not display_in_app)
-                )
-
-                notifications_sent.append(notification)
-
-                if send_email:
-                    email_context['notifications_settings_url'] = get_fully_qualified_url(
-                        reverse('notifications_settings', kwargs={'token': notification.token})
-                    )
-
-                    reply_to = None
-                    if reply_to_callback:
-                        reply_to = reply_to_callback(to_user)
-
-                    emailing.send_default_template(
-                        recipient=to_user.email,
-                        subject=email_subject,
-                        content_title_template=content_title_template,
-                        content_body_template=content_body_template,
-                        button_action_text=button_action_text,
-                        button_action_url=get_fully_qualified_url(notification.get_absolute_url()),
-                        context=email_context,
-                        reply_to=reply_to,
-                        metadata=dict(
-                            sender_id=send_by.id,
-                            recipient_id=to_user.id,
-                            notification_id=notification.id
-                        )
-                    )
-            except:
-                logger.error(
-                    'Error while notifying user {}'.format(to_user),
-                    exc_info=True
-                )
+            user_send_email = send_email
+            user_display_in_app = display_in_app
+            # When there's a preference to check,
+            # the user only get the notifications (email and app) if its preference are set accordingly
+            if preference_to_check:
+                user_preferences = to_user.notification_preferences.get(preference_to_check, {})
+                user_send_email = user_preferences.get('email', True)
+                user_display_in_app = user_preferences.get('app', True)
+
+            notification = Notification(
+                desk=desk,
+                type=type,
+                send_by=send_by,
+                to=to_user,
+                content=message,
+                linked_object=linked_object,
+                target_url=target_url,
+                source_feed=source_feed,
+                data=data,
+                is_read=(not user_display_in_app)
+            )
+            notifications_sent.append(notification)
+            if user_send_email:
+                notifications_to_email.append(notification)
+
+        Notification.bulk_create_with_tokens(notifications_sent)
+
+        if notifications_to_email:
+            send_notifications_emails(
+                notifications_to_email,
+                email_subject=email_subject,
+                content_title_template=content_title_template,
+                content_body_template=content_body_template,
+                button_action_text=button_action_text,
+                email_context=email_context,
+                reply_to_callback=reply_to_callback
+            )
     except:
         logger.error('Error during a notify', exc_info=True)
 
     return notifications_sent
 
 
-def notify(*args, **kwargs):
+def send_notifications_emails(notifications, email_subject, content_title_template, content_body_template,
+                              button_action_text, email_context, reply_to_callback=None):
+    recipients = []
+    for notification in notifications:
+        to_user = notification.to
+        absolute_url = notification.get_absolute_url()
+        recipients.append({
+            'recipient': to_user.email,
+            'button_action_url': get_fully_qualified_url(absolute_url) if absolute_url else None,
+            'notifications_settings_url': get_fully_qualified_url(
+                reverse('notifications_settings', kwargs={'token': notification.token})
+            ),
+            'reply_to': reply_to_callback(to_user) if reply_to_callback else None,
+            'metadata': dict(
+                sender_id=notification.send_by.id,
+                recipient_id=to_user.id,
+                notification_id=notification.id
+            ),
+        })
+
+    try:
+        emailing.send_default_template_batch(
+            recipients,
+            subject=email_subject,
+            content_title_template=content_title_template,
+            content_body_template=content_body_template,
+            button_action_text=button_action_text,
+            context=email_context,
+        )
+    except:
+        logger.error(
+            'Error while notifying users {}'.format([notification.to for notification in notifications]),
+            exc_info=True
+        )
+
+
+def notify(desk, **kwargs):
     """
-    Start an async job for the notify low-level helper
+    Start an async job for the notify low-level helper.
+    The notifications of a desk made during the same request are sent by a single job.
     """
-    NotifyJob.launch(*args, **kwargs)
+    NotifyJob.launch_batched(desk, **kwargs)
 
 # ===================
 # Mention notifications (comment/annotations)
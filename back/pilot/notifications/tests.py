@@ -1,14 +1,29 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from unittest.case import skip
 
+import mock
+
 from django.core import mail
+from django.db import connection
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from rest_framework.test import APITestCase
 
 from pilot.desks.tests import factories as desks_factories
 from pilot.items.tests import factories as items_factories
 from pilot.items.tests.test_api import API_ITEMS_DETAIL_URL
+from pilot.itemsfilters.models import SavedFilter
+from pilot.notifications.feed import update_saved_filters_and_notify, reconcile_saved_filters_and_notify, \
+    SAVED_FILTER_ENTERED, SAVED_FILTER_EXITED, SAVED_FILTER_UPDATED
+from pilot.notifications.const import NotificationType
+from pilot.notifications.jobs import NotifyJob
+from pilot.notifications.models import Notification, NotificationFeed
+from pilot.notifications.notify import notify, notify_sync
+from pilot.queue.jobs import Job, thread_local
+from pilot.notifications import emailing
 from pilot.notifications import factories as notification_factories
 from pilot.pilot_users.tests import factories as user_factories
 from pilot.utils.test import PilotAdminUserMixin, WorkflowStateTestingMixin
@@ -318,3 +333,214 @@ class NotificationsTest(PilotAdminUserMixin, WorkflowStateTestingMixin, APITestC
         }
         self.client.put(url, data=json_item, format='json')
         self.assertEqual(Notification.objects.count(), 0)
+
+
+@mock.patch('pilot.notifications.feed.notify_saved_filter')
+class SavedFilterFeedTest(PilotAdminUserMixin, TestCase):
+    def setUp(self):
+        super(SavedFilterFeedTest, self).setUp()
+        self.item_fr = items_factories.ItemFactory.create(desk=self.desk, language='fr')
+        self.item_en = items_factories.ItemFactory.create(desk=self.desk, language='en')
+        self.saved_filter = SavedFilter.objects.create(
+            desk=self.desk,
+            user=self.user,
+            title='French',
+            query='language=fr',
+            type=SavedFilter.TYPE_LIST
+        )
+        self.feed = NotificationFeed.objects.create(
+            desk=self.desk,
+            user=self.user,
+            feed_type=NotificationFeed.FEED_TYPE_ITEM_SAVED_FILTER,
+            saved_filter=self.saved_filter
+        )
+
+    def get_notified(self, mock_notify):
+        return {(call[0][1], call[0][2]) for call in mock_notify.call_args_list}
+
+    def get_instance_ids(self):
+        self.saved_filter.refresh_from_db()
+        return set(self.saved_filter.notification_feed_instance_ids)
+
+    def test_incremental_update(self, mock_notify):
+        self.assertEqual(self.get_instance_ids(), {self.item_fr.id})
+
+        self.item_en.language = 'fr'
+        self.item_en.save()
+        update_saved_filters_and_notify(self.desk, [self.item_en])
+        self.assertEqual(self.get_instance_ids(), {self.item_fr.id, self.item_en.id})
+        self.assertEqual(self.get_notified(mock_notify), {(self.item_en.id, SAVED_FILTER_ENTERED)})
+
+        mock_notify.reset_mock()
+        self.item_fr.language = 'en'
+        self.item_fr.save()
+        update_saved_filters_and_notify(self.desk, [self.item_fr, self.item_en])
+        self.assertEqual(self.get_instance_ids(), {self.item_en.id})
+        self.assertEqual(
+            self.get_notified(mock_notify),
+            {(self.item_fr.id, SAVED_FILTER_EXITED), (self.item_en.id, SAVED_FILTER_UPDATED)}
+        )
+
+    def test_only_changed_items_are_evaluated(self, mock_notify):
+        # Changed behind the back of the incremental update
+        type(self.item_en).objects.filter(id=self.item_en.id).update(language='fr')
+
+        update_saved_filters_and_notify(self.desk, [self.item_fr])
+        self.assertEqual(self.get_instance_ids(), {self.item_fr.id})
+        self.assertEqual(self.get_notified(mock_notify), {(self.item_fr.id, SAVED_FILTER_UPDATED)})
+
+        # Until the reconciliation pass
+        mock_notify.reset_mock()
+        reconcile_saved_filters_and_notify(self.desk)
+        self.assertEqual(self.get_instance_ids(), {self.item_fr.id, self.item_en.id})
+        self.assertEqual(self.get_notified(mock_notify), {(self.item_en.id, SAVED_FILTER_ENTERED)})
+
+
+class PostmarkStubHandler(BaseHTTPRequestHandler):
+    """
+    Record the requests made to the Postmark API, and accept all the messages
+    """
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append((self.path, body))
+
+        response = json.dumps([{'ErrorCode': 0, 'MessageID': str(i)} for i in range(len(body))]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class BulkNotifyTest(PilotAdminUserMixin, TestCase):
+    def setUp(self):
+        super(BulkNotifyTest, self).setUp()
+        self.to_users = [self.user]
+        for i in range(3):
+            to_user = user_factories.PilotUserFactory()
+            to_user.organizations.add(self.organization)
+            to_user.desks.add(self.desk)
+            self.to_users.append(to_user)
+
+        self.postmark_stub = HTTPServer(('127.0.0.1', 0), PostmarkStubHandler)
+        self.postmark_stub.requests = []
+        threading.Thread(target=self.postmark_stub.serve_forever, daemon=True).start()
+        self.addCleanup(self.postmark_stub.server_close)
+        self.addCleanup(self.postmark_stub.shutdown)
+
+    def notify_all(self):
+        return notify_sync(
+            desk=self.desk,
+            type=NotificationType.MENTION_COMMENT,
+            to_users=self.to_users,
+            message='@all {desk}',
+            email_subject='Mention on {desk}',
+            target_url='/items/1/',
+            context={'desk': self.desk.name}
+        )
+
+    def test_bulk_notify_through_postmark_batch(self):
+        stub_url = 'http://127.0.0.1:{}/'.format(self.postmark_stub.server_port)
+        with override_settings(EMAIL_BACKEND='postmark.django_backend.EmailBackend', POSTMARK_API_KEY='test'), \
+                mock.patch('postmark.core.__POSTMARK_URL__', stub_url):
+            notifications = self.notify_all()
+
+        self.assertEqual(len(notifications), len(self.to_users))
+        self.assertEqual(Notification.objects.filter(desk=self.desk).count(), len(self.to_users))
+        self.assertEqual(len({notification.token for notification in notifications}), len(self.to_users))
+
+        # A single request for all the recipients
+        self.assertEqual(len(self.postmark_stub.requests), 1)
+        path, messages = self.postmark_stub.requests[0]
+        self.assertEqual(path, '/email/batch')
+        self.assertEqual({message['To'] for message in messages}, {user.email for user in self.to_users})
+
+        # The shared rendering, with the links of each recipient
+        notifications_by_email = {notification.to.email: notification for notification in notifications}
+        for message in messages:
+            notification = notifications_by_email[message['To']]
+            self.assertEqual(message['Subject'], 'Mention on {}'.format(self.desk.name))
+            self.assertEqual(message['Metadata']['notification_id'], notification.id)
+            self.assertIn(notification.get_absolute_url(), message['TextBody'])
+            self.assertIn(notification.token, message['HtmlBody'])
+            self.assertNotIn('[[recipient:', message['HtmlBody'])
+
+    def test_batch_with_mixed_recipient_fields(self):
+        stub_url = 'http://127.0.0.1:{}/'.format(self.postmark_stub.server_port)
+        with override_settings(EMAIL_BACKEND='postmark.django_backend.EmailBackend', POSTMARK_API_KEY='test'), \
+                mock.patch('postmark.core.__POSTMARK_URL__', stub_url):
+            emailing.send_default_template_batch(
+                [
+                    {'recipient': 'with-button@example.com', 'button_action_url': 'http://example.com/items/1/',
+                     'notifications_settings_url': 'http://example.com/settings/'},
+                    {'recipient': 'without-button@example.com', 'button_action_url': None,
+                     'notifications_settings_url': 'http://example.com/settings/'},
+                ],
+                subject='Subject',
+                button_action_text='Open the item',
+            )
+
+        # Still a single request for all the groups of recipients
+        self.assertEqual(len(self.postmark_stub.requests), 1)
+        path, messages = self.postmark_stub.requests[0]
+        messages_by_email = {message['To']: message for message in messages}
+
+        with_button = messages_by_email['with-button@example.com']
+        self.assertIn('Open the item', with_button['TextBody'])
+        self.assertIn('http://example.com/items/1/', with_button['TextBody'])
+        self.assertIn('href="http://example.com/items/1/"', with_button['HtmlBody'])
+
+        # The button is not rendered with an empty link for the recipients without an url
+        without_button = messages_by_email['without-button@example.com']
+        self.assertNotIn('Open the item', without_button['TextBody'])
+        self.assertNotIn('Open the item', without_button['HtmlBody'])
+        self.assertNotIn('href=""', without_button['HtmlBody'])
+        self.assertIn('http://example.com/settings/', without_button['TextBody'])
+
+        for message in messages:
+            self.assertNotIn('[[recipient:', message['TextBody'])
+            self.assertNotIn('[[recipient:', message['HtmlBody'])
+
+    def test_notify_jobs_are_batched_by_desk(self):
+        Job.reset_pending_jobs()
+        self.addCleanup(Job.reset_pending_jobs)
+
+        for i in range(3):
+            notify(
+                desk=self.desk,
+                type=NotificationType.MENTION_COMMENT,
+                to_users=self.to_users,
+                message='Message {}'.format(i),
+                email_subject='Subject',
+            )
+
+        # The transaction of the test is never committed, the job stays pending
+        self.assertEqual(len(thread_local.pending_jobs), 1)
+        pending_job = thread_local.pending_jobs[0]
+        self.assertIs(pending_job.job_class, NotifyJob)
+        self.assertEqual(len(pending_job.kwargs['notifications']), 3)
+
+    def test_batched_notification_database_error(self):
+        def notify_sync_with_error(**notify_kwargs):
+            if notify_kwargs['message'] != 'Broken':
+                return notify_sync(**notify_kwargs)
+            # Swallowed, as notify_sync does
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1 / 0')
+            except Exception:
+                pass
+            return []
+
+        notify_kwargs = dict(type=NotificationType.MENTION_COMMENT, to_users=self.to_users, email_subject='Subject')
+        with mock.patch('pilot.notifications.notify.notify_sync', side_effect=notify_sync_with_error):
+            NotifyJob(None, None, desk_id=self.desk.id).run(notifications=[
+                dict(notify_kwargs, message='Broken'),
+                dict(notify_kwargs, message='Message'),
+            ])
+
+        # The notifications after the error are still created
+        self.assertEqual(Notification.objects.filter(desk=self.desk).count(), len(self.to_users))
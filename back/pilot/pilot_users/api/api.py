@@ -19,6 +19,7 @@ from django_filters.rest_framework import FilterSet
 from pilot.accounts.subscription import update_stripe_subscription_items
 from pilot.accounts.usage_limit import UserUsageLimit, UsageLimitReached
 from pilot.comments.jobs import MentionUpdateJob
+from pilot.desks.membership import invalidate_memberships
 from pilot.messaging.models import UserMessage
 from pilot.notifications import emailing
 from pilot.notifications.models import Notification
@@ -227,6 +228,8 @@ class UsersViewSet(viewsets.mixins.RetrieveModelMixin,
             user=user,
             desk=request.desk
         ).update(permission=permission)
+        # update() does not send any signal
+        invalidate_memberships(user_id=user.id)
         user.permission = permission  # Add the permission for the serialzier
         serializer = self.get_serializer(user)
         return Response(serializer.data)
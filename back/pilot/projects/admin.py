@@ -8,7 +8,7 @@ class ProjectAdmin(admin.ModelAdmin):
     list_filter = ('state', 'desk',)
     raw_id_fields = ('owners', 'created_by', 'updated_by', 'desk', 'channels', 'targets', 'assets', 'category')
     search_fields = ('name',)
-    exclude = ('search_vector', 'partial_search_document', 'state')
+    exclude = ('search_vector', 'partial_search_document', 'search_document_digest', 'state')
 
     def get_queryset(self, request):
         """
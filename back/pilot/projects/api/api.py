@@ -6,6 +6,7 @@ from rest_framework.permissions import AllowAny
 from rest_framework.status import HTTP_202_ACCEPTED
 
 from pilot.accounts.usage_limit import ProjectUsageLimit
+from pilot.items.visibility import refresh_items_visibilities
 from pilot.projects.api.filters import ProjectFilter
 from pilot.projects.api.serializers import ProjectCalendarSerializer, ProjectChoiceSerializer, ProjectListSerializer, \
     ProjectSerializer
@@ -116,7 +117,9 @@ class ProjectViewSet(ProjelViewSet):
         project = self.get_object()
         item_ids = request.data.get('itemIds')
         project.items.filter(id__in=item_ids).update(project=None)
-        HierarchyConsistencyJob.launch_r(self.request, project)
+        # The project is removed without any signal
+        refresh_items_visibilities(item_ids)
+        HierarchyConsistencyJob.launch_r(self.request, project, item_ids=item_ids)
         return Response(status=HTTP_202_ACCEPTED)
 
 
@@ -1,7 +1,9 @@
 import arrow
 
+from django.db.models import Count
 from django.utils.translation import ugettext_lazy as _
 
+from pilot.items.models import Item
 from pilot.notifications.const import NotificationType
 from pilot.pilot_users.models import UserInDesk
 from pilot.projects.models import Project
@@ -57,8 +59,20 @@ class ProjectXLSExporter(export_utils.BaseXLSExporter):
         # 1/ Metadata fields
         yield from super(ProjectXLSExporter, self).get_row(i, project)
 
-        # 2/ Content count
-        yield project.items.count()
+        # 2/ Content count, see prepare_chunk
+        yield project.items_count
+
+    def prepare_chunk(self, projects):
+        items_count = dict(
+            Item.objects
+            .filter(project__in=projects)
+            .order_by()
+            .values('project_id')
+            .annotate(count=Count('id'))
+            .values_list('project_id', 'count')
+        )
+        for project in projects:
+            project.items_count = items_count.get(project.id, 0)
 
     def add_style(self):
         super(ProjectXLSExporter, self).add_style()
@@ -1,21 +1,15 @@
-import logging
-
-from django.conf import settings
-
-from pilot.search.api.serializers import ProjectSearchDocTypeSerializer
-
-logger = logging.getLogger(__name__)
+from pilot.projects.models import Project
+from pilot.search.indexing import schedule_es_indexing
 
 
 def reindex_project(sender, instance, **kwargs):
-    if not settings.ES_DISABLED:
-        project = instance
-
-        try:
-            settings.ES_CLIENT.index(settings.ES_PROJECT_INDEX,
-                                     ProjectSearchDocTypeSerializer(project).data,
-                                     id=project.id)
-        except:
-            logger.error("[ES Indexing Error] Could not index Project (id={})"
-                         "".format(project.id),
-                         exc_info=True)
+    # For the M2M changes, only once they're done
+    action = kwargs.get('action')
+    if action and not action.startswith('post_'):
+        return
+
+    # A M2M change made from the other side, e.g. channel.projects.add(project) : the projects are in pk_set
+    if kwargs.get('reverse'):
+        schedule_es_indexing(Project, kwargs.get('pk_set') or [])
+    else:
+        schedule_es_indexing(Project, [instance.id])
@@ -1,7 +1,7 @@
 import threading
 import uuid
 import logging
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 try:
     import cPickle as pickle
 except ImportError:  # noqa  # pragma: no cover
@@ -10,11 +10,14 @@ except ImportError:  # noqa  # pragma: no cover
 from multiprocessing.dummy import Process as DummyProcess
 from multiprocessing.pool import ThreadPool
 
+from django.apps import apps
 from django.db import connections
+from django.db import models
 from django.db import transaction
 from django.utils import timezone
 from rq import get_current_job
 
+from pilot.desks.models import Desk
 from pilot.notifications.pilot_bot import get_pilot_bot_user
 from pilot.queue.models import JobTracker
 from pilot.queue.rq_setup import medium_priority_queue
@@ -26,6 +29,65 @@ thread_local = threading.local()
 thread_local.pending_jobs = []
 # A data-structure that holds the data required to launch a job after the transaction
 PendingJob = namedtuple('PendingJob', ['args', 'kwargs', 'job_id', 'job_class', 'depends_on', 'timeout'])
+# What is sent to RQ in place of a model instance, in the arguments of an untracked job
+ModelReference = namedtuple('ModelReference', ['model_label', 'pk'])
+
+
+def pack_job_arguments(value):
+    """
+    Replace the model instances and querysets in the arguments of a job by ModelReference,
+    so only their primary keys are pickled.
+    """
+    if isinstance(value, models.Model):
+        return ModelReference(value._meta.label, value.pk)
+    if isinstance(value, models.QuerySet):
+        return [ModelReference(instance._meta.label, instance.pk) for instance in value]
+    if isinstance(value, dict):
+        return {key: pack_job_arguments(item) for key, item in value.items()}
+    # Leave the namedtuples, and the ModelReference themselves, untouched
+    if isinstance(value, (list, tuple, set)) and not hasattr(value, '_fields'):
+        return type(value)(pack_job_arguments(item) for item in value)
+    return value
+
+
+def collect_model_references(value, references):
+    if isinstance(value, ModelReference):
+        references[value.model_label].add(value.pk)
+    elif isinstance(value, dict):
+        for item in value.values():
+            collect_model_references(item, references)
+    elif isinstance(value, (list, tuple, set)):
+        for item in value:
+            collect_model_references(item, references)
+
+
+def resolve_model_references(value, instances):
+    if isinstance(value, ModelReference):
+        return instances.get(value)
+    if isinstance(value, dict):
+        return {key: resolve_model_references(item, instances) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)) and not hasattr(value, '_fields'):
+        resolved = (resolve_model_references(item, instances) for item in value)
+        # The instances deleted since the launch are dropped from the collections
+        return type(value)(item for item in resolved if item is not None)
+    return value
+
+
+def unpack_job_arguments(args, kwargs):
+    """
+    Fetch back the instances referenced by the arguments of a job, with a single query by model.
+    The instances deleted in the meantime are replaced by None, or dropped from the lists.
+    """
+    references = defaultdict(set)
+    collect_model_references((args, kwargs), references)
+
+    instances = {}
+    for model_label, pks in references.items():
+        # The base manager, so the instances are fetched even if the default manager filters them out
+        for pk, instance in apps.get_model(model_label)._base_manager.in_bulk(pks).items():
+            instances[ModelReference(model_label, pk)] = instance
+
+    return resolve_model_references(args, instances), resolve_model_references(kwargs, instances)
 
 
 class SelfCleaningProcess(DummyProcess):
@@ -57,6 +119,10 @@ class Job(object):
     job_type = None
     queue = medium_priority_queue
     delete_tracker_on_success = False
+    # Untracked jobs don't have a JobTracker : their model instances arguments are sent to RQ as primary keys,
+    # and their failures are only reported in the logs and in the RQ failed jobs registry.
+    # This is meant for the high-volume internal jobs, whose progress is not displayed to the users.
+    tracked = True
 
     @staticmethod
     def reset_pending_jobs():
@@ -66,16 +132,31 @@ class Job(object):
     @classmethod
     def enqueue_job(cls, args, kwargs, job_id, depends_on=None, timeout=None):
         try:
-            cls.queue.enqueue_call(
-                cls.start,
-                args=args,
-                kwargs=kwargs,
-                job_id=job_id,
-                depends_on=depends_on,
-                timeout=timeout,
-            )
+            if cls.tracked:
+                cls.queue.enqueue_call(
+                    cls.start,
+                    args=args,
+                    kwargs=kwargs,
+                    job_id=job_id,
+                    depends_on=depends_on,
+                    timeout=timeout,
+                )
+            else:
+                # Packed only now, so the arguments of a pending job can still be updated until the flush
+                cls.queue.enqueue_call(
+                    cls.start_untracked,
+                    args=pack_job_arguments(args),
+                    kwargs=pack_job_arguments(kwargs),
+                    job_id=job_id,
+                    depends_on=depends_on,
+                    timeout=timeout,
+                    # Nothing to keep once it's done
+                    result_ttl=0,
+                )
         except:
             logger.error("[Job Enqueueing Error]\nJobTracker ID : {}".format(job_id), exc_info=True)
+            if not cls.tracked:
+                return
             job_tracker = JobTracker.objects.get(job_id=job_id)
             job_tracker.state = JobTracker.STATE_REDIS_DOWN
             job_tracker.save()
@@ -138,13 +219,21 @@ class Job(object):
         # This is to ensure that we can retrieve the JobTracker (by its job_id) when the job start
         job_id = str(uuid.uuid4())
 
+        depends_on = kwargs.pop('depends_on', None)
+        timeout = kwargs.pop('timeout', None)
+
+        if not cls.tracked:
+            # The desk is the first argument of start_untracked
+            cls.add_pending_job((desk.id,) + args, kwargs, job_id, depends_on, timeout)
+            return {
+                'job_id': job_id,
+                'job_tracker': None
+            }
+
         # If no user has been provided, we use the user bot to ensure created_by as something inside it
         if not user:
             user = get_pilot_bot_user()
 
-        depends_on = kwargs.pop('depends_on', None)
-        timeout = kwargs.pop('timeout', None)
-
         job_tracker = JobTracker.objects.create(
             desk=desk,
             created_by=user,
@@ -208,9 +297,34 @@ class Job(object):
 
         return result
 
-    def __init__(self, rq_job, job_tracker):
+    @classmethod
+    def start_untracked(cls, desk_id, *args, **kwargs):
+        logger.info(f"Starting untracked Job {cls.__name__} with ({args}), {{{kwargs}}}")
+        rq_job = get_current_job()
+
+        try:
+            with transaction.atomic():
+                args, kwargs = unpack_job_arguments(args, kwargs)
+                job = cls(rq_job, None, desk_id=desk_id)
+                return job.run(*args, **kwargs)
+        except:
+            logger.error("[Job Error]\nRQ job ID : {}\nUntracked job {}".format(rq_job.id, cls.__name__), exc_info=True)
+            # re-raise, so RQ can move the job to the failed queue
+            raise
+
+    def __init__(self, rq_job, job_tracker, desk_id=None):
         self.rq_job = rq_job
         self.job_tracker = job_tracker
+        self.desk_id = desk_id
+        self._desk = None
+
+    @property
+    def desk(self):
+        if self.job_tracker:
+            return self.job_tracker.desk
+        if self._desk is None:
+            self._desk = Desk.objects.get(id=self.desk_id)
+        return self._desk
 
     def run(self, *args, **kwargs):
         raise NotImplementedError()
@@ -0,0 +1,62 @@
+import mock
+
+from django.test import TestCase
+
+from pilot.notifications.const import NotificationType
+from pilot.notifications.jobs import NotifyJob
+from pilot.pilot_users.models import PilotUser
+from pilot.pilot_users.tests import factories as user_factories
+from pilot.queue.jobs import Job, ModelReference, pack_job_arguments, thread_local, unpack_job_arguments
+from pilot.queue.models import JobTracker
+from pilot.utils.test import PilotAdminUserMixin
+
+
+class UntrackedJobTests(PilotAdminUserMixin, TestCase):
+    def test_pack_job_arguments(self):
+        users = user_factories.PilotUserFactory.create_batch(2)
+        args = (self.desk, 'text')
+        kwargs = {
+            'to_users': PilotUser.objects.filter(id__in=[user.id for user in users]).order_by('id'),
+            'context': {'user': users[0], 'count': 2},
+        }
+
+        packed_args, packed_kwargs = pack_job_arguments(args), pack_job_arguments(kwargs)
+        self.assertEqual(packed_args, (ModelReference('desks.Desk', self.desk.id), 'text'))
+        self.assertEqual(
+            packed_kwargs['to_users'],
+            [ModelReference('pilot_users.PilotUser', user.id) for user in users]
+        )
+
+        # The deleted instances are dropped from the lists
+        users[1].delete()
+        with self.assertNumQueries(2):
+            unpacked_args, unpacked_kwargs = unpack_job_arguments(packed_args, packed_kwargs)
+        self.assertEqual(unpacked_args, (self.desk, 'text'))
+        self.assertEqual(unpacked_kwargs['to_users'], [users[0]])
+        self.assertEqual(unpacked_kwargs['context'], {'user': users[0], 'count': 2})
+
+    @mock.patch.object(NotifyJob, 'queue')
+    def test_untracked_job_launch(self, mock_queue):
+        Job.reset_pending_jobs()
+        self.addCleanup(Job.reset_pending_jobs)
+
+        NotifyJob.launch_batched(
+            self.desk,
+            type=NotificationType.MENTION_COMMENT,
+            to_users=[self.user],
+            message='Message',
+            email_subject='Subject',
+        )
+        self.assertFalse(JobTracker.objects.exists())
+
+        # The transaction of the test is never committed, flush ourselves
+        self.assertEqual(len(thread_local.pending_jobs), 1)
+        Job.flush_pending_jobs()
+
+        mock_queue.enqueue_call.assert_called_once()
+        call_kwargs = mock_queue.enqueue_call.call_args[1]
+        self.assertEqual(call_kwargs['args'], (self.desk.id,))
+        self.assertEqual(
+            call_kwargs['kwargs']['notifications'][0]['to_users'],
+            [ModelReference('pilot_users.PilotUser', self.user.id)]
+        )
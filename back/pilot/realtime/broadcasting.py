@@ -1,13 +1,27 @@
+import hashlib
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
 from aioredis import ConnectionClosedError
 from asgiref.sync import async_to_sync
+from cacheout import LRUCache
 from channels.layers import get_channel_layer
+from django.conf import settings
 
 from pilot.assets.api.serializers import AssetSerializer
 from pilot.items.api.light_serializers import EditSessionLightSerializer, serialize_editor
 from pilot.items.api.serializers import ItemSerializer
 from pilot.items.models import EditSession, Item
 from pilot.realtime.messages import S2C_MESSAGES, get_desk_group, get_item_group
+from pilot.realtime.oplog import apply_pending_changes
 from pilot.realtime.store import store
+from pilot.utils.redis import redis_client
+
+logger = logging.getLogger(__name__)
 
 # ===================
 # Outbound messages (broadcasting)
@@ -16,9 +30,14 @@ from pilot.realtime.store import store
 channel_layer = get_channel_layer()
 sync_group_add = async_to_sync(channel_layer.group_add)
 sync_group_send = async_to_sync(channel_layer.group_send)
+sync_send = async_to_sync(channel_layer.send)
 sync_group_discard = async_to_sync(channel_layer.group_discard)
 
 
+USERS_ON_ITEM_DIGEST_REDIS_KEY = 'pilot:realtime:users_on_item_digest:{}'
+USERS_ON_ITEM_DIGEST_TTL = 60 * 60
+
+
 class Broadcaster:
     """
     Entry-point for broadcasting messages to multiple clients through websockets.
@@ -30,6 +49,12 @@ class Broadcaster:
     The message we want to send has a "type" parameter, but django-channels also use this name for routing the messages.
     We use an "actual_type" parameter here, which will be converted to "type" by the consumer upon sending to the client.
     """
+    def __init__(self):
+        self.scheduler = BroadcastScheduler(settings.REALTIME_BROADCAST_WINDOW)
+        # The serialized last session of the items, by item id, kept for a window.
+        # The sessions are only created and touched by the compaction,
+        # so they don't need to be fetched again for each batch of changes.
+        self.sessions = LRUCache(maxsize=1024, ttl=settings.REALTIME_BROADCAST_WINDOW)
 
     def broadcast(self, group_name, type, exclude_recipients=[], **data):
         """
@@ -55,19 +80,39 @@ class Broadcaster:
     def broadcast_users_on_item(self, item_id):
         """
         Broadcast the list of users connected to an item, and their selection/field status.
+
+        The broadcasts on the same item are coalesced within REALTIME_BROADCAST_WINDOW,
+        and skipped when the users did not change : a newly registered connection gets them from its consumer.
         """
-        # remove stall connections before broadcasting the users
-        dead_connections = store.eliminate_dead_connections(item_id)
-        users = store.get_users_on_item(item_id)
+        if not item_id:
+            return
+
+        self.scheduler.schedule(('users_on_item', item_id), self._broadcast_users_on_item, item_id)
+
+    def _broadcast_users_on_item(self, item_id):
+        # Stall connections are removed from the store before reading the users
+        users, dead_connections = store.get_users_on_item(item_id)
+
+        # Nothing changed since the last broadcast, from this process or another one
+        if users_on_item_unchanged(item_id, users) and not dead_connections:
+            return
+
         self.broadcast(
             group_name=get_item_group(item_id),
             type=S2C_MESSAGES.BROADCAST_USERS_ON_ITEM,
-            users=[user.to_dict() for user in users]
+            users=users
         )
         # Close the connection AFTER broadcasting the "users_on_item" message,
-        # So the frontend has the time to update its disconnection message
-        for user in dead_connections:
-            user.consumer.close()
+        # So the frontend has the time to update its disconnection message.
+        self.close_dead_connections(dead_connections)
+
+    def close_dead_connections(self, dead_connections):
+        # The connection may be held by another process, so go through the channel layer.
+        for connection_id in dead_connections:
+            try:
+                sync_send(connection_id, {'type': 'close_dead_connection'})
+            except ConnectionClosedError:
+                pass
 
     def broadcast_item(self, item_id, sender_id=None, **extra_data):
         """
@@ -76,6 +121,8 @@ class Broadcaster:
         # Fetch a fresh Item instance, so the serializer have up to date data for its nested serializers
         # which may have been updated.
         item = Item.objects.detail_api_prefetch().get(id=item_id)
+        # Include the live-edit changes not compacted yet
+        apply_pending_changes(item)
 
         session = EditSession.objects.filter(item_id=item_id).latest()
         self.broadcast(
@@ -87,17 +134,186 @@ class Broadcaster:
             **extra_data
         )
 
+    def broadcast_items(self, item_ids, sender_id=None):
+        """
+        Same as broadcast_item for many items ( bulk actions ),
+        with a single query for the items and one for their last sessions.
+        """
+        sessions = (
+            EditSession.objects
+            .filter(item_id__in=item_ids)
+            .order_by('item_id', '-created_at')
+            .distinct('item_id')
+        )
+        sessions_by_item = {session.item_id: session for session in sessions}
+
+        for item in Item.objects.detail_api_prefetch().filter(id__in=item_ids):
+            apply_pending_changes(item)
+            self.broadcast(
+                group_name=get_item_group(item.id),
+                type=S2C_MESSAGES.BROADCAST_ITEM,
+                item=ItemSerializer(item).data,
+                exclude_recipients=[sender_id],
+                session=EditSessionLightSerializer(sessions_by_item.get(item.id)).data,
+            )
+
     def broadcast_item_changes(self, item_id, editor, changes):
         """
         Broadcast atomic changes on the item content, which are created during live edit.
+
+        The changes on the same item are merged within REALTIME_BROADCAST_WINDOW.
+        The session and the editor are serialized here, so the delayed broadcast does not use the database,
+        and the session is fetched once per window.
         """
-        session = EditSession.objects.filter(item_id=item_id).latest()
+        self.scheduler.merge_changes(
+            item_id,
+            editor,
+            changes,
+            self._broadcast_item_changes,
+            session=self.get_serialized_session(item_id),
+            # Memoized
+            serialized_editor=serialize_editor(editor)
+        )
+
+    def get_serialized_session(self, item_id):
+        # Without a window, the broadcasts are sent right away, and nothing is cached ( a ttl of 0 never expires )
+        if not self.scheduler.window:
+            return EditSessionLightSerializer(EditSession.objects.filter(item_id=item_id).latest()).data
+
+        session = self.sessions.get(item_id)
+        if session is None:
+            session = EditSessionLightSerializer(EditSession.objects.filter(item_id=item_id).latest()).data
+            self.sessions.set(item_id, session)
+        return session
+
+    def _broadcast_item_changes(self, item_id, changes, session, serialized_editor):
         self.broadcast(
             group_name=get_item_group(item_id),
             type=S2C_MESSAGES.BROADCAST_ITEM_CHANGES,
             changes=changes,
-            session=EditSessionLightSerializer(session).data,
-            editor=serialize_editor(editor)
+            session=session,
+            editor=serialized_editor
         )
 
+
+def users_on_item_unchanged(item_id, users):
+    """
+    Compare the users with the last ones broadcasted on this item, by any process
+    """
+    digest = hashlib.sha1(json.dumps(users, sort_keys=True).encode()).hexdigest()
+    key = USERS_ON_ITEM_DIGEST_REDIS_KEY.format(item_id)
+    pipeline = redis_client.pipeline()
+    pipeline.getset(key, digest)
+    pipeline.expire(key, USERS_ON_ITEM_DIGEST_TTL)
+    last_digest, _ = pipeline.execute()
+    return last_digest is not None and last_digest.decode() == digest
+
+
+class BroadcastScheduler:
+    """
+    Delay the broadcasts by a short window, to send a single message for all the calls received meanwhile.
+
+    The delayed broadcasts are sent in order by a single worker thread, started on the first broadcast.
+    They must not use the database, the worker would hold its own connection.
+    With a window of 0, the broadcasts are sent right away.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.condition = threading.Condition()
+        # key => (token, editor, args, kwargs) of the pending broadcast, the editor being only set for the changes
+        self.pending = {}
+        # (deadline, token, key, broadcast) of the pending broadcasts.
+        # The window is constant, so they are already ordered by deadline.
+        self.queue = deque()
+        # Identify a pending broadcast, so a broadcast sent early by a conflicting merge is not sent again
+        self.tokens = itertools.count()
+        self.worker = None
+
+    def schedule(self, key, broadcast, *args):
+        """
+        Call `broadcast(*args)` at the end of the window, unless it's already scheduled for this key.
+        """
+        if not self.window:
+            broadcast(*args)
+            return
+
+        with self.condition:
+            if key in self.pending:
+                return
+            self.add_pending(key, broadcast, args, {})
+
+    def merge_changes(self, item_id, editor, changes, broadcast, **extra_args):
+        """
+        Merge the changes into the pending changes on the item,
+        then call `broadcast(item_id, changes, **extra_args)` at the end of the window,
+        with the `extra_args` of the last call.
+
+        Consecutive changes on the same field cannot be merged ( the prosemirror steps must be applied in order ),
+        and the broadcasted changes have a single editor.
+        So the pending changes are sent right away in those cases, and a new window is started.
+        """
+        if not self.window:
+            broadcast(item_id, changes, **extra_args)
+            return
+
+        key = ('item_changes', item_id)
+        flushed = None
+        with self.condition:
+            pending = self.pending.get(key)
+            if pending:
+                _, pending_editor, args, kwargs = pending
+                if pending_editor == editor and not set(kwargs['changes']) & set(changes):
+                    kwargs['changes'].update(changes)
+                    kwargs.update(extra_args)
+                    return
+                flushed = self.pending.pop(key)
+            kwargs = dict(extra_args, item_id=item_id, changes=OrderedDict(changes))
+            self.add_pending(key, broadcast, (), kwargs, editor=editor)
+
+        if flushed:
+            _, _, args, kwargs = flushed
+            self.run(broadcast, args, kwargs)
+
+    def add_pending(self, key, broadcast, args, kwargs, editor=None):
+        """
+        Must be called with the condition held
+        """
+        token = next(self.tokens)
+        self.pending[key] = (token, editor, args, kwargs)
+        self.queue.append((time.monotonic() + self.window, token, key, broadcast))
+
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = threading.Thread(target=self.work, name='realtime-broadcasts', daemon=True)
+            self.worker.start()
+        self.condition.notify()
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+
+                deadline, token, key, broadcast = self.queue[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                self.queue.popleft()
+
+                pending = self.pending.get(key)
+                # Already sent, because of a conflicting merge
+                if pending is None or pending[0] != token:
+                    continue
+                del self.pending[key]
+
+            _, _, args, kwargs = pending
+            self.run(broadcast, args, kwargs)
+
+    def run(self, broadcast, args, kwargs):
+        try:
+            broadcast(*args, **kwargs)
+        except:
+            logger.error(f'[Realtime] Error during a delayed broadcast {broadcast.__name__}{args}{kwargs}', exc_info=True)
+
+
 broadcaster = Broadcaster()
@@ -68,7 +68,7 @@ class PilotConsumer(JsonWebsocketConsumer):
         try:
             # Keep our user alive
             if self.user:
-                self.user.breath()
+                store.breath(self.user)
             type = message.get('type')
 
             # Auth call will not have a connected user...
@@ -130,10 +130,22 @@ class PilotConsumer(JsonWebsocketConsumer):
             if not filter_items_for_sharing(item_queryset, self.user.sharing).exists():
                 return
 
-        store.register_user_on_item(self.user, item_id)
+        previous_item_id = store.register_user_on_item(self.user, item_id)
+        if previous_item_id:
+            sync_group_discard(self.item_group_name, self.channel_name)
+            broadcaster.broadcast_users_on_item(previous_item_id)
+
         self.item_group_name = get_item_group(item_id)
         sync_group_add(self.item_group_name, self.channel_name)
 
+        # The broadcast is skipped when the users did not change since the last one ( a reload, a return on the item ),
+        # so send them to this connection right away
+        users, dead_connections = store.get_users_on_item(item_id)
+        self.send_json({
+            'type': S2C_MESSAGES.BROADCAST_USERS_ON_ITEM,
+            'users': users
+        })
+        broadcaster.close_dead_connections(dead_connections)
         broadcaster.broadcast_users_on_item(self.user.item_id)
 
     def update_user_activity(self, message):
@@ -146,6 +158,7 @@ class PilotConsumer(JsonWebsocketConsumer):
         for attr in ['field_focus', 'field_updating', 'selection']:
             if attr in updated_user:
                 setattr(self.user, attr, updated_user[attr])
+        store.update_user(self.user)
 
         broadcaster.broadcast_users_on_item(self.user.item_id)
 
@@ -167,6 +180,7 @@ class PilotConsumer(JsonWebsocketConsumer):
         # Update the selection after propagating the change, and only if they were accepted
         if update_result['accepted']:
             self.user.selection = message.get('selection')
+            store.update_user(self.user)
             broadcaster.broadcast_users_on_item(self.user.item_id)
 
         # If there's an invalid change, inform the emitter
@@ -194,6 +208,12 @@ class PilotConsumer(JsonWebsocketConsumer):
     # Passthough messages from broadcaster
     # ===================
 
+    def close_dead_connection(self, message):
+        """
+        The user did not breathe in time, and has been purged from the store ( see broadcast_users_on_item )
+        """
+        self.close()
+
     def broadcast(self, message):
         """
         Transmit messages send from the broadcaster to the final client ( see broadcasting.py )
@@ -1,19 +1,27 @@
 import copy
 import datetime
 import json
-import arrow
+import logging
+from contextlib import contextmanager
 
+import arrow
+from cacheout import LRUCache
 from django.conf import settings
 from django.db import transaction
+from rq import Retry
 
 from pilot.activity_stream.jobs import create_activity
 from pilot.activity_stream.models import Activity
-from pilot.item_types.item_content_fields import get_elastic_field_name
+from pilot.item_types.item_content_fields import create_content_field, get_elastic_field_name
 from pilot.items.models import Item
 from pilot.notifications import notify
+from pilot.queue.rq_setup import high_priority_queue
+from pilot.realtime import oplog
 from pilot.realtime.broadcasting import broadcaster
 from pilot.utils.diff import DiffTracker
 
+logger = logging.getLogger(__name__)
+
 # 30 seconds for the testing in local dev
 if settings.DEBUG:
     BREAK_TIME_BETWEEN_SESSIONS = datetime.timedelta(seconds=30)
@@ -30,6 +38,9 @@ class ItemContentUpdater:
     - Annotations
     - EditSessions
 
+    The changes are accepted into the log of the item ( see pilot.realtime.oplog ), and broadcasted right away.
+    They are applied on the Item and its EditSessions later, by a compaction.
+
     There's also method for the special case of elastic field element deletion.
     """
     def __init__(self, user_id, item_id):
@@ -38,115 +49,173 @@ class ItemContentUpdater:
         self.item = None
         self.diff_tracker = None
 
+    def get_content_field(self, field_name, add_elastic_element=False):
+        if add_elastic_element:
+            field_name = field_name[:field_name.rfind('-')]
+
+        content_schema = get_item_content_schema(self.item_id)
+        if field_name in content_schema:
+            return create_content_field(content_schema[field_name])
+
+        # An element of an elastic field
+        base_field_name = field_name[:field_name.rfind('-')]
+        field_schema = content_schema.get(base_field_name)
+        if field_schema and field_schema.get('elastic'):
+            return create_content_field(field_schema)
+
+        return None
+
     def apply_changes(self, changes):
         update_result = dict(
             accepted={},
             invalid={},
             rejected={},
         )
-        any_content_change_accepted = False
 
         timestamp = arrow.utcnow().isoformat()
 
-        ##############################################################
-        # Start of transaction with the select_for_update, lock acquired
-        ##############################################################
+        entries = []
+        for field_name, change in changes.items():
+            add_elastic_element = change.get('action') == 'addElasticElement'
+            content_field = self.get_content_field(field_name, add_elastic_element)
+
+            # The field name does not match a field on the item type schema
+            if not content_field:
+                continue
+
+            # Annotations-only changes won't have a value
+            if 'value' in change:
+                # Special-case to ensure no oversized base64-encoded image ever reach the server,
+                # which would wreak havoc in cascade to a lot of service ( queue, redis, database... )
+                if content_field.is_prosemirror:
+                    serialized_value = json.dumps(change['value'])
+                    if 'data:image' in serialized_value and 'base64,' in serialized_value:
+                        update_result['invalid'][field_name] = 'base64'
+                        continue
+
+            entry = {
+                'field_name': field_name,
+                'version': change.get('version'),
+                'user_id': self.user_id,
+                'timestamp': timestamp,
+            }
+            if 'value' in change:
+                entry['value'] = change['value']
+            if 'annotations' in change:
+                entry['annotations_key'] = change.get('annotationsKey', field_name)
+                entry['annotations'] = change['annotations']
+            entries.append(entry)
+
+        # Ensure the versions are correct, without locking the item
+        accepted_fields = oplog.accept_changes(self.item_id, entries, self.get_field_versions) if entries else set()
+
+        for entry in entries:
+            field_name = entry['field_name']
+            change = changes[field_name]
+            if field_name not in accepted_fields:
+                update_result['rejected'][field_name] = change
+                continue
+
+            # The change has been accepted, the version number has been increased
+            change['timestamp'] = timestamp
+            change['version'] = entry['version'] + 1
+
+            # For prosemirror fields, if there's steps,
+            # we don't need to store the field value in the history
+            if 'steps' in change:
+                change.pop('value', None)
+
+            update_result['accepted'][field_name] = change
+
+        # If any change(s) has been accepted, we must publish for broadcast,
+        # and apply them on the item a bit later
+        if update_result['accepted']:
+            broadcaster.broadcast_item_changes(self.item_id, self.user_id, update_result['accepted'])
+            schedule_item_changes_compaction(self.item_id)
 
-        # select_for_update in a transaction to guard against concurrent editing.
-        # This will serve as a lock around the synchronized code block, until we end the transaction
+        return update_result
+
+    def get_field_versions(self):
+        return Item.objects.filter(id=self.item_id).values_list('field_versions', flat=True).get()
+
+    def compact_changes(self):
+        """
+        Apply the changes of the log on the item, and update the EditSessions accordingly.
+        """
+        # select_for_update in a transaction to guard against a concurrent compaction or elastic element deletion.
+        # The lock is taken once for all the pending changes, not for each change.
         with transaction.atomic():
-            item = self.item = Item.objects.with_content().select_for_update().get(id=self.item_id)
+            try:
+                item = self.item = Item.objects.with_content().select_for_update().get(id=self.item_id)
+            except Item.DoesNotExist:
+                item = None
+
+            log = oplog.read_log(self.item_id)
+            if not log or not item:
+                oplog.remove_pending_changes(self.item_id, log)
+                return
+            entries = [json.loads(entry) for entry in log]
+
             self.diff_tracker = DiffTracker(item)
             annotations_before = copy.deepcopy(item.annotations)
+            session = None
+
+            for entry in entries:
+                # The EditSession are created and updated on behalf of the author of each change
+                self.user_id = entry['user_id']
+                timestamp = entry['timestamp']
+
+                # A break between two changes : the current session must be saved before applying the change,
+                # so it won't contain it
+                if session and 'value' in entry and self.is_session_over(session, timestamp):
+                    self.save_session(session, copy.deepcopy(item.content))
+                    session = None
+
+                content_changed = oplog.apply_change(item, entry)
 
-            for field_name, change in changes.items():
-                add_elastic_element = change.get('action') == 'addElasticElement'
-
-                if add_elastic_element:
-                    base_field_name = field_name[:field_name.rfind('-')]
-                    content_field = item.get_content_field(base_field_name)
-                else:
-                    content_field = item.get_content_field(field_name)
-
-                # The field name does not match a field on the item type schema
-                if not content_field:
-                    continue
-
-                # Ensure the version is correct
-                current_version = item.field_versions.setdefault(field_name, 0)
-                if current_version != change.get('version'):
-                    update_result['rejected'][field_name] = change
-                    continue
-
-                # The version is correct and the content is valid, we accept the change
-                change['timestamp'] = timestamp
-                # The change has been accepted, we can increase the version number
-                item.field_versions[field_name] = current_version + 1
-                change['version'] = current_version + 1
-
-                # Annotations-only changes won't have a value
-                if 'value' in change:
-                    value = change['value']
-
-                    # Special-case to ensure no oversized base64-encoded image ever reach the server,
-                    # which would wreak havoc in cascade to a lot of service ( queue, redis, database... )
-                    if content_field.is_prosemirror:
-                        serialized_value = json.dumps(value)
-                        if 'data:image' in serialized_value and 'base64,' in serialized_value:
-                            update_result['invalid'][field_name] = 'base64'
-                            continue
-
-                    item.content[field_name] = value
-                    any_content_change_accepted = True
-
-                # For prosemirror fields, if there's steps,
-                # we don't need to store the field value in the history
-                if 'steps' in change:
-                    change.pop('value', None)
-
-                if 'annotations' in change:
-                    if item.annotations is None:
-                        item.annotations = {}
-                    annotations_key = change.get('annotationsKey', field_name)
-                    item.annotations[annotations_key] = change['annotations']
-
-                update_result['accepted'][field_name] = change
-
-            # We save the item only if there's accepted change
-            if update_result['accepted']:
                 item.last_editor = self.user_id
                 item.last_edition_datetime = timestamp
                 if isinstance(self.user_id, int):
                     item.updated_by_id = self.user_id
                 item.updated_at = timestamp
-                item.save()
 
                 # Update the session only for content changes, not annotations
-                if any_content_change_accepted:
-                    self.update_session(timestamp)
+                if content_changed:
+                    if session is None:
+                        session = self.get_current_session(timestamp)
+                    self.touch_session(session, timestamp)
+
+            item.save(update_fields=[
+                'json_content', 'annotations', 'field_versions',
+                'last_editor', 'last_edition_datetime', 'updated_by', 'updated_at'
+            ])
+            if session:
+                self.save_session(session, item.content)
+
+        # Applying the same changes twice is harmless,
+        # so we can remove them after the commit, without holding the lock any longer.
+        # We may be inside the transaction of a request, so wait for the actual commit.
+        # The entries are removed by content, so a concurrent compaction of the same entries does not remove newer ones.
+        transaction.on_commit(lambda: oplog.remove_pending_changes(self.item_id, log))
 
-        ##############################################################
-        # End of transaction with the select_for_update, lock released
-        ##############################################################
-
-        annotations_after = item.annotations
         notify.process_notifications_when_annotation_is_updated(
             item,
             annotations_before,
-            annotations_after
+            item.annotations
         )
 
-        # If any change(s) has been accepted, we must publish for broadcast
-        if update_result['accepted']:
-            broadcaster.broadcast_item_changes(self.item_id, self.user_id, update_result['accepted'])
+    def delete_elastic_element(self, field_name, index):
+        # The field versions are updated outside of the log
+        with item_changes_compacted(self.item_id):
+            self._delete_elastic_element(field_name, index)
 
-        return update_result
+        broadcaster.broadcast_item(self.item_id)
 
-    def delete_elastic_element(self, field_name, index):
+    def _delete_elastic_element(self, field_name, index):
         # select_for_update in a transaction to guard against concurrent editing.
         # This will serve as a lock around the synchronized code block, until we end the transaction
         with transaction.atomic():
-            item = self.item = Item.objects.select_for_update().get(id=self.item_id)
+            item = self.item = Item.objects.with_content().select_for_update().get(id=self.item_id)
             self.diff_tracker = DiffTracker(item)
 
             i = index
@@ -166,8 +235,6 @@ class ItemContentUpdater:
             item.save()
             self.update_session(arrow.utcnow().isoformat())
 
-        broadcaster.broadcast_item(self.item_id)
-
     def create_session(self, timestamp):
         session = self.item.create_session(
             timestamp=timestamp,
@@ -186,6 +253,9 @@ class ItemContentUpdater:
 
         return session
 
+    def is_session_over(self, session, timestamp):
+        return arrow.get(timestamp) - arrow.get(session.end) > BREAK_TIME_BETWEEN_SESSIONS
+
     def get_current_session(self, timestamp):
         # First change ever, we need to create a session
         if self.item.sessions.count() == 1:
@@ -193,22 +263,109 @@ class ItemContentUpdater:
         # There's already somme session, check if we're using the same or must create a new one
         else:
             last_session = self.item.last_session
-            last_edit_time = last_session.end
 
             # Last edit is too old, ceate a new session
-            if arrow.get(timestamp) - arrow.get(last_edit_time) > BREAK_TIME_BETWEEN_SESSIONS:
+            if self.is_session_over(last_session, timestamp):
                 return self.create_session(timestamp)
             # We're still in the same session
             else:
                 return last_session
 
+    def touch_session(self, session, timestamp):
+        session.end = timestamp
+        if self.user_id not in session.editors:
+            session.editors.append(self.user_id)
+        if isinstance(self.user_id, int):
+            session.updated_by_id = self.user_id
+
+    def save_session(self, session, content):
+        session.content = content
+        session.annotations = self.item.annotations
+        session.save()
+
     def update_session(self, timestamp):
         current_session = self.get_current_session(timestamp)
-        current_session.content = self.item.content
-        current_session.annotations = self.item.annotations
-        current_session.end = timestamp
-        if self.user_id not in current_session.editors:
-            current_session.editors.append(self.user_id)
-        if isinstance(self.user_id, int):
-            current_session.updated_by_id = self.user_id
-        current_session.save()
+        self.touch_session(current_session, timestamp)
+        self.save_session(current_session, self.item.content)
+
+
+# A short cache, the content schema of an item type is rarely updated
+_content_schema_cache = LRUCache(maxsize=1024, ttl=10)
+
+
+def get_item_content_schema(item_id):
+    """
+    Returns: The content schema of the item type of an item, as a dict name => field schema
+    """
+    content_schema = _content_schema_cache.get(item_id)
+    if content_schema is None:
+        content_schema = {
+            field_schema['name']: field_schema
+            for field_schema in Item.objects.filter(id=item_id).values_list('item_type__content_schema', flat=True).get()
+        }
+        _content_schema_cache.set(item_id, content_schema)
+    return content_schema
+
+
+# The delays between the retries of a failed compaction, in seconds
+COMPACTION_RETRY_INTERVALS = [10, 60, 300]
+
+
+def compact_item_changes(item_id):
+    ItemContentUpdater(None, item_id).compact_changes()
+
+    # Cleared only once compacted : a failed compaction is retried by RQ, then by compact_all_item_changes.
+    # The changes accepted during the compaction may not have scheduled another one, so schedule it now.
+    oplog.clear_scheduled_compaction(item_id)
+    if settings.REALTIME_COMPACTION_INTERVAL and oplog.has_pending_changes(item_id):
+        schedule_item_changes_compaction(item_id)
+
+
+def schedule_item_changes_compaction(item_id):
+    """
+    Compact the changes of the item at most once per REALTIME_COMPACTION_INTERVAL seconds
+    """
+    interval = settings.REALTIME_COMPACTION_INTERVAL
+    if not interval:
+        compact_item_changes(item_id)
+    elif oplog.schedule_compaction(item_id, interval):
+        high_priority_queue.enqueue_in(
+            datetime.timedelta(seconds=interval),
+            compact_item_changes,
+            item_id,
+            retry=Retry(max=len(COMPACTION_RETRY_INTERVALS), interval=COMPACTION_RETRY_INTERVALS)
+        )
+
+
+def compact_all_item_changes():
+    """
+    Compact the log of all the items with pending changes, whose compaction has failed or has been lost
+    ( Redis restart, RQ scheduler down ), before the log expires. Run by the `compact_item_changes` cron command.
+
+    Returns: The count of compacted and failed items
+    """
+    stats = {'compacted': 0, 'failed': 0}
+    for item_id in oplog.get_items_with_pending_changes():
+        # Already scheduled, and not failed yet
+        if oplog.is_compaction_scheduled(item_id):
+            continue
+        try:
+            compact_item_changes(item_id)
+            stats['compacted'] += 1
+        except Exception:
+            logger.error(f"[Realtime] Cannot compact the changes of the item {item_id}", exc_info=True)
+            stats['failed'] += 1
+    return stats
+
+
+@contextmanager
+def item_changes_compacted(item_id):
+    """
+    Compact the log before updating the content or the field versions of an item outside of the log,
+    and reload the versions from the database afterwards.
+    """
+    ItemContentUpdater(None, item_id).compact_changes()
+    try:
+        yield
+    finally:
+        oplog.reset_versions(item_id)
@@ -0,0 +1,233 @@
+import hashlib
+import json
+
+from pilot.utils.redis import redis_client
+
+__doc__ = '''
+Per-item log of the accepted live-edit changes, kept in Redis.
+
+The live-edit changes are accepted with an optimistic concurrency control :
+each field of an item have a version, and a change is accepted only if it has been made on the current version.
+The versions are kept in Redis, and checked and incremented atomically with the append to the log,
+so accepting a change does not need any lock on the Item row.
+
+The log is then compacted into Item.json_content and the EditSessions
+in the background ( see pilot.realtime.items.compact_item_changes ).
+
+Until the compaction, the database is behind the log, so the readers that need the up-to-date content
+must apply the pending changes on the item ( see apply_pending_changes ).
+'''
+
+OPLOG_REDIS_KEY_PREFIX = 'pilot:realtime:oplog'
+
+# A field that cannot be a content field name, to know if the versions have been loaded from the database
+VERSIONS_LOADED_FIELD = ':loaded'
+
+# The log and the versions are kept for a day after the last change.
+# The compaction should have run long before, so the versions are safely reloaded from the database afterwards.
+OPLOG_TTL = 24 * 60 * 60
+
+# Check the field versions, and append the accepted changes to the log, atomically.
+# KEYS : versions hash, log list
+# ARGV : ttl, then (field name, expected version, entry json) for each change
+# Returns nil if the versions are not loaded, else the list of the accepted field names
+ACCEPT_CHANGES_SCRIPT = '''
+if redis.call('HEXISTS', KEYS[1], ':loaded') == 0 then
+    return false
+end
+local accepted = {}
+for i = 2, #ARGV, 3 do
+    local current_version = tonumber(redis.call('HGET', KEYS[1], ARGV[i])) or 0
+    if current_version == tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[1], ARGV[i], current_version + 1)
+        redis.call('RPUSH', KEYS[2], ARGV[i + 2])
+        table.insert(accepted, ARGV[i])
+    end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return accepted
+'''
+
+# Remove the compacted entries from the head of the log.
+# A concurrent compaction may have removed some of them already, so start from the current head,
+# and stop at the first entry which has not been compacted.
+# KEYS : log list
+# ARGV : sha1 of the compacted entries, in order
+# Returns the number of entries removed
+REMOVE_COMPACTED_CHANGES_SCRIPT = '''
+local head = redis.call('LINDEX', KEYS[1], 0)
+if not head then
+    return 0
+end
+local start = nil
+for i = 1, #ARGV do
+    if ARGV[i] == redis.sha1hex(head) then
+        start = i
+        break
+    end
+end
+if not start then
+    return 0
+end
+local removed = 0
+for i = start, #ARGV do
+    head = redis.call('LINDEX', KEYS[1], 0)
+    if not head or redis.sha1hex(head) ~= ARGV[i] then
+        break
+    end
+    redis.call('LPOP', KEYS[1])
+    removed = removed + 1
+end
+return removed
+'''
+
+accept_changes_script = redis_client.register_script(ACCEPT_CHANGES_SCRIPT)
+remove_compacted_changes_script = redis_client.register_script(REMOVE_COMPACTED_CHANGES_SCRIPT)
+
+
+def get_versions_key(item_id):
+    return f'{OPLOG_REDIS_KEY_PREFIX}:{item_id}:versions'
+
+
+def get_log_key(item_id):
+    return f'{OPLOG_REDIS_KEY_PREFIX}:{item_id}:log'
+
+
+def get_compaction_key(item_id):
+    return f'{OPLOG_REDIS_KEY_PREFIX}:{item_id}:compaction'
+
+
+def load_versions(item_id, field_versions):
+    """
+    Initialize the versions of an item from the database.
+    Versions already loaded by a concurrent process are kept.
+    """
+    versions_key = get_versions_key(item_id)
+    pipeline = redis_client.pipeline()
+    for field_name, version in field_versions.items():
+        pipeline.hsetnx(versions_key, field_name, version)
+    pipeline.hset(versions_key, VERSIONS_LOADED_FIELD, 1)
+    pipeline.expire(versions_key, OPLOG_TTL)
+    pipeline.execute()
+
+
+def reset_versions(item_id):
+    """
+    The versions will be reloaded from the database on the next change.
+    Must be called after the field versions have been updated in the database outside of the log,
+    and after a compaction, so no accepted change is lost.
+    """
+    redis_client.delete(get_versions_key(item_id))
+
+
+def accept_changes(item_id, changes, load_field_versions):
+    """
+    Args:
+        changes: a list of entries ( dict ) with a `field_name` and the `version` the change has been made on
+        load_field_versions: a function that returns the field versions stored in the database
+
+    Returns: the set of the accepted field names
+    """
+    args = [OPLOG_TTL]
+    for entry in changes:
+        args += [entry['field_name'], entry['version'], json.dumps(entry)]
+
+    keys = [get_versions_key(item_id), get_log_key(item_id)]
+    accepted = accept_changes_script(keys=keys, args=args)
+    if accepted is None:
+        load_versions(item_id, load_field_versions())
+        accepted = accept_changes_script(keys=keys, args=args)
+
+    return {field_name.decode() for field_name in accepted}
+
+
+def has_pending_changes(item_id):
+    return redis_client.llen(get_log_key(item_id)) > 0
+
+
+def read_log(item_id):
+    """
+    Returns: the entries of the log, as json
+    """
+    return redis_client.lrange(get_log_key(item_id), 0, -1)
+
+
+def get_pending_changes(item_id):
+    return [json.loads(entry) for entry in read_log(item_id)]
+
+
+def remove_pending_changes(item_id, compacted_entries):
+    """
+    Remove the entries of the log once they have been compacted, `compacted_entries` being the json read by read_log.
+
+    The entries are identified by their content, not by their count,
+    so the entries removed meanwhile by a concurrent compaction are not counted twice.
+    """
+    if not compacted_entries:
+        return 0
+    return remove_compacted_changes_script(
+        keys=[get_log_key(item_id)],
+        args=[hashlib.sha1(entry).hexdigest() for entry in compacted_entries]
+    )
+
+
+def schedule_compaction(item_id, interval):
+    """
+    Returns: True if no compaction is already scheduled for this item in the next `interval` seconds
+    """
+    return bool(redis_client.set(get_compaction_key(item_id), 1, nx=True, ex=interval))
+
+
+def clear_scheduled_compaction(item_id):
+    redis_client.delete(get_compaction_key(item_id))
+
+
+def is_compaction_scheduled(item_id):
+    return bool(redis_client.exists(get_compaction_key(item_id)))
+
+
+def get_items_with_pending_changes():
+    """
+    Returns: The ids of the items with a non-empty log, Redis deleting the empty lists
+    """
+    log_key_pattern = get_log_key('*')
+    prefix, suffix = log_key_pattern.split('*')
+    return [
+        int(key.decode()[len(prefix):-len(suffix)])
+        for key in redis_client.scan_iter(match=log_key_pattern)
+    ]
+
+
+def apply_change(item, entry):
+    """
+    Apply a log entry on an item ( or any ItemContentMixin with field_versions and annotations ), in memory.
+
+    Applying the same entry twice is harmless, so a compaction interrupted before the removal of the compacted entries
+    can safely be replayed.
+
+    Returns: True if the content has been changed, False for annotations-only changes
+    """
+    field_name = entry['field_name']
+    item.field_versions[field_name] = max(item.field_versions.get(field_name, 0), entry['version'] + 1)
+
+    if 'annotations' in entry:
+        if item.annotations is None:
+            item.annotations = {}
+        item.annotations[entry['annotations_key']] = entry['annotations']
+
+    if 'value' in entry:
+        item.content[field_name] = entry['value']
+        return True
+    return False
+
+
+def apply_pending_changes(item):
+    """
+    Bring an item fetched from the database up to date with the changes not compacted yet
+    """
+    for entry in get_pending_changes(item.id):
+        apply_change(item, entry)
+        item.last_editor = entry['user_id']
+        item.last_edition_datetime = entry['timestamp']
+    return item
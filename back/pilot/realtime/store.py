@@ -1,10 +1,27 @@
 import datetime
+import json
 import random
+import time
 from cacheout import LRUCache
 
 from django.conf import settings
 from django.utils import timezone
 
+from pilot.utils.redis import redis_client
+
+__doc__ = '''
+Presence of the users connected to the realtime server.
+
+The presence is kept in a store, with two backends :
+ - RedisStore, shared by all the realtime server processes, so users connected to different processes
+   on the same item see each other, and get different colors.
+ - MemoryStore, local to the process, used for the tests.
+
+Each user registered on an item have a deadline, pushed back each time he breathes.
+Users whose deadline has passed are purged from the store when reading the users on the item,
+and their connection is closed.
+'''
+
 user_colors = [
     '#911eb4',
     '#008080',
@@ -24,6 +41,10 @@ if settings.DEBUG:
 else:
     BREATHING_TIME_BEFORE_DEATH = datetime.timedelta(minutes=30)
 
+# Do not push back the deadline in the store at each message received from a user
+BREATHING_REFRESH_INTERVAL = datetime.timedelta(seconds=30)
+
+
 class RealtimeUser(object):
     """
     Represent a user connected to our server through a websocket.
@@ -52,7 +73,9 @@ class RealtimeUser(object):
 
         # The django-channel Consumer instance through this user is connected to the realtime server
         self.consumer = consumer
-        # The timestamp of the last activity of this user
+        # The channel name of the consumer identify the connection across all the realtime server processes
+        self.connection_id = consumer.channel_name
+        # The timestamp of the last time the liveness of this user has been sent to the store
         self.last_breathing = timezone.now()
         # The item id where the user is currently connected
         self.item_id = None
@@ -65,84 +88,316 @@ class RealtimeUser(object):
         # The color of the user on the registered item
         self.color = None
 
-    def breath(self):
-        self.last_breathing = timezone.now()
-
-    def is_dead(self):
-        return timezone.now() - self.last_breathing > BREATHING_TIME_BEFORE_DEATH
+        # The identity does not change during the connection, serialize it once
+        if self.dj_user:
+            self.username = self.dj_user.username
+            self.avatar = self.dj_user.get_avatar_url()
+        else:
+            self.username = self.email
+            self.avatar = None
 
     def to_dict(self):
-        user_dict = {
+        return {
             'id': self.id,
             'color': self.color,
             'field_focus': self.field_focus,
             'selection': self.selection,
-            'field_updating': self.field_updating
+            'field_updating': self.field_updating,
+            'username': self.username,
+            'avatar': self.avatar,
         }
-        if self.dj_user:
-            user_dict.update({
-                'username': self.dj_user.username,
-                'avatar': self.dj_user.get_avatar_url()
-            })
-        else:
-            user_dict.update({
-                'username': self.email,
-                'avatar': None
-            })
-
-        return user_dict
 
 
 class Store():
     """
-    Keep track of all users connected to the realtime server,
-    and which user is registered on which item.
+    Keep track of which user is registered on which item.
+
+    Subclasses store the presence of the users, represented by the result of RealtimeUser.to_dict(),
+    by item id and connection id.
     """
-    def __init__(self):
-        # userId => RealtimeUser
-        # self.users = LRUCache(
-        #     maxsize=4096,
-        #     ttl=0,
-        # )
-        # itemId -> set([RealtimeUser, ...])
-        self.users_on_item = LRUCache(
-            maxsize=4096,
-            ttl=0,
-            default=lambda key: set()
-        )
+    def __init__(self, time_before_death=BREATHING_TIME_BEFORE_DEATH):
+        self.time_before_death = time_before_death.total_seconds()
+
+    def get_deadline(self):
+        return time.time() + self.time_before_death
 
     def add_user(self, user):
         pass
-        # self.users.set(user.id, user)
 
     def remove_user(self, user):
-        # self.users.delete(user.id)
-        if user.item_id and user.item_id in self.users_on_item:
-            self.users_on_item.get(user.item_id).discard(user)
-
-    def get_users_on_item(self, item_id):
-        return self.users_on_item.get(item_id, [])
+        if user.item_id:
+            self.remove_presence(user.item_id, user.connection_id)
 
     def register_user_on_item(self, user, item_id):
+        """
+        Returns: The id of the item the user has left, if any, where the users on item must be broadcasted
+        """
+        # A connection is registered on a single item at a time
+        previous_item_id = None
+        if user.item_id and user.item_id != item_id:
+            previous_item_id = user.item_id
+            self.remove_user(user)
+
         user.item_id = item_id
-        users_on_this_item = self.users_on_item.get(item_id)
+        user.last_breathing = timezone.now()
+        user.color = self.add_presence(
+            item_id,
+            user.connection_id,
+            user.to_dict(),
+            random.sample(user_colors, len(user_colors))
+        )
+        return previous_item_id
+
+    def update_user(self, user):
+        """
+        Store the new activity of a user ( field focus, selection, etc... )
+        """
+        if user.item_id:
+            user.last_breathing = timezone.now()
+            self.update_presence(user.item_id, user.connection_id, user.to_dict())
+
+    def breath(self, user):
+        """
+        Keep the user alive
+        """
+        if not user.item_id or timezone.now() - user.last_breathing < BREATHING_REFRESH_INTERVAL:
+            return
+        user.last_breathing = timezone.now()
+        self.refresh_presence(user.item_id, user.connection_id)
+
+    def get_users_on_item(self, item_id):
+        """
+        Returns: A tuple (users, dead_connections), with the living users represented as dicts,
+                 and the connection ids of the users which has been purged because they did not breathe in time.
+        """
+        if not item_id:
+            return [], []
+        return self.get_presence(item_id)
+
+    # ===================
+    # Backend API
+    # ===================
+
+    def add_presence(self, item_id, connection_id, user_dict, colors):
+        """
+        Returns: The first color of `colors` not used by the other users on the item, or None
+        """
+        raise NotImplementedError()
+
+    def update_presence(self, item_id, connection_id, user_dict):
+        raise NotImplementedError()
+
+    def refresh_presence(self, item_id, connection_id):
+        raise NotImplementedError()
+
+    def remove_presence(self, item_id, connection_id):
+        raise NotImplementedError()
+
+    def get_presence(self, item_id):
+        raise NotImplementedError()
+
+
+class MemoryStore(Store):
+    """
+    Store the presence in the current process
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # itemId -> {connectionId: {'user': user_dict, 'deadline': timestamp}}
+        self.users_on_item = LRUCache(
+            maxsize=4096,
+            ttl=0,
+            default=lambda key: {}
+        )
+
+    def add_presence(self, item_id, connection_id, user_dict, colors):
+        presences = self.users_on_item.get(item_id)
+        used_colors = [
+            presence['user']['color']
+            for other_connection_id, presence in presences.items()
+            if other_connection_id != connection_id
+        ]
+        color = next((color for color in colors if color not in used_colors), None)
+
+        user_dict['color'] = color
+        presences[connection_id] = {'user': user_dict, 'deadline': self.get_deadline()}
+        return color
+
+    def update_presence(self, item_id, connection_id, user_dict):
+        presence = self.users_on_item.get(item_id).get(connection_id)
+        # The user may have been purged meanwhile
+        if presence:
+            user_dict['color'] = presence['user']['color']
+            presence.update(user=user_dict, deadline=self.get_deadline())
+
+    def refresh_presence(self, item_id, connection_id):
+        presence = self.users_on_item.get(item_id).get(connection_id)
+        if presence:
+            presence['deadline'] = self.get_deadline()
+
+    def remove_presence(self, item_id, connection_id):
+        if item_id in self.users_on_item:
+            self.users_on_item.get(item_id).pop(connection_id, None)
+
+    def get_presence(self, item_id):
+        presences = self.users_on_item.get(item_id)
+        now = time.time()
+        dead_connections = [
+            connection_id
+            for connection_id, presence in presences.items()
+            if presence['deadline'] < now
+        ]
+        for connection_id in dead_connections:
+            del presences[connection_id]
+
+        return [presence['user'] for presence in presences.values()], dead_connections
+
+
+# Purge the dead users on an item, then allocate a color to the new user, atomically.
+# KEYS : users hash, colors hash, deadlines sorted set
+# ARGV : now, deadline, key ttl, connection id, user json, colors...
+ADD_PRESENCE_SCRIPT = '''
+local dead = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+for _, connection_id in ipairs(dead) do
+    redis.call('HDEL', KEYS[1], connection_id)
+    redis.call('HDEL', KEYS[2], connection_id)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+
+redis.call('HDEL', KEYS[2], ARGV[4])
+local used = {}
+for _, color in ipairs(redis.call('HVALS', KEYS[2])) do
+    used[color] = true
+end
+local color = false
+for i = 6, #ARGV do
+    if not used[ARGV[i]] then
+        color = ARGV[i]
+        break
+    end
+end
+
+if color then
+    redis.call('HSET', KEYS[2], ARGV[4], color)
+end
+redis.call('HSET', KEYS[1], ARGV[4], ARGV[5])
+redis.call('ZADD', KEYS[3], ARGV[2], ARGV[4])
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], ARGV[3])
+end
+return color
+'''
+
+# Update the user dict, only if the user has not been purged meanwhile
+# KEYS : users hash, deadlines sorted set
+# ARGV : deadline, key ttl, connection id, user json
+UPDATE_PRESENCE_SCRIPT = '''
+if not redis.call('ZSCORE', KEYS[2], ARGV[3]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[3], ARGV[4])
+redis.call('ZADD', KEYS[2], ARGV[1], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+'''
+
+# Purge the dead users on an item, and return the living ones
+# KEYS : users hash, colors hash, deadlines sorted set
+# ARGV : now
+GET_PRESENCE_SCRIPT = '''
+local dead = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+for _, connection_id in ipairs(dead) do
+    redis.call('HDEL', KEYS[1], connection_id)
+    redis.call('HDEL', KEYS[2], connection_id)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[1])
+return {dead, redis.call('HGETALL', KEYS[1]), redis.call('HGETALL', KEYS[2])}
+'''
+
+
+class RedisStore(Store):
+    """
+    Store the presence in Redis, for all the realtime server processes.
+
+    Each item have :
+     - a hash of the users json, by connection id
+     - a hash of the users colors, by connection id
+     - a sorted set of the connection ids, scored by their deadline
+
+    The keys expire after BREATHING_TIME_BEFORE_DEATH, so the items without any living user are cleaned up by Redis.
+    """
+    KEY_PREFIX = 'pilot:realtime:item'
+
+    def __init__(self, redis, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.redis = redis
+        # The keys outlive the deadlines, so the dead users can still be purged and their connection closed
+        self.key_ttl = max(int(self.time_before_death), 0) + 60
+        self.add_presence_script = redis.register_script(ADD_PRESENCE_SCRIPT)
+        self.update_presence_script = redis.register_script(UPDATE_PRESENCE_SCRIPT)
+        self.get_presence_script = redis.register_script(GET_PRESENCE_SCRIPT)
+
+    def get_keys(self, item_id):
+        return [
+            f'{self.KEY_PREFIX}:{item_id}:users',
+            f'{self.KEY_PREFIX}:{item_id}:colors',
+            f'{self.KEY_PREFIX}:{item_id}:deadlines',
+        ]
+
+    def add_presence(self, item_id, connection_id, user_dict, colors):
+        color = self.add_presence_script(
+            keys=self.get_keys(item_id),
+            args=[time.time(), self.get_deadline(), self.key_ttl, connection_id, json.dumps(user_dict)] + colors
+        )
+        return color.decode() if color else None
+
+    def update_presence(self, item_id, connection_id, user_dict):
+        users_key, _, deadlines_key = self.get_keys(item_id)
+        self.update_presence_script(
+            keys=[users_key, deadlines_key],
+            args=[self.get_deadline(), self.key_ttl, connection_id, json.dumps(user_dict)]
+        )
+
+    def refresh_presence(self, item_id, connection_id):
+        keys = self.get_keys(item_id)
+        pipeline = self.redis.pipeline()
+        # Do not resurrect a user already purged
+        pipeline.zadd(keys[2], {connection_id: self.get_deadline()}, xx=True)
+        for key in keys:
+            pipeline.expire(key, self.key_ttl)
+        pipeline.execute()
+
+    def remove_presence(self, item_id, connection_id):
+        users_key, colors_key, deadlines_key = self.get_keys(item_id)
+        pipeline = self.redis.pipeline()
+        pipeline.hdel(users_key, connection_id)
+        pipeline.hdel(colors_key, connection_id)
+        pipeline.zrem(deadlines_key, connection_id)
+        pipeline.execute()
+
+    def get_presence(self, item_id):
+        dead_connections, users, colors = self.get_presence_script(
+            keys=self.get_keys(item_id),
+            args=[time.time()]
+        )
+        # HGETALL results are flat lists [key1, value1, key2, value2, ...]
+        colors = dict(zip(colors[::2], colors[1::2]))
+
+        user_dicts = []
+        for connection_id, user_json in zip(users[::2], users[1::2]):
+            user_dict = json.loads(user_json)
+            color = colors.get(connection_id)
+            user_dict['color'] = color.decode() if color else None
+            user_dicts.append(user_dict)
 
-        used_colors = [user.color for user in users_on_this_item]
-        for color in random.sample(user_colors, len(user_colors)):
-            if color not in used_colors:
-                user.color = color
-                break
+        return user_dicts, [connection_id.decode() for connection_id in dead_connections]
 
-        users_on_this_item.add(user)
 
-    def eliminate_dead_connections(self, item_id):
-        dead_connections = []
-        # Make a copy of the set, so we d'ont run into concurrent edition issues
-        for user in list(self.users_on_item.get(item_id)):
-            if user.is_dead():
-                self.remove_user(user)
-                dead_connections.append(user)
-        return dead_connections
+def create_store():
+    if settings.REALTIME_PRESENCE_STORE == 'redis':
+        return RedisStore(redis_client)
+    return MemoryStore()
 
 
-store = Store()
+store = create_store()
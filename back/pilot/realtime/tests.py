@@ -0,0 +1,241 @@
+import datetime
+import time
+
+import mock
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from pilot.items.models import Item
+from pilot.items.tests import factories as items_factories
+from pilot.realtime import oplog
+from pilot.realtime.broadcasting import BroadcastScheduler, Broadcaster
+from pilot.realtime.items import ItemContentUpdater, compact_all_item_changes, compact_item_changes
+from pilot.realtime.store import MemoryStore, RedisStore, RealtimeUser, user_colors
+from pilot.utils.redis import redis_client
+from pilot.utils.test import PilotAdminUserMixin
+
+ITEM_ID = 'tests'
+
+
+class StoreTestMixin(object):
+    def create_store(self, time_before_death=datetime.timedelta(minutes=30)):
+        raise NotImplementedError()
+
+    def clear_item(self, item_id):
+        pass
+
+    def create_user(self, email):
+        consumer = mock.Mock(channel_name=f'channel-{email}')
+        return RealtimeUser(consumer, sharing=mock.Mock(email=email))
+
+    def test_users_on_item(self):
+        store = self.create_store()
+        alice = self.create_user('alice@example.com')
+        bob = self.create_user('bob@example.com')
+
+        store.register_user_on_item(alice, ITEM_ID)
+        store.register_user_on_item(bob, ITEM_ID)
+
+        users, dead_connections = store.get_users_on_item(ITEM_ID)
+        self.assertEqual(dead_connections, [])
+        self.assertEqual(
+            sorted((user['id'], user['color']) for user in users),
+            [(alice.id, alice.color), (bob.id, bob.color)]
+        )
+
+        alice.field_focus = 'title'
+        store.update_user(alice)
+        users, _ = store.get_users_on_item(ITEM_ID)
+        self.assertIn('title', [user['field_focus'] for user in users])
+
+        store.remove_user(bob)
+        users, _ = store.get_users_on_item(ITEM_ID)
+        self.assertEqual([user['id'] for user in users], [alice.id])
+
+    def test_register_on_another_item(self):
+        store = self.create_store()
+        alice = self.create_user('alice@example.com')
+        other_item_id = f'{ITEM_ID}-other'
+        self.addCleanup(self.clear_item, other_item_id)
+
+        self.assertIsNone(store.register_user_on_item(alice, ITEM_ID))
+        self.assertIsNone(store.register_user_on_item(alice, ITEM_ID))
+        # The item left is returned, so its users can be broadcasted
+        self.assertEqual(store.register_user_on_item(alice, other_item_id), ITEM_ID)
+
+        self.assertEqual(store.get_users_on_item(ITEM_ID), ([], []))
+        users, _ = store.get_users_on_item(other_item_id)
+        self.assertEqual([user['id'] for user in users], [alice.id])
+
+    def test_colors_are_unique(self):
+        store = self.create_store()
+        users = [self.create_user(f'user{i}@example.com') for i in range(len(user_colors) + 1)]
+        for user in users:
+            store.register_user_on_item(user, ITEM_ID)
+
+        colors = [user.color for user in users[:-1]]
+        self.assertCountEqual(colors, user_colors)
+        # No color left for the last one
+        self.assertIsNone(users[-1].color)
+
+        # The color of a leaving user is available again
+        store.remove_user(users[0])
+        store.register_user_on_item(users[-1], ITEM_ID)
+        self.assertEqual(users[-1].color, users[0].color)
+
+    def test_dead_connections(self):
+        store = self.create_store(time_before_death=datetime.timedelta(seconds=-1))
+        alice = self.create_user('alice@example.com')
+        store.register_user_on_item(alice, ITEM_ID)
+
+        users, dead_connections = store.get_users_on_item(ITEM_ID)
+        self.assertEqual(users, [])
+        self.assertEqual(dead_connections, [alice.connection_id])
+
+        # Already purged
+        self.assertEqual(store.get_users_on_item(ITEM_ID), ([], []))
+
+
+class MemoryStoreTest(StoreTestMixin, SimpleTestCase):
+    def create_store(self, time_before_death=datetime.timedelta(minutes=30)):
+        return MemoryStore(time_before_death=time_before_death)
+
+
+class RedisStoreTest(StoreTestMixin, SimpleTestCase):
+    def tearDown(self):
+        self.clear_item(ITEM_ID)
+
+    def clear_item(self, item_id):
+        redis_client.delete(*RedisStore(redis_client).get_keys(item_id))
+
+    def create_store(self, time_before_death=datetime.timedelta(minutes=30)):
+        return RedisStore(redis_client, time_before_death=time_before_death)
+
+
+class BroadcastSchedulerTest(SimpleTestCase):
+    def wait_window(self):
+        time.sleep(0.2)
+
+    def test_schedule(self):
+        broadcast = mock.Mock(__name__='broadcast')
+        scheduler = BroadcastScheduler(window=0.05)
+        for i in range(3):
+            scheduler.schedule(('users_on_item', 1), broadcast, 1)
+        scheduler.schedule(('users_on_item', 2), broadcast, 2)
+
+        self.wait_window()
+        self.assertEqual(broadcast.call_args_list, [mock.call(1), mock.call(2)])
+
+    def test_merge_changes(self):
+        broadcast = mock.Mock(__name__='broadcast')
+        scheduler = BroadcastScheduler(window=0.05)
+        scheduler.merge_changes(1, 'editor', {'title': 1}, broadcast, session=1)
+        scheduler.merge_changes(1, 'editor', {'body': 1}, broadcast, session=2)
+        # Conflict on the same field, the pending changes are sent right away, with the last session
+        scheduler.merge_changes(1, 'editor', {'body': 2}, broadcast, session=3)
+        self.assertEqual(broadcast.call_args_list, [mock.call(item_id=1, changes={'title': 1, 'body': 1}, session=2)])
+
+        # The broadcast sent early is not sent again by the worker
+        self.wait_window()
+        self.assertEqual(broadcast.call_args_list[1:], [mock.call(item_id=1, changes={'body': 2}, session=3)])
+
+
+class BroadcasterTest(PilotAdminUserMixin, TestCase):
+    @override_settings(REALTIME_BROADCAST_WINDOW=0.05)
+    def test_broadcast_item_changes_queries(self):
+        item = items_factories.ItemFactory.create(desk=self.desk)
+        broadcaster = Broadcaster()
+        broadcaster.broadcast = mock.Mock()
+        # The editor is memoized
+        broadcaster.broadcast_item_changes(item.id, self.user.id, {'title': {'value': 'First'}})
+
+        # The session is fetched once for the window
+        with self.assertNumQueries(0):
+            broadcaster.broadcast_item_changes(item.id, self.user.id, {'body': {'value': 'Body'}})
+            broadcaster.broadcast_item_changes(item.id, self.user.id, {'title': {'value': 'Second'}})
+
+        time.sleep(0.2)
+        self.assertEqual(broadcaster.broadcast.call_count, 2)
+
+
+@mock.patch('pilot.realtime.items.broadcaster')
+class ItemContentUpdaterTest(PilotAdminUserMixin, TestCase):
+    def setUp(self):
+        super(ItemContentUpdaterTest, self).setUp()
+        self.item = items_factories.ItemFactory.create(desk=self.desk)
+
+    def tearDown(self):
+        redis_client.delete(
+            oplog.get_versions_key(self.item.id),
+            oplog.get_log_key(self.item.id),
+            oplog.get_compaction_key(self.item.id)
+        )
+
+    def apply_title(self, title, version):
+        changes = {'title': {'value': title, 'version': version}}
+        return ItemContentUpdater(self.user.id, self.item.id).apply_changes(changes)
+
+    def test_optimistic_concurrency(self, mock_broadcaster):
+        update_result = self.apply_title('First', 0)
+        self.assertEqual(update_result['accepted']['title']['version'], 1)
+        mock_broadcaster.broadcast_item_changes.assert_called_once()
+
+        # Made on the same version, concurrently with the first one
+        update_result = self.apply_title('Second', 0)
+        self.assertIn('title', update_result['rejected'])
+
+        item = Item.objects.get(id=self.item.id)
+        self.assertEqual(item.content['title'], 'First')
+        self.assertEqual(item.field_versions['title'], 1)
+        self.assertEqual(item.last_session.content['title'], 'First')
+
+    @override_settings(REALTIME_COMPACTION_INTERVAL=60)
+    @mock.patch('pilot.realtime.items.high_priority_queue')
+    def test_compaction(self, mock_queue, mock_broadcaster):
+        self.apply_title('First', 0)
+        self.apply_title('Second', 1)
+        # A single compaction is scheduled
+        mock_queue.enqueue_in.assert_called_once()
+
+        item = Item.objects.get(id=self.item.id)
+        self.assertNotEqual(item.content['title'], 'Second')
+        oplog.apply_pending_changes(item)
+        self.assertEqual(item.content['title'], 'Second')
+
+        compact_item_changes(self.item.id)
+        self.assertFalse(oplog.has_pending_changes(self.item.id))
+        item = Item.objects.get(id=self.item.id)
+        self.assertEqual(item.content['title'], 'Second')
+        self.assertEqual(item.field_versions['title'], 2)
+
+    @override_settings(REALTIME_COMPACTION_INTERVAL=60)
+    @mock.patch('pilot.realtime.items.high_priority_queue')
+    def test_concurrent_compactions(self, mock_queue, mock_broadcaster):
+        self.apply_title('First', 0)
+        compacted_log = oplog.read_log(self.item.id)
+        self.apply_title('Second', 1)
+
+        self.assertEqual(oplog.remove_pending_changes(self.item.id, compacted_log), 1)
+        # Another compaction of the same entries does not remove the newer ones
+        self.assertEqual(oplog.remove_pending_changes(self.item.id, compacted_log), 0)
+        self.assertEqual([entry['value'] for entry in oplog.get_pending_changes(self.item.id)], ['Second'])
+
+    @override_settings(REALTIME_COMPACTION_INTERVAL=60)
+    @mock.patch('pilot.realtime.items.high_priority_queue')
+    def test_failed_compaction(self, mock_queue, mock_broadcaster):
+        self.apply_title('First', 0)
+        # Retried by RQ
+        self.assertIsNotNone(mock_queue.enqueue_in.call_args[1]['retry'])
+
+        with mock.patch.object(ItemContentUpdater, 'compact_changes', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                compact_item_changes(self.item.id)
+        self.assertTrue(oplog.has_pending_changes(self.item.id))
+        self.assertTrue(oplog.is_compaction_scheduled(self.item.id))
+
+        # The retries are exhausted, and the scheduling has expired : the sweep compacts the item
+        oplog.clear_scheduled_compaction(self.item.id)
+        self.assertIn(self.item.id, oplog.get_items_with_pending_changes())
+        self.assertEqual(compact_all_item_changes()['failed'], 0)
+        item = Item.objects.get(id=self.item.id)
+        self.assertEqual(item.content['title'], 'First')
@@ -0,0 +1,106 @@
+"""
+The settings and mappings of the Elasticsearch indices, used when they are created by `rebuild_index`
+"""
+
+INDEX_SETTINGS = {
+    "number_of_shards": 1,
+    "analysis": {
+        "filter": {
+            "autocomplete_filter": {
+                "type": "edge_ngram",
+                "min_gram": 1,
+                "max_gram": 20
+            },
+        },
+        "analyzer": {
+            "autocomplete": {
+                "type": "custom",
+                "tokenizer": "standard",
+                "filter": [
+                    "lowercase",
+                    "asciifolding",
+                    "stop",
+                    "autocomplete_filter"
+                ]
+            },
+            "custom_search_analyzer": {
+                "type": "custom",
+                "tokenizer": "standard",
+                "filter": [
+                    "lowercase",
+                    "asciifolding"
+                ]
+            },
+        }
+    }
+}
+
+
+ITEM_INDEX_BODY = {
+    "settings": INDEX_SETTINGS,
+
+    "mappings": {
+        "_source": {"enabled": True},
+        "properties": {
+            "id": {
+                "type": "integer"
+            },
+            "title": {
+                "type": "text",
+                "analyzer": "autocomplete",
+                "search_analyzer": "custom_search_analyzer",
+                "boost": 2
+            },
+            "content": {
+                "type": "text",
+                "analyzer": "autocomplete",
+                "search_analyzer": "custom_search_analyzer"
+            },
+            "language": {
+                "type": "text"
+            },
+            "url": {
+                "type": "text",
+                "index": False
+            },
+            "in_trash": {
+                "type": "boolean",
+            },
+            "hidden": {
+                "type": "boolean",
+            },
+        }
+    }
+}
+
+
+PROJECT_INDEX_BODY = {
+    "settings": INDEX_SETTINGS,
+
+    "mappings": {
+        "_source": {"enabled": True},
+        "properties": {
+            "id": {
+                "type": "integer"
+            },
+            "name": {
+                "type": "text",
+                "analyzer": "autocomplete",
+                "search_analyzer": "custom_search_analyzer",
+                "boost": 2
+            },
+            "description": {
+                "type": "text",
+                "analyzer": "autocomplete",
+                "search_analyzer": "custom_search_analyzer"
+            },
+            "url": {
+                "type": "text",
+                "index": False
+            },
+            "hidden": {
+                "type": "boolean",
+            },
+        }
+    }
+}
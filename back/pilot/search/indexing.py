@@ -0,0 +1,251 @@
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from elasticsearch import helpers
+
+from pilot.items.models import Item
+from pilot.projects.models import Project
+from pilot.queue.rq_setup import low_priority_queue
+from pilot.search.api.serializers import ItemSearchDocTypeSerializer, ProjectSearchDocTypeSerializer
+from pilot.search.index_settings import ITEM_INDEX_BODY, PROJECT_INDEX_BODY
+from pilot.utils.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+__doc__ = '''
+Asynchronous indexing of the items and projects into Elasticsearch.
+
+The saves only add the instances to a Redis set ( see schedule_es_indexing ), once the transaction is committed,
+so they don't wait for Elasticsearch, and the saves of the same instance are indexed only once.
+
+The set is then drained by run_es_indexing, a few seconds later in a RQ job,
+and by the `es_indexing` cron command, which also retries the failed documents.
+The documents are sent with the _bulk API, versioned by the `updated_at` of the instances,
+so an older state never overwrite a newer one.
+
+While `rebuild_index` fills a new index, the documents are written both in the current index and in the new one,
+so the rebuild doesn't miss the saves made during it.
+'''
+
+ES_INDEXING_REDIS_KEY = 'pilot:es_indexing'
+ES_INDEXING_SCHEDULED_REDIS_KEY = 'pilot:es_indexing:scheduled'
+
+# Number of instances loaded and serialized together
+ES_INDEXING_BATCH_SIZE = 500
+# Size bounds of a single _bulk request
+ES_INDEXING_CHUNK_SIZE = 500
+ES_INDEXING_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+# Retries of the documents rejected by a busy cluster ( 429 ), with an exponential backoff in seconds
+ES_INDEXING_MAX_RETRIES = 3
+ES_INDEXING_INITIAL_BACKOFF = 1
+ES_INDEXING_MAX_BACKOFF = 30
+
+# A scheduled run is cleared by its job.
+# The expiration is only a safety net if the job is lost, so the next saves schedule a new one.
+ES_INDEXING_SCHEDULED_TTL = 10 * 60
+
+# The progress of `rebuild_index` for a doc type : the name of the new index, and the last indexed id
+REBUILD_INDEX_REDIS_KEY = 'pilot:rebuild_index:{}'
+
+
+class IndexedModel:
+    def __init__(self, doc_type, model, serializer_class, index_setting, index_body,
+                 select_related=(), prefetch_related=()):
+        self.doc_type = doc_type
+        self.model = model
+        self.serializer_class = serializer_class
+        self.index_setting = index_setting
+        self.index_body = index_body
+        self.select_related = select_related
+        self.prefetch_related = prefetch_related
+
+    @property
+    def index(self):
+        """
+        The alias of the current index, swapped by `rebuild_index`
+        """
+        return getattr(settings, self.index_setting)
+
+    def get_rebuild_checkpoint(self):
+        return redis_client.hgetall(REBUILD_INDEX_REDIS_KEY.format(self.doc_type))
+
+    def get_write_indices(self):
+        indices = [self.index]
+        rebuilt_index = self.get_rebuild_checkpoint().get(b'index')
+        if rebuilt_index:
+            indices.append(rebuilt_index.decode())
+        return indices
+
+    def get_queryset(self):
+        # The queryset of get_search_values, with the relations of the serializer
+        queryset = self.model.get_search_vector_update_queryset()
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        return queryset.prefetch_related(*self.prefetch_related)
+
+
+INDEXED_MODELS = {
+    'item': IndexedModel(
+        'item', Item, ItemSearchDocTypeSerializer, 'ES_ITEM_INDEX', ITEM_INDEX_BODY,
+        select_related=('project',),
+        prefetch_related=('channels', 'tags', 'targets')
+    ),
+    'project': IndexedModel(
+        'project', Project, ProjectSearchDocTypeSerializer, 'ES_PROJECT_INDEX', PROJECT_INDEX_BODY,
+        prefetch_related=('channels', 'tags', 'targets')
+    ),
+}
+
+DOC_TYPES_BY_MODEL = {indexed_model.model: doc_type for doc_type, indexed_model in INDEXED_MODELS.items()}
+
+
+def schedule_es_indexing(model, instance_ids):
+    """
+    Index the instances in the background, once the current transaction is committed
+    """
+    if settings.ES_DISABLED or not instance_ids:
+        return
+
+    doc_type = DOC_TYPES_BY_MODEL[model]
+    elements = [f'{doc_type},{instance_id}' for instance_id in instance_ids]
+    transaction.on_commit(lambda: add_es_indexing_elements(elements))
+
+
+def add_es_indexing_elements(elements):
+    try:
+        redis_client.sadd(ES_INDEXING_REDIS_KEY, *elements)
+        # A single run absorbs all the saves made until it starts
+        if redis_client.set(ES_INDEXING_SCHEDULED_REDIS_KEY, 1, nx=True, ex=ES_INDEXING_SCHEDULED_TTL):
+            low_priority_queue.enqueue_in(
+                datetime.timedelta(seconds=settings.ES_INDEXING_DELAY),
+                run_es_indexing,
+                result_ttl=0
+            )
+    except:
+        logger.error(f"[ES Indexing Error] Could not schedule the indexing of {elements}", exc_info=True)
+
+
+def get_document_version(instance):
+    # In microseconds, so two saves in the same second don't get the same version
+    return int(instance.updated_at.timestamp() * 1000000)
+
+
+def get_index_actions(indexed_model, instance, indices):
+    source = indexed_model.serializer_class(instance).data
+    for index in indices:
+        yield {
+            '_op_type': 'index',
+            '_index': index,
+            '_id': instance.id,
+            # external_gte, so the M2M changes, which don't touch updated_at, are still indexed
+            '_version': get_document_version(instance),
+            '_version_type': 'external_gte',
+            '_source': source,
+        }
+
+
+def get_bulk_actions(indexed_model, instance_ids):
+    """
+    The index actions of the instances, and the delete actions of those which don't exist anymore
+    """
+    indices = indexed_model.get_write_indices()
+    instances = indexed_model.get_queryset().filter(id__in=instance_ids)
+    for instance in instances:
+        yield from get_index_actions(indexed_model, instance, indices)
+        instance_ids.discard(instance.id)
+
+    for instance_id in instance_ids:
+        for index in indices:
+            yield {
+                '_op_type': 'delete',
+                '_index': index,
+                '_id': instance_id,
+            }
+
+
+def is_bulk_item_ok(ok, result):
+    if ok:
+        return True
+
+    op_type, item = next(iter(result.items()))
+    # A newer version of the document has already been indexed
+    if item.get('status') == 409:
+        return True
+    # Already absent from the index
+    if op_type == 'delete' and item.get('status') == 404:
+        return True
+    return False
+
+
+def run_es_indexing(batch_size=ES_INDEXING_BATCH_SIZE):
+    """
+    Index the instances scheduled with `schedule_es_indexing`, by batches, with the _bulk API.
+    The documents which could not be indexed are scheduled again for the next run.
+
+    Returns: a dict of throughput stats
+    """
+    # New saves must schedule a new run
+    redis_client.delete(ES_INDEXING_SCHEDULED_REDIS_KEY)
+
+    stats = {
+        'batches': 0,
+        'indexed': 0,
+        'deleted': 0,
+        'errors': 0,
+    }
+    start = time.monotonic()
+    failed_elements = []
+
+    while True:
+        elements = redis_client.spop(ES_INDEXING_REDIS_KEY, batch_size)
+        if not elements:
+            break
+        stats['batches'] += 1
+
+        instance_ids_by_doc_type = {}
+        for element in elements:
+            doc_type, instance_id = element.decode().split(',')
+            instance_ids_by_doc_type.setdefault(doc_type, set()).add(int(instance_id))
+
+        for doc_type, instance_ids in instance_ids_by_doc_type.items():
+            indexed_model = INDEXED_MODELS[doc_type]
+            try:
+                results = helpers.streaming_bulk(
+                    settings.ES_CLIENT,
+                    get_bulk_actions(indexed_model, set(instance_ids)),
+                    chunk_size=ES_INDEXING_CHUNK_SIZE,
+                    max_chunk_bytes=ES_INDEXING_MAX_CHUNK_BYTES,
+                    max_retries=ES_INDEXING_MAX_RETRIES,
+                    initial_backoff=ES_INDEXING_INITIAL_BACKOFF,
+                    max_backoff=ES_INDEXING_MAX_BACKOFF,
+                    raise_on_error=False,
+                    raise_on_exception=False,
+                )
+                for ok, result in results:
+                    op_type, item = next(iter(result.items()))
+                    if is_bulk_item_ok(ok, result):
+                        stats['deleted' if op_type == 'delete' else 'indexed'] += 1
+                    else:
+                        stats['errors'] += 1
+                        failed_elements.append(f"{doc_type},{item['_id']}")
+                        logger.warning(f"[ES Indexing Error] Could not index {doc_type} {item['_id']} : {item}")
+            except:
+                # The serialization failed, or Elasticsearch is unreachable
+                stats['errors'] += len(instance_ids)
+                failed_elements += [f'{doc_type},{instance_id}' for instance_id in instance_ids]
+                logger.error(f"[ES Indexing Error] Could not index {doc_type} {instance_ids}", exc_info=True)
+
+    # Retried by the next run, not this one, to let Elasticsearch recover
+    if failed_elements:
+        redis_client.sadd(ES_INDEXING_REDIS_KEY, *failed_elements)
+
+    stats['duration'] = time.monotonic() - start
+    if stats['batches']:
+        logger.info(
+            f"ES indexing : {stats['indexed']} indexed, {stats['deleted']} deleted, {stats['errors']} errors "
+            f"in {stats['batches']} batches, {stats['duration']:.2f}s"
+        )
+    return stats
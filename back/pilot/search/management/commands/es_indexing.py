@@ -0,0 +1,28 @@
+import logging
+import sys
+
+from django.core.management.base import BaseCommand
+
+from pilot.search.indexing import run_es_indexing, ES_INDEXING_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Index into Elasticsearch the instances that has been previously saved, and retry the failed ones
+    """
+
+    help = "Index into Elasticsearch the instances that has been previously saved"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size',
+            type=int, dest='batch_size', default=ES_INDEXING_BATCH_SIZE,
+            help='Number of instances loaded and serialized together')
+
+    def handle(self, *args, **options):
+        logger.info(f"[Cron Command Start] {' '.join(sys.argv[1:])}")
+
+        stats = run_es_indexing(batch_size=options['batch_size'])
+
+        logger.info(f"[Cron Command End] {' '.join(sys.argv[1:])} {stats}")
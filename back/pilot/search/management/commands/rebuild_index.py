@@ -1,156 +1,61 @@
 import logging
 import sys
 
-from elasticsearch.client.indices import IndicesClient
-
 from django.core.management.base import BaseCommand
 from django.conf import settings
 
-from pilot.projects.models import Project
-from pilot.items.models import Item
-from pilot.search.api.serializers import ItemSearchDocTypeSerializer, ProjectSearchDocTypeSerializer
+from pilot.search.indexing import ES_INDEXING_CHUNK_SIZE, INDEXED_MODELS
+from pilot.search.rebuild import REBUILD_INDEX_BATCH_SIZE, REBUILD_INDEX_WORKERS, rebuild_index
 
 logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
-    def handle(self, verbosity=2, **kwargs):
-        logger.info(f"[Command Start] {' '.join(sys.argv[1:])}")
+    """
+    Rebuild the Elasticsearch indices in new indices, then swap the aliases used by the search,
+    so the search keeps working during the rebuild
+    """
 
-        indicies_client = IndicesClient(settings.ES_CLIENT)
-        if indicies_client.exists(settings.ES_ITEM_INDEX):
-            indicies_client.delete(settings.ES_ITEM_INDEX)
-        if indicies_client.exists(settings.ES_PROJECT_INDEX):
-            indicies_client.delete(settings.ES_PROJECT_INDEX)
+    help = "Rebuild the Elasticsearch indices, without interrupting the search"
 
-        index_settings = {
-            "number_of_shards": 1,
-            "analysis": {
-                "filter": {
-                    "autocomplete_filter": {
-                        "type": "edge_ngram",
-                        "min_gram": 1,
-                        "max_gram": 20
-                    },
-                },
-                "analyzer": {
-                    "autocomplete": {
-                        "type": "custom",
-                        "tokenizer": "standard",
-                        "filter": [
-                            "lowercase",
-                            "asciifolding",
-                            "stop",
-                            "autocomplete_filter"
-                        ]
-                    },
-                    "custom_search_analyzer": {
-                        "type": "custom",
-                        "tokenizer": "standard",
-                        "filter": [
-                            "lowercase",
-                            "asciifolding"
-                        ]
-                    },
-                }
-            }
-        }
+    def add_arguments(self, parser):
+        parser.add_argument('--doc-type',
+            nargs='+', dest='doc_types', choices=list(INDEXED_MODELS), default=list(INDEXED_MODELS),
+            help='Indices to rebuild')
 
-        item_index_settings = {
-            "settings": index_settings,
+        parser.add_argument('--workers',
+            type=int, dest='workers', default=REBUILD_INDEX_WORKERS,
+            help='Number of _bulk requests sent in parallel')
 
-            "mappings": {
-                "_source": {"enabled": True},
-                "properties": {
-                    "id": {
-                        "type": "integer"
-                    },
-                    "title": {
-                        "type": "text",
-                        "analyzer": "autocomplete",
-                        "search_analyzer": "custom_search_analyzer",
-                        "boost": 2
-                    },
-                    "content": {
-                        "type": "text",
-                        "analyzer": "autocomplete",
-                        "search_analyzer": "custom_search_analyzer"
-                    },
-                    "language": {
-                        "type": "text"
-                    },
-                    "url": {
-                        "type": "text",
-                        "index": False
-                    },
-                    "in_trash": {
-                        "type": "boolean",
-                    },
-                    "hidden": {
-                        "type": "boolean",
-                    },
-                }
-            }
-        }
+        parser.add_argument('--batch-size',
+            type=int, dest='batch_size', default=REBUILD_INDEX_BATCH_SIZE,
+            help='Number of instances loaded together, and between two checkpoints')
 
-        project_index_settings = {
-            "settings": index_settings,
+        parser.add_argument('--chunk-size',
+            type=int, dest='chunk_size', default=ES_INDEXING_CHUNK_SIZE,
+            help='Number of documents in a single _bulk request')
 
-            "mappings": {
-                "_source": {"enabled": True},
-                "properties": {
-                    "id": {
-                        "type": "integer"
-                    },
-                    "name": {
-                        "type": "text",
-                        "analyzer": "autocomplete",
-                        "search_analyzer": "custom_search_analyzer",
-                        "boost": 2
-                    },
-                    "description": {
-                        "type": "text",
-                        "analyzer": "autocomplete",
-                        "search_analyzer": "custom_search_analyzer"
-                    },
-                    "url": {
-                        "type": "text",
-                        "index": False
-                    },
-                    "hidden": {
-                        "type": "boolean",
-                    },
-                }
-            }
-        }
+        parser.add_argument('--resume',
+            action='store_true', dest='resume',
+            help='Resume an interrupted rebuild from its last checkpoint')
 
-        indicies_client.create(settings.ES_ITEM_INDEX, body=item_index_settings)
-        indicies_client.create(settings.ES_PROJECT_INDEX, body=project_index_settings)
+        parser.add_argument('--keep-old',
+            action='store_true', dest='keep_old',
+            help='Keep the previous indices once the aliases are swapped')
 
-        items = Item.all_the_objects \
-            .select_related('project') \
-            .prefetch_related('channels', 'tags', 'targets')
-        for item in items.iterator():
-            try:
-                settings.ES_CLIENT.create(
-                    settings.ES_ITEM_INDEX,
-                    item.id,
-                    ItemSearchDocTypeSerializer(item, context={'rebuild_index': True}).data
-                )
-                logger.info('Indexed item %d' % item.id)
-            except Exception as e:
-                logger.error('Indexation went wrong for item %d : %s' % (item.id, e))
+    def handle(self, *args, **options):
+        logger.info(f"[Command Start] {' '.join(sys.argv[1:])}")
 
-        projects = Project.all_the_objects.prefetch_related('channels', 'tags', 'targets')
-        for project in projects.iterator():
-            try:
-                settings.ES_CLIENT.create(
-                    settings.ES_PROJECT_INDEX,
-                    project.id,
-                    ProjectSearchDocTypeSerializer(project, context={'rebuild_index': True}).data
-                )
-                logger.info('Indexed project %d' % project.id)
-            except Exception as e:
-                logger.error('Indexation went wrong for project %d : %s' % (project.id, e))
+        for doc_type in options['doc_types']:
+            stats = rebuild_index(
+                settings.ES_CLIENT,
+                INDEXED_MODELS[doc_type],
+                resume=options['resume'],
+                keep_old=options['keep_old'],
+                workers=options['workers'],
+                batch_size=options['batch_size'],
+                chunk_size=options['chunk_size'],
+            )
+            logger.info(f"Rebuilt the {doc_type} index : {stats}")
 
         logger.info(f"[Command End] {' '.join(sys.argv[1:])}")
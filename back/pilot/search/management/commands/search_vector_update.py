@@ -3,7 +3,7 @@ import sys
 
 from django.core.management.base import BaseCommand
 
-from pilot.utils.search import run_search_vector_update
+from pilot.utils.search import run_search_vector_update, SEARCH_VECTOR_UPDATE_BATCH_SIZE
 
 logger = logging.getLogger(__name__)
 
@@ -15,9 +15,14 @@ class Command(BaseCommand):
 
     help = "Update the search vector for instances that has been previously saved"
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size',
+            type=int, dest='batch_size', default=SEARCH_VECTOR_UPDATE_BATCH_SIZE,
+            help='Number of instances updated in a single query')
+
     def handle(self, *args, **options):
         logger.info(f"[Cron Command Start] {' '.join(sys.argv[1:])}")
 
-        run_search_vector_update()
+        stats = run_search_vector_update(batch_size=options['batch_size'])
 
-        logger.info(f"[Cron Command End] {' '.join(sys.argv[1:])}")
+        logger.info(f"[Cron Command End] {' '.join(sys.argv[1:])} {stats}")
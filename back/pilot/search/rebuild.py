@@ -0,0 +1,149 @@
+import logging
+import time
+
+from django.utils import timezone
+from elasticsearch import helpers
+
+from pilot.search.indexing import (
+    ES_INDEXING_CHUNK_SIZE, ES_INDEXING_MAX_CHUNK_BYTES, REBUILD_INDEX_REDIS_KEY,
+    get_index_actions, is_bulk_item_ok
+)
+from pilot.utils.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+__doc__ = '''
+Rebuild of an Elasticsearch index without interrupting the search.
+
+The documents are written in a new versioned index ( e.g. items_20200612093000 ),
+while the searches still use the current one, through an alias ( settings.ES_ITEM_INDEX ).
+Once the new index is filled, the alias is atomically moved to it, and the previous index is deleted.
+
+The progress is saved in Redis after each batch, so an interrupted rebuild can be resumed.
+'''
+
+REBUILD_INDEX_BATCH_SIZE = 2000
+REBUILD_INDEX_WORKERS = 4
+
+
+def create_versioned_index(client, indexed_model):
+    index = f'{indexed_model.index}_{timezone.now():%Y%m%d%H%M%S}'
+    body = indexed_model.index_body
+    # No refresh while filling the index, it is not searched yet
+    client.indices.create(index=index, body={
+        **body,
+        'settings': {**body['settings'], 'refresh_interval': '-1'}
+    })
+    return index
+
+
+def iter_instances_batches(indexed_model, last_id, batch_size):
+    """
+    The instances by id, by batches, each one loaded with its relations in a few queries
+    """
+    queryset = indexed_model.get_queryset().order_by('id')
+    while True:
+        instances = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not instances:
+            return
+        yield instances
+        last_id = instances[-1].id
+
+
+def fill_index(client, indexed_model, index, last_id=0,
+               workers=REBUILD_INDEX_WORKERS, batch_size=REBUILD_INDEX_BATCH_SIZE, chunk_size=ES_INDEXING_CHUNK_SIZE):
+    """
+    Index the instances with an id greater than `last_id`, saving the progress after each batch.
+    A failing Elasticsearch raises, and the rebuild can be resumed from the last saved batch.
+    """
+    checkpoint_key = REBUILD_INDEX_REDIS_KEY.format(indexed_model.doc_type)
+    stats = {
+        'indexed': 0,
+        'errors': 0,
+    }
+
+    for instances in iter_instances_batches(indexed_model, last_id, batch_size):
+        actions = (
+            action
+            for instance in instances
+            for action in get_index_actions(indexed_model, instance, [index])
+        )
+        results = helpers.parallel_bulk(
+            client,
+            actions,
+            thread_count=workers,
+            chunk_size=chunk_size,
+            max_chunk_bytes=ES_INDEXING_MAX_CHUNK_BYTES,
+            raise_on_error=False,
+        )
+        for ok, result in results:
+            if is_bulk_item_ok(ok, result):
+                stats['indexed'] += 1
+            else:
+                stats['errors'] += 1
+                logger.error(f"[Rebuild Index Error] Could not index {indexed_model.doc_type} : {result}")
+
+        redis_client.hset(checkpoint_key, 'last_id', instances[-1].id)
+        logger.info(f"Rebuild index {index} : {stats['indexed']} indexed, up to id {instances[-1].id}")
+
+    return stats
+
+
+def swap_alias(client, alias, index):
+    """
+    Atomically point the alias to the index.
+    Returns the indices previously behind the alias.
+    """
+    actions = [{'add': {'index': index, 'alias': alias}}]
+    old_indices = []
+
+    if client.indices.exists_alias(name=alias):
+        old_indices = [old_index for old_index in client.indices.get_alias(name=alias) if old_index != index]
+        actions = [{'remove': {'index': old_index, 'alias': alias}} for old_index in old_indices] + actions
+    elif client.indices.exists(index=alias):
+        # An index built before the aliases, with the name of the alias : replaced in the same operation
+        actions.append({'remove_index': {'index': alias}})
+
+    client.indices.update_aliases(body={'actions': actions})
+    return old_indices
+
+
+def rebuild_index(client, indexed_model, resume=False, keep_old=False, **fill_options):
+    """
+    Fill a new index with all the instances, then swap the alias to it.
+
+    With `resume`, continue the interrupted rebuild from its last saved batch.
+    Otherwise, an interrupted rebuild is dropped.
+
+    Returns: a dict of throughput stats
+    """
+    checkpoint_key = REBUILD_INDEX_REDIS_KEY.format(indexed_model.doc_type)
+    checkpoint = indexed_model.get_rebuild_checkpoint()
+    start = time.monotonic()
+
+    if resume and checkpoint:
+        index = checkpoint[b'index'].decode()
+        last_id = int(checkpoint.get(b'last_id', 0))
+        logger.info(f"Resume the rebuild of {index} after id {last_id}")
+    else:
+        if checkpoint:
+            client.indices.delete(index=checkpoint[b'index'].decode(), ignore=404)
+        index = create_versioned_index(client, indexed_model)
+        last_id = 0
+        # From now on, the saves are also written in the new index ( see IndexedModel.get_write_indices )
+        redis_client.hset(checkpoint_key, mapping={'index': index, 'last_id': last_id})
+
+    stats = fill_index(client, indexed_model, index, last_id, **fill_options)
+
+    client.indices.put_settings(index=index, body={'index': {'refresh_interval': None}})
+    client.indices.refresh(index=index)
+    old_indices = swap_alias(client, indexed_model.index, index)
+    redis_client.delete(checkpoint_key)
+
+    if not keep_old:
+        for old_index in old_indices:
+            client.indices.delete(index=old_index, ignore=404)
+
+    stats['index'] = index
+    stats['duration'] = time.monotonic() - start
+    return stats
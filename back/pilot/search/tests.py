@@ -0,0 +1,118 @@
+import mock
+from django.test import TestCase, override_settings
+
+from pilot.items.tests import factories as items_factories
+from pilot.search import indexing, rebuild
+from pilot.utils.redis import redis_client
+from pilot.utils.test import PilotAdminUserMixin
+
+
+class EsIndexingTests(PilotAdminUserMixin, TestCase):
+    def setUp(self):
+        super(EsIndexingTests, self).setUp()
+        self.item = items_factories.ItemFactory.create(desk=self.desk)
+        redis_client.delete(indexing.ES_INDEXING_REDIS_KEY, indexing.ES_INDEXING_SCHEDULED_REDIS_KEY)
+
+    def tearDown(self):
+        redis_client.delete(indexing.ES_INDEXING_REDIS_KEY, indexing.ES_INDEXING_SCHEDULED_REDIS_KEY)
+
+    def test_bulk_actions(self):
+        deleted_id = self.item.id + 1000
+        actions = list(indexing.get_bulk_actions(indexing.INDEXED_MODELS['item'], {self.item.id, deleted_id}))
+
+        self.assertEqual([(action['_op_type'], action['_id']) for action in actions], [
+            ('index', self.item.id),
+            ('delete', deleted_id),
+        ])
+        self.assertEqual(actions[0]['_version'], indexing.get_document_version(self.item))
+        self.assertEqual(actions[0]['_version_type'], 'external_gte')
+
+    @override_settings(ES_DISABLED=False)
+    @mock.patch('pilot.search.indexing.low_priority_queue')
+    def test_schedule(self, mock_queue):
+        indexing.add_es_indexing_elements([f'item,{self.item.id}'])
+        indexing.add_es_indexing_elements([f'item,{self.item.id}'])
+
+        # The saves of the same item are indexed once, by a single run
+        self.assertEqual(redis_client.smembers(indexing.ES_INDEXING_REDIS_KEY), {f'item,{self.item.id}'.encode()})
+        mock_queue.enqueue_in.assert_called_once()
+
+    @mock.patch('pilot.search.indexing.helpers.streaming_bulk')
+    def test_run_es_indexing(self, mock_streaming_bulk):
+        failed_item = items_factories.ItemFactory.create(desk=self.desk)
+        redis_client.sadd(indexing.ES_INDEXING_REDIS_KEY, f'item,{self.item.id}', f'item,{failed_item.id}')
+
+        def streaming_bulk(client, actions, **kwargs):
+            for action in actions:
+                if action['_id'] == failed_item.id:
+                    yield False, {'index': {'_id': failed_item.id, 'status': 429}}
+                else:
+                    yield True, {'index': {'_id': action['_id'], 'status': 201}}
+        mock_streaming_bulk.side_effect = streaming_bulk
+
+        stats = indexing.run_es_indexing()
+        self.assertEqual((stats['indexed'], stats['errors']), (1, 1))
+
+        # The failed item is retried by the next run
+        self.assertEqual(redis_client.smembers(indexing.ES_INDEXING_REDIS_KEY), {f'item,{failed_item.id}'.encode()})
+
+
+
+class RebuildIndexTests(PilotAdminUserMixin, TestCase):
+    def setUp(self):
+        super(RebuildIndexTests, self).setUp()
+        self.items = items_factories.ItemFactory.create_batch(3, desk=self.desk)
+        self.indexed_model = indexing.INDEXED_MODELS['item']
+        self.checkpoint_key = indexing.REBUILD_INDEX_REDIS_KEY.format('item')
+        self.client = mock.Mock()
+        redis_client.delete(self.checkpoint_key)
+
+        self.indexed_ids = []
+        patcher = mock.patch('pilot.search.rebuild.helpers.parallel_bulk', side_effect=self.parallel_bulk)
+        self.mock_parallel_bulk = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        redis_client.delete(self.checkpoint_key)
+
+    def parallel_bulk(self, client, actions, **kwargs):
+        for action in actions:
+            self.indexed_ids.append(action['_id'])
+            yield True, {'index': {'_id': action['_id'], 'status': 201}}
+
+    def test_rebuild_index(self):
+        # The first rebuild replaces the index named as the alias
+        self.client.indices.exists_alias.return_value = False
+        self.client.indices.exists.return_value = True
+
+        stats = rebuild.rebuild_index(self.client, self.indexed_model, batch_size=2)
+        self.assertEqual(stats['indexed'], 3)
+        self.assertEqual(self.mock_parallel_bulk.call_count, 2)
+
+        new_index = stats['index']
+        self.client.indices.create.assert_called_once()
+        self.client.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'add': {'index': new_index, 'alias': self.indexed_model.index}},
+            {'remove_index': {'index': self.indexed_model.index}},
+        ]})
+        self.assertFalse(redis_client.exists(self.checkpoint_key))
+
+    def test_write_indices_during_rebuild(self):
+        redis_client.hset(self.checkpoint_key, mapping={'index': 'items_new', 'last_id': 0})
+        self.assertEqual(self.indexed_model.get_write_indices(), [self.indexed_model.index, 'items_new'])
+
+    def test_resume(self):
+        redis_client.hset(self.checkpoint_key, mapping={'index': 'items_new', 'last_id': self.items[0].id})
+        self.client.indices.exists_alias.return_value = True
+        self.client.indices.get_alias.return_value = {'items_old': {'aliases': {}}}
+
+        rebuild.rebuild_index(self.client, self.indexed_model, resume=True)
+
+        # Only the items after the checkpoint, in the index of the checkpoint
+        self.client.indices.create.assert_not_called()
+        self.assertEqual(self.indexed_ids, [item.id for item in self.items[1:]])
+        self.client.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove': {'index': 'items_old', 'alias': self.indexed_model.index}},
+            {'add': {'index': 'items_new', 'alias': self.indexed_model.index}},
+        ]})
+        self.client.indices.delete.assert_called_once_with(index='items_old', ignore=404)
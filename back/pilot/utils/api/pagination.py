@@ -1,8 +1,16 @@
+import base64
+import json
+import math
 from collections import OrderedDict
 from functools import cached_property
 
-from django.core.paginator import Paginator
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import EmptyPage, InvalidPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 
 
@@ -16,6 +24,46 @@ class PaginatorWithoutAnnotations(Paginator):
         return queryset.count()
 
 
+class PageWithoutCount(Page):
+    def __init__(self, object_list, number, paginator, has_more):
+        super(PageWithoutCount, self).__init__(object_list, number, paginator)
+        self.has_more = has_more
+
+    def has_next(self):
+        return self.has_more
+
+
+class PaginatorWithoutCount(Paginator):
+    """
+    A Paginator without COUNT(*) : one more instance is fetched to know if there's a next page,
+    and the `count` and `num_pages` are unknown.
+    """
+    count = None
+    num_pages = None
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        object_list = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not object_list and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        return PageWithoutCount(
+            object_list[:self.per_page],
+            number,
+            self,
+            has_more=len(object_list) > self.per_page
+        )
+
+
 class PilotPageNumberPagination(pagination.PageNumberPagination):
     django_paginator_class = PaginatorWithoutAnnotations
 
@@ -27,3 +75,180 @@ class PilotPageNumberPagination(pagination.PageNumberPagination):
             ('previous', self.page.previous_page_number() if self.page.has_previous() else None),
             ('objects', data)
         ]))
+
+
+def get_keyset_ordering(queryset):
+    """
+    Returns the (field name, descending) of the queryset ordering,
+    if it can be paginated with a keyset : a non-null field of the model, optionally followed by the id.
+    Returns None otherwise ( ordering on a relation, an annotation, several fields... )
+    """
+    ordering = list(queryset.query.order_by or queryset.query.get_meta().ordering)
+    if not ordering or len(ordering) > 2 or not all(isinstance(param, str) for param in ordering):
+        return None
+
+    descending = ordering[0].startswith('-')
+    field_name = ordering[0].lstrip('-')
+    if field_name == 'pk':
+        field_name = 'id'
+    if len(ordering) == 2 and ordering[1] not in (['-id', '-pk'] if descending else ['id', 'pk']):
+        return None
+
+    try:
+        field = queryset.model._meta.get_field(field_name)
+    except FieldDoesNotExist:
+        return None
+    if not field.concrete or field.is_relation or field.null:
+        return None
+
+    return field_name, descending
+
+
+def estimate_count(queryset):
+    """
+    The number of rows estimated by the Postgres planner ( EXPLAIN ), without running the query
+    """
+    queryset = queryset.order_by()
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class PilotKeysetPagination(PilotPageNumberPagination):
+    """
+    A PilotPageNumberPagination which switches to a keyset pagination when the `cursor` query param is given
+    ( empty for the first page ).
+
+    Instead of an OFFSET, the pages start after the ordering value and the id of the last instance
+    of the previous page, so the deep pages are as fast as the first one.
+    The response keeps the same shape, `next` and `previous` being opaque cursors instead of page numbers.
+
+    There's no COUNT(*) by default : the `count` query param may ask for an `exact` or an `estimated` count.
+    The API token clients never get a count, even with the page number pagination.
+
+    Querysets with an ordering unsupported by the keyset fall back on the page number pagination.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    keyset_ordering = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_ordering = None
+        if self.cursor_query_param in request.query_params:
+            self.keyset_ordering = get_keyset_ordering(queryset)
+
+        if not self.keyset_ordering:
+            # request.auth is the ApiToken of the public API clients
+            if request.auth is not None:
+                return self.paginate_queryset_without_count(queryset, request)
+            return super(PilotKeysetPagination, self).paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        self.request = request
+        field_name, descending = self.keyset_ordering
+        field = queryset.model._meta.get_field(field_name)
+        cursor = self.decode_cursor(request, field)
+        backwards = bool(cursor and cursor['backwards'])
+
+        # Count before the cursor filtering
+        self.count = self.get_count(queryset, request)
+
+        page_queryset = queryset
+        if cursor:
+            lookup = 'lt' if descending != backwards else 'gt'
+            page_queryset = page_queryset.filter(
+                Q(**{f'{field_name}__{lookup}': cursor['value']}) |
+                Q(**{field_name: cursor['value'], f'id__{lookup}': cursor['id']})
+            )
+        sign = '-' if descending != backwards else ''
+        page_queryset = page_queryset.order_by(f'{sign}{field_name}', f'{sign}id')
+
+        # One more, to know if there's another page after this one
+        results = list(page_queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if backwards:
+            results.reverse()
+
+        self.next_cursor = self.previous_cursor = None
+        if results:
+            if has_more or backwards:
+                self.next_cursor = self.encode_cursor(field, results[-1], backwards=False)
+            if (has_more and backwards) or (cursor and not backwards):
+                self.previous_cursor = self.encode_cursor(field, results[0], backwards=True)
+
+        self.num_pages = math.ceil(self.count / page_size) if self.count is not None else None
+        return results
+
+    def paginate_queryset_without_count(self, queryset, request):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = PaginatorWithoutCount(queryset, page_size)
+        page_number = request.query_params.get(self.page_query_param, 1)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+
+        self.request = request
+        return list(self.page)
+
+    def get_count(self, queryset, request):
+        # request.auth is the ApiToken of the public API clients
+        if request.auth is not None:
+            return None
+
+        count = request.query_params.get(self.count_query_param)
+        if count == 'exact':
+            return PaginatorWithoutAnnotations(queryset, 1).count
+        elif count == 'estimated':
+            return estimate_count(queryset)
+        return None
+
+    def encode_cursor(self, field, instance, backwards):
+        cursor = {
+            'field': field.name,
+            'value': field.value_to_string(instance),
+            'id': instance.id,
+            'backwards': backwards,
+        }
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+    def decode_cursor(self, request, field):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            # A cursor of another ordering
+            if cursor['field'] != field.name:
+                raise ValueError()
+            cursor['value'] = field.to_python(cursor['value'])
+            cursor['id'] = int(cursor['id'])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def get_paginated_response(self, data):
+        if not self.keyset_ordering:
+            return super(PilotKeysetPagination, self).get_paginated_response(data)
+
+        return Response(OrderedDict([
+            ('num_pages', self.num_pages),
+            ('count', self.count),
+            ('next', self.next_cursor),
+            ('previous', self.previous_cursor),
+            ('objects', data)
+        ]))
@@ -167,6 +167,17 @@ class ActivityModelMixin(object):
 
 class BulkActionMixin(object):
     def get_bulk_action_handlers(self):
+        """
+        The handlers of the bulk actions, called for each instance : handler(instance, params)
+        """
+        return {}
+
+    def get_bulk_queryset_action_handlers(self):
+        """
+        The set-wise implementations of the bulk actions, called once with the whole queryset : handler(queryset, params)
+        A set-wise handler may return False when it can't handle the params,
+        the per-instance handler is then used as a fallback.
+        """
         return {}
 
     @action(detail=False, methods=['POST'])
@@ -176,7 +187,8 @@ class BulkActionMixin(object):
         params = request.data.pop('params', {})
 
         action_handler = self.get_bulk_action_handlers().get(action)
-        if not action_handler:
+        queryset_action_handler = self.get_bulk_queryset_action_handlers().get(action)
+        if not action_handler and not queryset_action_handler:
             return HttpResponseBadRequest("Unknown action {}".format(action))
 
         if ids == '__ALL__':
@@ -188,6 +200,9 @@ class BulkActionMixin(object):
             queryset = self.get_queryset().filter(id__in=ids)
 
         with transaction.atomic():
+            if queryset_action_handler and queryset_action_handler(queryset, params) is not False:
+                return Response(status=status.HTTP_204_NO_CONTENT)
+
             for instance in queryset:
                 action_handler(instance, params)
 
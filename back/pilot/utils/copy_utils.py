@@ -98,7 +98,7 @@ def copy_item(item, created_by,
     # because we need to update the hierarchy in a sync way,
     # so ProjelDetailHierarchy.vue can reload the hierarchy immediately
     for projel in projels_for_item(new_item):
-        ensure_consistent_hierarchy(projel)
+        ensure_consistent_hierarchy(projel, item_ids=[new_item.id])
 
 
 def copy_project(source_project, new_project, copy_params={}):
@@ -30,6 +30,7 @@ EXCLUDED_DIFFING_FIELDS = [
     # Don't diff the search fields
     'search_vector',
     'partial_search_document',
+    'search_document_digest',
     # Internal fields on Item
     'annotations',
     'last_edition_datetime',
@@ -352,14 +353,42 @@ class DiffTracker(object):
         return diff_data
 
     def format_diff_for_related_instance(self, related_instance):
-        if related_instance is None:
-            return {
-                'id': None,
-                'repr': ''
-            }
-        else:
-            return {
-                'id': related_instance.id,
-                'repr': str(related_instance)
-            }
+        return format_diff_for_related_instance(related_instance)
+
+
+def format_diff_for_related_instance(related_instance):
+    if related_instance is None:
+        return {
+            'id': None,
+            'repr': ''
+        }
+    else:
+        return {
+            'id': related_instance.id,
+            'repr': str(related_instance)
+        }
+
+
+def get_related_field_diff(field_name, before, after):
+    """
+    The diff of a related field, in the DiffTracker format, without tracking the whole instance.
+    `before` and `after` are instances ( ForeignKey ), or lists of instances ( ManyToManyField ).
+
+    Returns None if the field did not change.
+    """
+    if isinstance(before, (list, tuple)):
+        before = [format_diff_for_related_instance(related) for related in sorted(before, key=lambda r: r.id)]
+        after = [format_diff_for_related_instance(related) for related in sorted(after, key=lambda r: r.id)]
+    else:
+        before = format_diff_for_related_instance(before)
+        after = format_diff_for_related_instance(after)
+
+    if before == after:
+        return None
+
+    return {
+        'field_name': field_name,
+        'before': before,
+        'after': after
+    }
 
@@ -5,10 +5,11 @@ import tempfile
 import zipfile
 import logging
 
-from django.db.models import ForeignKey
+from django.db.models import ForeignKey, prefetch_related_objects
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
 from openpyxl.styles import Alignment
-from openpyxl.utils.exceptions import IllegalCharacterError
 from openpyxl.writer.excel import ExcelWriter
 from openpyxl.utils import get_column_letter
 
@@ -29,6 +30,10 @@ from pilot.utils.serialization import SerializationDialect
 
 logger = logging.getLogger(__name__)
 
+WRAP_ALIGNMENT = Alignment(wrap_text=True)
+
+# The number of instances fetched and prefetched at once in the exports
+EXPORT_CHUNK_SIZE = 500
 
 ASSET_METADATA_FIELDS = (
     'title',
@@ -160,6 +165,38 @@ def format_field(instance, field_name, dialect=SerializationDialect.TEXT):
     return value
 
 
+def iterate_by_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE, prepare_chunk=None):
+    """
+    Iterate over a queryset like queryset.iterator(), without loading all the rows in memory,
+    but keep the prefetch_related lookups of the queryset, which are ignored by queryset.iterator().
+
+    The instances are fetched by chunks, and the lookups are prefetched for each chunk,
+    so the iteration runs a bounded number of queries per chunk, instead of per instance.
+
+    Args:
+        prepare_chunk: an optional function called with each chunk (a list of instances),
+                       to prefetch additional data
+    """
+    lookups = queryset._prefetch_related_lookups
+
+    def prepare(chunk):
+        if lookups:
+            prefetch_related_objects(chunk, *lookups)
+        if prepare_chunk:
+            prepare_chunk(chunk)
+        return chunk
+
+    chunk = []
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(instance)
+        if len(chunk) == chunk_size:
+            yield from prepare(chunk)
+            chunk = []
+
+    if chunk:
+        yield from prepare(chunk)
+
+
 class BaseXLSExportJob(Job):
     queue = low_priority_queue
     download_export_string = _("Télécharger l'export")
@@ -229,6 +266,13 @@ class BaseXLSExportJob(Job):
 
 
 class BaseXLSExporter(object):
+    """
+    Export a queryset into an xlsx file.
+
+    The workbook is in write-only mode : the rows are streamed to the output as they are produced,
+    so the memory usage does not grow with the number of rows.
+    As a consequence, the styles must be declared before writing the rows ( see add_style ).
+    """
     model = None
     metadata_fields = []
 
@@ -236,11 +280,13 @@ class BaseXLSExporter(object):
         self.queryset = queryset
         self.output_file = output_file
 
-        self.workbook = Workbook()
-        self.worksheet = self.workbook.active
+        self.workbook = Workbook(write_only=True)
+        self.worksheet = self.workbook.create_sheet()
 
         # Indicies of the column where the text should wrap (1-based, as openpyxl)
         self.wrapped_columns = []
+        # The number of columns, known once the header has been generated
+        self.column_count = 0
 
     def get_header(self):
         for i, metadata_field_name in enumerate(self.metadata_fields):
@@ -253,18 +299,36 @@ class BaseXLSExporter(object):
         for metadata_field_name in self.metadata_fields:
             yield format_field(instance, metadata_field_name)
 
+    def prepare_chunk(self, instances):
+        """
+        Prefetch, for a chunk of instances, the data needed by get_row which are not in the queryset lookups
+        """
+        pass
+
     def get_all_column_letters(self):
-        for col_index in range(0, self.worksheet.max_column):
+        for col_index in range(0, self.column_count):
             yield get_column_letter(col_index + 1)
 
     def add_style(self):
+        """
+        Declare the column styles.
+        Called after the header generation, but before writing any row.
+        """
         # Set a width of 25 on all columns
         for column_letter in self.get_all_column_letters():
             self.worksheet.column_dimensions[column_letter].width = 25
 
-        for row_index in range(2, self.worksheet.max_row + 1):
-            for column_index in self.wrapped_columns:
-                self.worksheet.cell(row_index, column_index).alignment = Alignment(wrap_text=True)
+    def style_row(self, row):
+        """
+        Cells cannot be styled after being written, so the wrapped cells are styled on the fly
+        """
+        for column_index, value in enumerate(row, start=1):
+            if column_index in self.wrapped_columns:
+                cell = WriteOnlyCell(self.worksheet, value=value)
+                cell.alignment = WRAP_ALIGNMENT
+                yield cell
+            else:
+                yield value
 
     def clean_illegal_characters(self, row):
         ILLEGAL_CHARACTERS = r'[\x0b]'
@@ -276,15 +340,17 @@ class BaseXLSExporter(object):
                 yield value
 
     def do_export(self):
-        self.worksheet.append([force_text(h) for h in self.get_header()])
-
-        for (i, instance) in enumerate(self.queryset.iterator()):
-            try:
-                self.worksheet.append(self.get_row(i, instance))
-            except IllegalCharacterError:
-                self.worksheet.append(self.clean_illegal_characters(self.get_row(i, instance)))
-
+        header = [force_text(h) for h in self.get_header()]
+        self.column_count = len(header)
         self.add_style()
+        self.worksheet.append(header)
+
+        for (i, instance) in enumerate(iterate_by_chunks(self.queryset, prepare_chunk=self.prepare_chunk)):
+            row = list(self.get_row(i, instance))
+            # A row cannot be retried once appended in write-only mode, so check the illegal characters before
+            if any(isinstance(value, str) and ILLEGAL_CHARACTERS_RE.search(value) for value in row):
+                row = self.clean_illegal_characters(row)
+            self.worksheet.append(list(self.style_row(row)))
 
         archive = zipfile.ZipFile(
             self.output_file,
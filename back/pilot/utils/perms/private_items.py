@@ -1,3 +1,4 @@
+from django.db.models import Q
 
 
 # Does the user has the permission to see a private item, and to edit the private flag ?
@@ -22,4 +23,18 @@ def user_can_access_item(request, item):
         not request.desk.private_items_enabled or
         not item.is_private or
         user_has_private_item_perm(request.user, item)
-    )
\ No newline at end of file
+    )
+
+# The items of a queryset the user is allowed to access, same rules than user_can_access_item
+def filter_accessible_items(request, queryset):
+    if request.user.is_anonymous:
+        return queryset.none()
+
+    if not request.desk.private_items_enabled or request.user.permissions.is_admin:
+        return queryset
+
+    return queryset.filter(
+        Q(is_private=False) |
+        Q(created_by=request.user) |
+        Q(owners=request.user)
+    ).distinct()
@@ -11,6 +11,11 @@ def filter_items_for_sharing(items_queryset, sharing):
     """
     Keep only items in the queryset that are part of the sharing
     """
+    if sharing.saved_filter and not sharing.deactivated:
+        from pilot.itemsfilters.saved_filter import get_saved_filter_plan
+        # Shared lists and calendars reuse the compiled plan of their SavedFilter
+        return get_saved_filter_plan(sharing.saved_filter).filter_queryset(items_queryset)
+
     item_filter = ItemFilter(
         data=QueryDict(sharing.get_query_string()),
         queryset=items_queryset
@@ -1,11 +1,28 @@
+import datetime
+import logging
+
+from django.apps import apps
+from django.conf import settings
 from django.contrib.postgres.fields.jsonb import KeyTextTransform
 from django.db import transaction
 
 from pilot.channels.models import Channel
 from pilot.queue import jobs_registar
-from pilot.queue.jobs import Job
+from pilot.queue.jobs import Job, thread_local
 from pilot.queue.rq_setup import medium_priority_queue
 from pilot.utils.projel.models import Projel
+from pilot.utils.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+HIERARCHY_CONSISTENCY_REDIS_KEY_PREFIX = 'pilot:hierarchy_consistency'
+
+# Member of the changed items set when the whole hierarchy must be checked
+FULL_CONSISTENCY = 'all'
+
+# A scheduled consistency is cleared by its job.
+# The expiration is only a safety net if the job is lost, so the next changes schedule a new one.
+SCHEDULED_CONSISTENCY_TTL = 10 * 60
 
 
 class NodeTypes:
@@ -100,7 +117,7 @@ def sort_hierarchy(nodes, items):
         if node['type'] == NodeTypes.FOLDER:
             return 'A' + str(node.get('name', ''))
         if node['type'] == NodeTypes.ITEM:
-            return 'B' + str(items[node['id']].get('title', ''))
+            return 'B' + str(items.get(node['id'], {}).get('title', ''))
 
     nodes.sort(key=get_sort_key)
 
@@ -128,22 +145,80 @@ def walk_nodes_to_see_items(nodes, items):
             walk_nodes_to_see_items(node['nodes'], items)
 
 
+def walk_nodes_to_see_changed_items(nodes, removed_item_ids, seen_item_ids):
+    """
+    Remove the nodes of the removed items, and the duplicated nodes of the other items,
+    and collect the ids of the items seen in the hierarchy into `seen_item_ids`.
+
+    Returns: True if the hierarchy has been changed
+    """
+    changed = False
+    for i in reversed(range(len(nodes))):
+        node = nodes[i]
+
+        if node['type'] == NodeTypes.ITEM:
+            item_id = node.get('id')
+            if item_id in removed_item_ids or item_id in seen_item_ids:
+                nodes.pop(i)
+                changed = True
+            else:
+                seen_item_ids.add(item_id)
+
+        if node['type'] == NodeTypes.FOLDER:
+            # Walk in the subfolders
+            changed = walk_nodes_to_see_changed_items(node['nodes'], removed_item_ids, seen_item_ids) or changed
+
+    return changed
+
+
+def get_items_titles(items_queryset):
+    return {
+        item['id']: item
+        for item in items_queryset.values('id', title=KeyTextTransform('title', 'json_content'))
+    }
+
+
 # Note : the verb "consistentize" does not exists in proper english :-(
-def ensure_consistent_hierarchy(projel):
+def ensure_consistent_hierarchy(projel, item_ids=None):
+    """
+    Add the items of the projel missing from its hierarchy at its root, remove the nodes of the items
+    which are not in the projel anymore, and sort the root.
+
+    When `item_ids` is given, only those items have changed since the last consistency,
+    and the other nodes are considered up-to-date.
+    """
     # We use a transaction + a select_for_update() to ensure we won't override
     # a save made by the frontend
     with transaction.atomic():
         projel = projel.__class__.objects.select_for_update().get(id=projel.id)
 
-        items_queryset = projel.items.values('id', title=KeyTextTransform('title', 'json_content'))
-        items = {item['id']: item for item in items_queryset}
-        # Make a copy, we'll need the original, untouched items dict for sorting
-        unseen_items = dict(items)
-        walk_nodes_to_see_items(projel.hierarchy, unseen_items)
-        for item_id in unseen_items.keys():
-            add_item_to_hierarchy_root(projel, item_id)
-        sort_hierarchy(projel.hierarchy, items)
-        projel.save()
+        if item_ids is None:
+            items = get_items_titles(projel.items.all())
+            # Make a copy, we'll need the original, untouched items dict for sorting
+            unseen_items = dict(items)
+            walk_nodes_to_see_items(projel.hierarchy, unseen_items)
+            for item_id in unseen_items.keys():
+                add_item_to_hierarchy_root(projel, item_id)
+            sort_hierarchy(projel.hierarchy, items)
+            projel.save()
+            return
+
+        item_ids = set(item_ids)
+        items_in_projel = set(projel.items.filter(id__in=item_ids).values_list('id', flat=True))
+        seen_item_ids = set()
+        changed = walk_nodes_to_see_changed_items(projel.hierarchy, item_ids - items_in_projel, seen_item_ids)
+
+        added_item_ids = items_in_projel - seen_item_ids
+        if added_item_ids:
+            for item_id in added_item_ids:
+                add_item_to_hierarchy_root(projel, item_id)
+            # Only the root is sorted, so only the titles of its items are needed.
+            # Removing nodes keeps it sorted.
+            root_item_ids = [node['id'] for node in projel.hierarchy if node['type'] == NodeTypes.ITEM]
+            sort_hierarchy(projel.hierarchy, get_items_titles(projel.items.filter(id__in=root_item_ids)))
+
+        if changed or added_item_ids:
+            projel.save()
 
 
 def projels_for_item(item):
@@ -153,22 +228,160 @@ def projels_for_item(item):
         return set(item.channels.all())
 
 
+def get_projel_key(projel):
+    return f'{projel._meta.label}:{projel.id}'
+
+
+def get_changed_items_key(projel_key):
+    return f'{HIERARCHY_CONSISTENCY_REDIS_KEY_PREFIX}:{projel_key}:items'
+
+
+def get_scheduled_key(projel_key):
+    return f'{HIERARCHY_CONSISTENCY_REDIS_KEY_PREFIX}:{projel_key}:scheduled'
+
+
+def merge_hierarchy_changes(changes, projel_key, item_ids):
+    """
+    Merge the ids of changed items into a dict projel_key => set of item ids, or None for a full consistency
+    """
+    if item_ids is None or (projel_key in changes and changes[projel_key] is None):
+        changes[projel_key] = None
+    else:
+        changes.setdefault(projel_key, set()).update(item_ids)
+
+
+def record_hierarchy_changes(changes):
+    """
+    Add the changes to the ones waiting for the consistency of each projel, in Redis.
+
+    Returns: the keys of the projels with no consistency scheduled yet
+    """
+    pipeline = redis_client.pipeline()
+    for projel_key, item_ids in changes.items():
+        pipeline.sadd(get_changed_items_key(projel_key), *(item_ids if item_ids is not None else [FULL_CONSISTENCY]))
+        pipeline.expire(get_changed_items_key(projel_key), SCHEDULED_CONSISTENCY_TTL)
+        pipeline.set(get_scheduled_key(projel_key), 1, nx=True, ex=SCHEDULED_CONSISTENCY_TTL)
+    results = pipeline.execute()
+
+    # One result for each of the 3 commands of each projel, the last one is the scheduling
+    return [projel_key for projel_key, scheduled in zip(changes, results[2::3]) if scheduled]
+
+
+def pop_hierarchy_changes(projel_key):
+    """
+    Returns: the ids of the items changed since the last consistency, or None for a full consistency
+    """
+    # New changes must schedule a new consistency
+    redis_client.delete(get_scheduled_key(projel_key))
+    members, _ = (
+        redis_client.pipeline()
+        .smembers(get_changed_items_key(projel_key))
+        .delete(get_changed_items_key(projel_key))
+        .execute()
+    )
+    members = {member.decode() for member in members}
+    if FULL_CONSISTENCY in members:
+        return None
+    return {int(item_id) for item_id in members}
+
+
 class HierarchyConsistencyJob(Job):
+    """
+    The consistency of a projel is coalesced :
+     - all the changes made during a request are merged into a single pending job
+     - the changes are then recorded in Redis, and a single consistency is scheduled for each projel,
+       HIERARCHY_CONSISTENCY_DEBOUNCE seconds later, absorbing all the changes made in the meantime
+    """
     job_type = jobs_registar.JOB_TYPE_HIERARCHY_CONSISTENCY
     queue = medium_priority_queue
-    delete_tracker_on_success = True
+    tracked = False
 
-    def run(self, projels):
+    @classmethod
+    def launch(cls, desk, user=None, projels=(), item_ids=None):
+        """
+        Args:
+            projels: a Projel, or an iterable of Projels
+            item_ids: the items added to or removed from the projels.
+                      If None, the whole hierarchies are checked.
+        """
         # Can also launch the job with a single Projel instead of a iterable
         if isinstance(projels, Projel):
             projels = [projels]
 
+        changes = {}
         for projel in projels:
-            ensure_consistent_hierarchy(projel)
+            merge_hierarchy_changes(changes, get_projel_key(projel), item_ids)
+        cls.launch_changes(desk, user, changes)
+
+    @classmethod
+    def launch_changes(cls, desk, user, changes):
+        """
+        Args:
+            changes: a dict projel_key => set of changed item ids, or None ( see merge_hierarchy_changes )
+        """
+        if not changes:
+            return
+
+        if not hasattr(thread_local, 'pending_jobs'):
+            Job.reset_pending_jobs()
+
+        for pending_job in thread_local.pending_jobs:
+            if pending_job.job_class is cls and pending_job.args == (desk.id,):
+                for projel_key, item_ids in changes.items():
+                    merge_hierarchy_changes(pending_job.kwargs['changes'], projel_key, item_ids)
+                return
+
+        # The changes must be complete before the launch :
+        # outside of a transaction, the pending jobs are flushed right away by `launch`
+        pending_changes = {}
+        for projel_key, item_ids in changes.items():
+            merge_hierarchy_changes(pending_changes, projel_key, item_ids)
+        super(HierarchyConsistencyJob, cls).launch(desk, user, changes=pending_changes)
 
     @classmethod
     def launch_for_item(cls, request, item):
-        cls.launch_r(request, projels_for_item(item))
+        cls.launch_r(request, projels_for_item(item), item_ids=[item.id])
+
+    @classmethod
+    def enqueue_job(cls, args, kwargs, job_id, depends_on=None, timeout=None):
+        try:
+            projel_keys = record_hierarchy_changes(kwargs['changes'])
+        except:
+            logger.error("[Job Enqueueing Error]\nHierarchy changes : {}".format(kwargs['changes']), exc_info=True)
+            return
+
+        # A consistency is already scheduled for the other projels, it will absorb the changes
+        if not projel_keys:
+            return
+
+        debounce = settings.HIERARCHY_CONSISTENCY_DEBOUNCE
+        if not debounce:
+            super(HierarchyConsistencyJob, cls).enqueue_job(args, {'projel_keys': projel_keys}, job_id, depends_on, timeout)
+            return
+
+        try:
+            cls.queue.enqueue_in(
+                datetime.timedelta(seconds=debounce),
+                cls.start_untracked,
+                *args,
+                projel_keys=projel_keys,
+                job_id=job_id,
+                result_ttl=0,
+            )
+        except:
+            logger.error("[Job Enqueueing Error]\nRQ job ID : {}".format(job_id), exc_info=True)
+
+    def run(self, projel_keys):
+        for projel_key in projel_keys:
+            item_ids = pop_hierarchy_changes(projel_key)
+            if item_ids is not None and not item_ids:
+                # Already absorbed by a previous consistency
+                continue
+
+            model_label, projel_id = projel_key.rsplit(':', 1)
+            projel = apps.get_model(model_label).objects.filter(id=projel_id).first()
+            if projel:
+                ensure_consistent_hierarchy(projel, item_ids)
 
 
 
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from redis import RedisError
+
+from pilot.utils.prosemirror.serializer import SERIALIZER_VERSION
+from pilot.utils.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+__doc__ = '''
+Content-addressed cache of the Prosemirror conversions.
+
+A conversion is identified by the hash of the canonical json of the document, the output format
+and the serializer version, so the same document is converted only once, whatever the item,
+comment or notification it comes from, and bumping SERIALIZER_VERSION invalidates everything.
+
+The conversions are stored in a local LRU bounded by the size of its values,
+in front of a Redis cache shared by all the processes.
+'''
+
+CONVERSION_CACHE_REDIS_KEY_PREFIX = 'pilot:prosemirror_conversion'
+CONVERSION_CACHE_STATS_REDIS_KEY = 'pilot:prosemirror_conversion_stats'
+
+STATS_COUNTERS = ('local_hits', 'redis_hits', 'misses', 'local_evictions', 'redis_errors')
+# The counters are also added to the Redis hash after this many operations, or this many seconds,
+# for the processes which only get hits and never write to Redis
+STATS_FLUSH_OPERATIONS = 1000
+STATS_FLUSH_INTERVAL = 60
+
+
+class ByteSizeLRUCache:
+    """
+    A thread-safe LRU cache of strings, which evicts the least recently used entries
+    when the total size of the values exceeds `max_bytes`.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        """
+        Returns: The number of evicted entries
+        """
+        value_size = len(value.encode())
+        # Do not flush the whole cache for a single huge value
+        if value_size > self.max_bytes:
+            return 0
+
+        evicted = 0
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, value_size)
+            self.size += value_size
+
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                evicted += 1
+        return evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ProsemirrorConversionCache:
+    """
+    Hit/miss counters are kept per process, and added to a Redis hash
+    each time we talk to Redis anyway, or at least every STATS_FLUSH_OPERATIONS or STATS_FLUSH_INTERVAL,
+    so the stats of all the processes can be read in one place.
+    """
+    def __init__(self, redis, local_max_bytes, redis_ttl, redis_min_size):
+        self.redis = redis
+        self.local_cache = ByteSizeLRUCache(local_max_bytes)
+        self.redis_ttl = redis_ttl
+        # Small documents are converted faster than a Redis round-trip, keep them in the local cache only
+        self.redis_min_size = redis_min_size
+
+        self.stats = dict.fromkeys(STATS_COUNTERS, 0)
+        # The counters not yet added to the Redis hash
+        self.pending_stats = dict.fromkeys(STATS_COUNTERS, 0)
+        self.stats_lock = threading.Lock()
+        self.stats_flush_operations = STATS_FLUSH_OPERATIONS
+        self.stats_flush_interval = STATS_FLUSH_INTERVAL
+        self.pending_operations = 0
+        self.stats_flushed_at = time.monotonic()
+
+    def get_key(self, canonical_json, output_format):
+        digest = hashlib.sha256(canonical_json.encode()).hexdigest()
+        return f'{CONVERSION_CACHE_REDIS_KEY_PREFIX}:{SERIALIZER_VERSION}:{output_format}:{digest}'
+
+    def get_or_convert(self, pm_document_dict, output_format, convert):
+        """
+        Args:
+            pm_document_dict: a python dict representing a Prosemirror document
+            output_format: 'html', 'markdown' or 'text'
+            convert: a function called with (pm_document_dict, output_format) on cache miss
+
+        Returns: The converted document
+        """
+        canonical_json = json.dumps(pm_document_dict, sort_keys=True, separators=(',', ':'))
+        key = self.get_key(canonical_json, output_format)
+
+        value = self.local_cache.get(key)
+        if value is not None:
+            self.incr_stats(local_hits=1)
+            self.flush_stats_if_due()
+            return value
+
+        use_redis = len(canonical_json) >= self.redis_min_size
+
+        if use_redis:
+            value = self.redis_get(key)
+            if value is not None:
+                self.incr_stats(redis_hits=1, local_evictions=self.local_cache.set(key, value))
+                self.flush_stats_if_due()
+                return value
+
+        value = convert(pm_document_dict, output_format)
+        self.incr_stats(misses=1, local_evictions=self.local_cache.set(key, value))
+        if use_redis:
+            self.redis_set(key, value)
+        else:
+            self.flush_stats_if_due()
+        return value
+
+    def redis_get(self, key):
+        try:
+            value = self.redis.get(key)
+        except RedisError:
+            logger.warning('Cannot read the prosemirror conversion cache', exc_info=True)
+            self.incr_stats(redis_errors=1)
+            return None
+        return value.decode() if value is not None else None
+
+    def redis_set(self, key, value):
+        pending_stats = self.pop_pending_stats()
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            pipeline.set(key, value.encode(), ex=self.redis_ttl)
+            self.add_stats_to_pipeline(pipeline, pending_stats)
+            pipeline.execute()
+        except RedisError:
+            logger.warning('Cannot write the prosemirror conversion cache', exc_info=True)
+            self.restore_pending_stats(pending_stats)
+            self.incr_stats(redis_errors=1)
+
+    def flush_stats_if_due(self):
+        with self.stats_lock:
+            due = (
+                self.pending_operations >= self.stats_flush_operations or
+                time.monotonic() - self.stats_flushed_at >= self.stats_flush_interval
+            )
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        pending_stats = self.pop_pending_stats()
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            self.add_stats_to_pipeline(pipeline, pending_stats)
+            pipeline.execute()
+        except RedisError:
+            logger.warning('Cannot write the prosemirror conversion cache stats', exc_info=True)
+            self.restore_pending_stats(pending_stats)
+            self.incr_stats(redis_errors=1)
+
+    def add_stats_to_pipeline(self, pipeline, pending_stats):
+        for counter, count in pending_stats.items():
+            if count:
+                pipeline.hincrby(CONVERSION_CACHE_STATS_REDIS_KEY, counter, count)
+
+    def incr_stats(self, **counts):
+        with self.stats_lock:
+            for counter, count in counts.items():
+                self.stats[counter] += count
+                self.pending_stats[counter] += count
+            self.pending_operations += 1
+
+    def pop_pending_stats(self):
+        with self.stats_lock:
+            pending_stats = self.pending_stats
+            self.pending_stats = dict.fromkeys(STATS_COUNTERS, 0)
+            # Also reset on failure, so an unavailable Redis is not retried on each operation
+            self.pending_operations = 0
+            self.stats_flushed_at = time.monotonic()
+        return pending_stats
+
+    def restore_pending_stats(self, pending_stats):
+        # Keep the counters for the next attempt
+        with self.stats_lock:
+            for counter, count in pending_stats.items():
+                self.pending_stats[counter] += count
+
+    def get_stats(self):
+        """
+        Returns: The counters of the current process, and the counters of all the processes stored in Redis
+        """
+        with self.stats_lock:
+            local_stats = dict(self.stats)
+        local_stats['local_entries'] = len(self.local_cache)
+        local_stats['local_bytes'] = self.local_cache.size
+
+        try:
+            shared_stats = {
+                counter.decode(): int(count)
+                for counter, count in self.redis.hgetall(CONVERSION_CACHE_STATS_REDIS_KEY).items()
+            }
+        except RedisError:
+            logger.warning('Cannot read the prosemirror conversion cache stats', exc_info=True)
+            shared_stats = {}
+
+        return {'process': local_stats, 'shared': shared_stats}
+
+
+_conversion_cache = None
+_conversion_cache_lock = threading.Lock()
+
+
+def get_conversion_cache():
+    global _conversion_cache
+    with _conversion_cache_lock:
+        if _conversion_cache is None:
+            _conversion_cache = ProsemirrorConversionCache(
+                redis=redis_client,
+                local_max_bytes=settings.PROSEMIRROR_CONVERSION_CACHE_LOCAL_MAX_BYTES,
+                redis_ttl=settings.PROSEMIRROR_CONVERSION_CACHE_REDIS_TTL,
+                redis_min_size=settings.PROSEMIRROR_CONVERSION_CACHE_REDIS_MIN_SIZE,
+            )
+        return _conversion_cache
+
+
+def get_conversion_cache_stats():
+    return get_conversion_cache().get_stats()
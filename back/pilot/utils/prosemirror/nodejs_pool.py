@@ -0,0 +1,230 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import select
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+
+from settings.base import frontend_path
+
+logger = logging.getLogger(__name__)
+
+__doc__ = '''
+Pool of long-lived node.js processes running serializePmDocWorker.js.
+
+Each worker speaks a line-delimited JSON protocol over stdin/stdout, and serialize a whole batch
+of documents in a single round-trip, so we pay the node.js boot only once per worker,
+instead of once per document.
+'''
+
+WORKER_SCRIPT_PATH = frontend_path(os.path.join('serializePmDoc', 'serializePmDocWorker.js'))
+
+
+class NodeWorkerError(Exception):
+    pass
+
+
+class NodeWorkerPoolFull(NodeWorkerError):
+    pass
+
+
+class NodeWorker:
+    def __init__(self, max_memory_mb):
+        self.process = subprocess.Popen(
+            ['node', f'--max-old-space-size={max_memory_mb}', WORKER_SCRIPT_PATH],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        self.request_id = 0
+        self.rss = 0
+        self.last_used_at = time.monotonic()
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def request(self, payload, timeout):
+        self.request_id += 1
+        payload = dict(payload, id=self.request_id)
+
+        try:
+            self.process.stdin.write(json.dumps(payload).encode() + b'\n')
+            self.process.stdin.flush()
+        except OSError as e:
+            raise NodeWorkerError(f'Cannot write to the node.js worker : {e}')
+
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise NodeWorkerError(f'The node.js worker did not answer within {timeout} seconds')
+        line = self.process.stdout.readline()
+        if not line:
+            raise NodeWorkerError(f'The node.js worker exited with code {self.process.poll()}')
+
+        response = json.loads(line)
+        self.last_used_at = time.monotonic()
+        self.rss = response.get('rss', 0)
+        if response.get('id') != self.request_id:
+            raise NodeWorkerError(f"The node.js worker answered {response.get('error') or 'to another request'}")
+        return response
+
+    def ping(self, timeout):
+        return self.request({'ping': True}, timeout).get('pong', False)
+
+    def stop(self):
+        if not self.is_alive():
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+class NodeWorkerPool:
+    """
+    A bounded pool of NodeWorker.
+
+    Workers are started lazily, health-checked after being idle for a while,
+    restarted when they crash, and recycled when they exceed their memory cap.
+    At most `size + queue_size` callers may use the pool at the same time,
+    the other ones get a NodeWorkerPoolFull error instead of piling up.
+    """
+    def __init__(self, size, queue_size, max_memory_mb, timeout, health_check_interval):
+        self.pid = os.getpid()
+        self.max_memory_mb = max_memory_mb
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self.admission = threading.BoundedSemaphore(size + queue_size)
+        # None are placeholders for the workers that are not started yet
+        self.idle_workers = queue.LifoQueue(maxsize=size)
+        for i in range(size):
+            self.idle_workers.put(None)
+        self.workers = set()
+        self.workers_lock = threading.Lock()
+
+    def serialize(self, pm_documents, output_format):
+        """
+        Serialize a batch of Prosemirror documents in a single round-trip to a node.js worker
+
+        Args:
+            pm_documents: a list of python dict representing Prosemirror documents
+            output_format: 'html', 'markdown' or 'text'
+
+        Returns: The list of the serialized documents
+        """
+        if not pm_documents:
+            return []
+
+        response = self.request({'format': output_format, 'documents': pm_documents})
+
+        serialized_documents = []
+        for result in response['results']:
+            if 'error' in result:
+                raise NodeWorkerError(f"Failed to serialize prosemirror document by node.js :\n{result['error']}")
+            serialized_documents.append(result['output'])
+        return serialized_documents
+
+    def request(self, payload):
+        if not self.admission.acquire(blocking=False):
+            raise NodeWorkerPoolFull('Too many pending requests on the node.js worker pool')
+
+        try:
+            try:
+                worker = self.idle_workers.get(timeout=self.timeout)
+            except queue.Empty:
+                raise NodeWorkerError(f'No node.js worker available after {self.timeout} seconds')
+
+            try:
+                worker = self.get_healthy_worker(worker)
+                try:
+                    response = worker.request(payload, self.timeout)
+                except NodeWorkerError:
+                    # The worker may have crashed, restart it and retry once
+                    logger.warning('Node.js worker failed, restarting it', exc_info=True)
+                    worker = self.restart_worker(worker)
+                    response = worker.request(payload, self.timeout)
+
+                if worker.rss > self.max_memory_mb * 1024 * 1024:
+                    logger.info(f'Node.js worker {worker.process.pid} uses {worker.rss} bytes, recycling it')
+                    self.stop_worker(worker)
+                    worker = None
+
+                return response
+
+            except Exception:
+                self.stop_worker(worker)
+                worker = None
+                raise
+
+            finally:
+                self.idle_workers.put(worker)
+
+        finally:
+            self.admission.release()
+
+    def get_healthy_worker(self, worker):
+        if worker is None or not worker.is_alive():
+            return self.restart_worker(worker)
+
+        if time.monotonic() - worker.last_used_at > self.health_check_interval:
+            try:
+                if worker.ping(self.timeout):
+                    return worker
+            except NodeWorkerError:
+                pass
+            logger.warning(f'Node.js worker {worker.process.pid} failed its health check, restarting it')
+            return self.restart_worker(worker)
+
+        return worker
+
+    def restart_worker(self, worker):
+        self.stop_worker(worker)
+        worker = NodeWorker(self.max_memory_mb)
+        with self.workers_lock:
+            self.workers.add(worker)
+        return worker
+
+    def stop_worker(self, worker):
+        if worker is None:
+            return
+        worker.stop()
+        with self.workers_lock:
+            self.workers.discard(worker)
+
+    def shutdown(self):
+        # Forked processes inherit the atexit handlers, but the workers belong to the parent
+        if os.getpid() != self.pid:
+            return
+        with self.workers_lock:
+            workers = list(self.workers)
+        for worker in workers:
+            self.stop_worker(worker)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_nodejs_pool():
+    """
+    Return the worker pool of the current process.
+    A forked process (like a RQ work horse) must not share the pipes of its parent, so it gets its own pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = NodeWorkerPool(
+                size=settings.PROSEMIRROR_NODEJS_POOL_SIZE,
+                queue_size=settings.PROSEMIRROR_NODEJS_QUEUE_SIZE,
+                max_memory_mb=settings.PROSEMIRROR_NODEJS_WORKER_MAX_MEMORY_MB,
+                timeout=settings.PROSEMIRROR_NODEJS_TIMEOUT,
+                health_check_interval=settings.PROSEMIRROR_NODEJS_HEALTH_CHECK_INTERVAL,
+            )
+            atexit.register(_pool.shutdown)
+        return _pool
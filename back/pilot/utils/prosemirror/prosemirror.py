@@ -1,12 +1,12 @@
-import os
 import json
 import logging
-import subprocess
-import tempfile
 
+from django.conf import settings
 from django.utils.safestring import mark_safe
 
-from settings.base import frontend_path
+from pilot.utils.prosemirror.cache import get_conversion_cache
+from pilot.utils.prosemirror.nodejs_pool import get_nodejs_pool
+from pilot.utils.prosemirror.serializer import serialize_prosemirror_document, ProsemirrorSerializationError
 
 logger = logging.getLogger(__name__)
 
@@ -49,74 +49,87 @@ def convert_text_to_prosemirror_doc(text):
     return {"type": "doc", "content": paragraph_nodes}
 
 
+def call_nodejs_serialize_prosemirror_documents(pm_documents, output_format):
+    """
+    Serialize a batch of Prosemirror documents in a single round-trip to a long-lived node.js worker
+
+    Args:
+        pm_documents: a list of Json strings or python dicts representing Prosemirror documents
+        output_format: 'html', 'markdown' or 'text'
+
+    Returns: The list of the serialized documents
+    """
+    pm_document_dicts = [get_body_input_as_dict(pm_document) for pm_document in pm_documents]
+
+    try:
+        serialized_documents = get_nodejs_pool().serialize(pm_document_dicts, output_format)
+    except Exception as e:
+        logger.error('Failed to serialize prosemirror document by node.js', exc_info=True)
+        raise
+
+    # Prosemirror serialize to CommonMarkdown which states that line break should be represented with backslash.
+    # We do not want that.
+    return [serialized_document.replace('\\\n', '\n') for serialized_document in serialized_documents]
+
+
 def call_nodejs_serialize_prosemirror_document(pm_document, output_format):
     if not pm_document or pm_document == EMPTY_PROSEMIRROR_DOC:
         return ''
 
+    return call_nodejs_serialize_prosemirror_documents([pm_document], output_format)[0]
+
+
+def prosemirror_serialize(pm_document, output_format):
+    """
+    Serialize a Prosemirror document, going through the conversion cache when it's enabled.
+    """
+    if not pm_document or pm_document == EMPTY_PROSEMIRROR_DOC:
+        return ''
+
     pm_document_dict = get_body_input_as_dict(pm_document)
-    pm_document_string = json.dumps(pm_document_dict).encode()
-    temporary_file = None
 
+    if settings.PROSEMIRROR_CONVERSION_CACHE_ENABLED:
+        return get_conversion_cache().get_or_convert(pm_document_dict, output_format, convert_prosemirror_document)
+    return convert_prosemirror_document(pm_document_dict, output_format)
+
+
+def convert_prosemirror_document(pm_document_dict, output_format):
+    """
+    Serialize a Prosemirror document with the python serializer.
+    Fallback to Node.js for the documents that the python serializer cannot handle.
+    """
     try:
-        # Small documents : pass directly the json as arg
-        if len(pm_document_string) < 10000:
-            transfer_mode = 'argument'
-            argument = json.dumps(pm_document)
-        # Document too large : transfer through a temporary file
-        else:
-            temporary_file = tempfile.NamedTemporaryFile(prefix='prosemirrorJsonToMarkdown_', delete=False)
-            temporary_file.write(pm_document_string)
-            transfer_mode = 'tempfile'
-            argument = temporary_file.name
-
-        serialized_document = subprocess.check_output(
-            ['node', frontend_path(os.path.join('serializePmDoc', 'serializePmDoc.js')), argument,  transfer_mode, output_format],
-            stderr=subprocess.STDOUT
-        )
-        serialized_document = serialized_document.decode()
-
-        # Prosemirror serialize to CommonMarkdown which states that line break should be represented with backslash.
-        # We do not want that. Replace this after writing our own Python Prosemirror Node Parser/Serializer
-        serialized_document = serialized_document.replace('\\\n', '\n')
-
-    except subprocess.CalledProcessError as e:
-        logger.error(f'Failed to serialize prosemirror document by node.js. '
-                     f'Output below :\n{e.output.decode()}', exc_info=True)
-        raise
-    except Exception as e:
-        logger.error('Failed to serialize prosemirror document', exc_info=True)
-        raise
-    finally:
-        if temporary_file:
-            temporary_file.close()
+        serialized_document = serialize_prosemirror_document(pm_document_dict, output_format)
+    except ProsemirrorSerializationError:
+        logger.warning('Python serialization of a prosemirror document failed, fallback to node.js', exc_info=True)
+        return call_nodejs_serialize_prosemirror_document(pm_document_dict, output_format)
 
-    return serialized_document
+    # Same post-processing than call_nodejs_serialize_prosemirror_document
+    return serialized_document.replace('\\\n', '\n')
 
 
 def prosemirror_json_to_markdown(pm_document):
     """
     Utility to convert JSON Prosemirror Document format to Markdown
-    Warning : This will delegate to Node.js, which may be resource consuming
 
     Args:
         pm_document: a Json string or python dict representing a Prosemirror document
 
     Returns: A string formatted in Markdown
     """
-    return call_nodejs_serialize_prosemirror_document(pm_document, 'markdown')
+    return prosemirror_serialize(pm_document, 'markdown')
 
 
 def prosemirror_json_to_html(pm_document):
     """
     Utility to convert JSON Prosemirror Document format to html.
-    Warning : This will delegate to Node.js, which may be resource consuming
 
     Args:
         pm_document: a Json string or python dict representing a Prosemirror document
 
     Returns: A string formatted in html
     """
-    html_document = call_nodejs_serialize_prosemirror_document(pm_document, 'html')
+    html_document = prosemirror_serialize(pm_document, 'html')
     # Prosemirror schema allow paragraph in list item and this exported as HTML "as is"
     # Before we properly fix this let's replace all the things and write too specific code
     html_document = mark_safe(html_document.replace('<li><p>', '<li>').replace('</p></li>','</li>'))
@@ -126,14 +139,13 @@ def prosemirror_json_to_html(pm_document):
 def prosemirror_json_to_text(pm_document):
     """
     Utility to convert JSON Prosemirror Document format to plain text.
-    Warning : This will delegate to Node.js, which may be resource consuming
 
     Args:
         pm_document: a Json string or python dict representing a Prosemirror document
 
     Returns: A string formatted in plain text
     """
-    return call_nodejs_serialize_prosemirror_document(pm_document, 'text')
+    return prosemirror_serialize(pm_document, 'text')
 
 
 def get_body_input_as_text(value):
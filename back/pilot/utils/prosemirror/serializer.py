@@ -0,0 +1,909 @@
+import os
+import re
+
+__doc__ = '''
+Pure python serialization of JSON Prosemirror documents to html, markdown and plain text.
+
+This is a port of the Node.js serializer bundled in front/serializePmDoc :
+ - the tiptap schema built by `buildSchema()` in front/src/richText/schema.js
+ - prosemirror-model `Node.fromJSON` and `DOMSerializer`
+ - prosemirror-markdown `defaultMarkdownSerializer` with our overrides
+ - jsdom `innerHTML` serialization
+
+Its output must stay byte-identical to the Node.js one (see golden_corpus.json).
+Anything that we do not reproduce faithfully raises `ProsemirrorSerializationError`,
+so the caller can fall back to the Node.js serializer.
+'''
+
+# Bump this when the output of the serializer changes
+SERIALIZER_VERSION = 1
+
+# Documents along with their html, markdown and text serialization by serializePmDoc.js
+GOLDEN_CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'golden_corpus.json')
+
+
+class ProsemirrorSerializationError(ValueError):
+    pass
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Javascript compatibility helpers
+# ----------------------------------------------------------------------------------------------------------------------
+
+# Characters matched by \s in a javascript regexp
+JS_WHITESPACE = '\t\n\x0b\x0c\r \xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000\ufeff'
+JS_LINE_TERMINATORS = '\n\r\u2028\u2029'
+
+# Javascript /^(\s*)(.*?)(\s*)$/m
+ENCLOSING_WHITESPACE_RE = re.compile(
+    f'(?:\\A|(?<=[{JS_LINE_TERMINATORS}]))'
+    f'([{JS_WHITESPACE}]*)([^{JS_LINE_TERMINATORS}]*?)([{JS_WHITESPACE}]*)'
+    f'(?=[{JS_LINE_TERMINATORS}]|\\Z)'
+)
+NON_WHITESPACE_RE = re.compile(f'[^{JS_WHITESPACE}]')
+TRAILING_WHITESPACE_RE = re.compile(f'[{JS_WHITESPACE}]+\\Z')
+MARKDOWN_ESCAPE_RE = re.compile(r'[`*\\~\[\]]')
+MARKDOWN_LINE_START_ESCAPE_RE = re.compile(r'\A[:#\-*+]')
+MARKDOWN_ORDERED_LIST_ESCAPE_RE = re.compile(r'\A([0-9]+)\.')
+BACKTICKS_RE = re.compile(r'`+')
+
+
+def js_truthy(value):
+    return value not in (None, False, 0, '')
+
+
+def js_string(value):
+    """
+    Mimic the javascript String() conversion, for the values we may find in a Prosemirror document
+    """
+    if isinstance(value, str):
+        return value
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, list):
+        return ','.join('' if v is None else js_string(v) for v in value)
+    raise ProsemirrorSerializationError(f'Cannot convert {value!r} to a javascript string')
+
+
+def js_int(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ProsemirrorSerializationError(f'Unsupported integer value {value!r}')
+    return value
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Schema
+# ----------------------------------------------------------------------------------------------------------------------
+
+REQUIRED = object()
+
+
+class NodeType:
+    def __init__(self, name, attrs=None, inline=False, leaf=False):
+        self.name = name
+        self.attrs = attrs or {}
+        self.is_text = name == 'text'
+        self.is_inline = inline or self.is_text
+        self.is_block = not self.is_inline
+        self.is_leaf = leaf or self.is_text
+
+
+class MarkType:
+    def __init__(self, name, rank, attrs=None):
+        self.name = name
+        self.rank = rank
+        self.attrs = attrs or {}
+        # Prosemirror returns a shared instance for marks created without attributes
+        self.instance = Mark(self, dict(self.attrs))
+
+
+def compute_attrs(type_attrs, value):
+    if value is not None and not isinstance(value, dict):
+        raise ProsemirrorSerializationError(f'Invalid attrs {value!r}')
+    value = value or {}
+    attrs = {}
+    for name, default in type_attrs.items():
+        if name in value:
+            attrs[name] = value[name]
+        elif default is REQUIRED:
+            raise ProsemirrorSerializationError(f'No value supplied for attribute {name}')
+        else:
+            attrs[name] = default
+    return attrs
+
+
+class Mark:
+    __slots__ = ('type', 'attrs')
+
+    def __init__(self, mark_type, attrs):
+        self.type = mark_type
+        self.attrs = attrs
+
+    def eq(self, other):
+        return self is other or (self.type is other.type and self.attrs == other.attrs)
+
+    def is_in_set(self, marks):
+        return any(self.eq(mark) for mark in marks)
+
+
+class Node:
+    __slots__ = ('type', 'attrs', 'content', 'marks', 'text')
+
+    def __init__(self, node_type, attrs, content, marks, text=None):
+        self.type = node_type
+        self.attrs = attrs
+        self.content = content
+        self.marks = marks
+        self.text = text
+
+    @property
+    def child_count(self):
+        return len(self.content)
+
+    def child(self, index):
+        if index < 0 or index >= len(self.content):
+            raise ProsemirrorSerializationError(f'Index {index} out of range')
+        return self.content[index]
+
+    def with_text(self, text):
+        return Node(self.type, self.attrs, self.content, self.marks, text)
+
+    @property
+    def text_content(self):
+        if self.type.is_text:
+            return self.text
+        return ''.join(child.text_content for child in self.content)
+
+
+CELL_ATTRS = {'colspan': 1, 'rowspan': 1, 'colwidth': None, 'background': None}
+
+NODE_TYPES = {node_type.name: node_type for node_type in (
+    NodeType('doc'),
+    NodeType('text'),
+    NodeType('paragraph'),
+    NodeType('blockquote'),
+    NodeType('bullet_list'),
+    NodeType('code_block'),
+    NodeType('hard_break', inline=True, leaf=True),
+    NodeType('heading', attrs={'level': 1}),
+    NodeType('horizontal_rule', leaf=True),
+    NodeType('list_item'),
+    NodeType('ordered_list', attrs={'order': 1}),
+    NodeType('image', inline=True, leaf=True, attrs={
+        'src': REQUIRED, 'caption': None, 'title': None, 'alt': None, 'alignment': None
+    }),
+    NodeType('table'),
+    NodeType('table_header', attrs=CELL_ATTRS),
+    NodeType('table_cell', attrs=CELL_ATTRS),
+    NodeType('table_row'),
+)}
+
+# The order matters : marks are sorted by rank on each node
+MARK_TYPES = {mark_type.name: mark_type for mark_type in (
+    MarkType('strong', 0),
+    MarkType('code', 1),
+    MarkType('em', 2),
+    MarkType('link', 3, attrs={'href': None, 'title': None}),
+    MarkType('strike', 4),
+    MarkType('underline', 5),
+    MarkType('mention', 6, attrs={'entity': None, 'id': None, 'uid': None}),
+)}
+
+
+def mark_from_json(json):
+    if not isinstance(json, dict):
+        raise ProsemirrorSerializationError('Invalid mark data')
+    mark_type = MARK_TYPES.get(json.get('type'))
+    if not mark_type:
+        raise ProsemirrorSerializationError(f"There is no mark type {json.get('type')!r} in this schema")
+    attrs = json.get('attrs')
+    if not js_truthy(attrs):
+        return mark_type.instance
+    return Mark(mark_type, compute_attrs(mark_type.attrs, attrs))
+
+
+def fragment_from_json(json):
+    if not js_truthy(json):
+        return []
+    if not isinstance(json, list):
+        raise ProsemirrorSerializationError('Invalid input for Fragment.fromJSON')
+
+    return [node_from_json(child) for child in json]
+
+
+def node_from_json(json):
+    if not isinstance(json, dict):
+        raise ProsemirrorSerializationError('Invalid input for Node.fromJSON')
+
+    marks = []
+    if js_truthy(json.get('marks')):
+        if not isinstance(json['marks'], list):
+            raise ProsemirrorSerializationError('Invalid mark data for Node.fromJSON')
+        marks = sorted((mark_from_json(mark) for mark in json['marks']), key=lambda mark: mark.type.rank)
+
+    node_type = NODE_TYPES.get(json.get('type'))
+    if not node_type:
+        raise ProsemirrorSerializationError(f"Unknown node type: {json.get('type')!r}")
+
+    if node_type.is_text:
+        text = json.get('text')
+        if not isinstance(text, str):
+            raise ProsemirrorSerializationError('Invalid text node in JSON')
+        if not text:
+            raise ProsemirrorSerializationError('Empty text nodes are not allowed')
+        return Node(node_type, {}, [], marks, text)
+
+    return Node(node_type, compute_attrs(node_type.attrs, json.get('attrs')), fragment_from_json(json.get('content')), marks)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Html
+# ----------------------------------------------------------------------------------------------------------------------
+
+VOID_ELEMENTS = {
+    'area', 'base', 'basefont', 'bgsound', 'br', 'col', 'embed', 'frame', 'hr', 'img', 'input', 'keygen', 'link',
+    'meta', 'param', 'source', 'track', 'wbr'
+}
+
+
+def escape_html_text(text):
+    return text.replace('&', '&amp;').replace('\xa0', '&nbsp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def escape_html_attribute(value):
+    return value.replace('&', '&amp;').replace('\xa0', '&nbsp;').replace('"', '&quot;')
+
+
+class DomFragment:
+    """
+    Minimal DOM, just enough to replay the prosemirror DOMSerializer and jsdom serialization
+    """
+    def __init__(self):
+        self.children = []
+
+    def append_child(self, child):
+        if isinstance(child, DomFragment) and not isinstance(child, DomElement):
+            self.children.extend(child.children)
+            child.children = []
+        else:
+            self.children.append(child)
+
+    def inner_html(self):
+        return ''.join(
+            escape_html_text(child) if isinstance(child, str) else child.outer_html()
+            for child in self.children
+        )
+
+
+class DomElement(DomFragment):
+    def __init__(self, tag):
+        super(DomElement, self).__init__()
+        self.tag = tag
+        self.attributes = {}
+
+    def set_attribute(self, name, value):
+        self.attributes[name.lower()] = js_string(value)
+
+    def outer_html(self):
+        attributes = ''.join(f' {name}="{escape_html_attribute(value)}"' for name, value in self.attributes.items())
+        if self.tag in VOID_ELEMENTS:
+            return f'<{self.tag}{attributes}>'
+        return f'<{self.tag}{attributes}>{self.inner_html()}</{self.tag}>'
+
+
+def render_spec(spec):
+    """
+    Port of DOMSerializer.renderSpec. Return a (dom, content_dom) tuple
+    """
+    if isinstance(spec, str):
+        return spec, None
+    if isinstance(spec, DomFragment):
+        return spec, None
+    if not isinstance(spec, list) or not spec or not isinstance(spec[0], str):
+        raise ProsemirrorSerializationError(f'Invalid DOM spec {spec!r}')
+
+    dom = DomElement(spec[0].lower())
+    content_dom = None
+    start = 1
+    if len(spec) > 1 and isinstance(spec[1], dict):
+        start = 2
+        for name, value in spec[1].items():
+            if value is not None:
+                dom.set_attribute(name, value)
+
+    for i in range(start, len(spec)):
+        child = spec[i]
+        if child == 0 and not isinstance(child, bool):
+            if i < len(spec) - 1 or i > start:
+                raise ProsemirrorSerializationError('Content hole must be the only child of its parent node')
+            return dom, dom
+        child_dom, child_content_dom = render_spec(child)
+        dom.append_child(child_dom)
+        if child_content_dom is not None:
+            if content_dom is not None:
+                raise ProsemirrorSerializationError('Multiple content holes')
+            content_dom = child_content_dom
+
+    return dom, content_dom
+
+
+def cell_attrs(node):
+    attrs = {}
+    for name in ('colspan', 'rowspan'):
+        value = node.attrs[name]
+        if value is not None and not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ProsemirrorSerializationError(f'Unsupported {name} {value!r}')
+        if value != 1:
+            attrs[name] = value
+    if js_truthy(node.attrs['colwidth']):
+        if not isinstance(node.attrs['colwidth'], list):
+            raise ProsemirrorSerializationError('Unsupported colwidth')
+        attrs['data-colwidth'] = js_string(node.attrs['colwidth'])
+    if js_truthy(node.attrs['background']):
+        attrs['style'] = f"{js_string(attrs.get('style', ''))}background-color: {js_string(node.attrs['background'])};"
+    return attrs
+
+
+def image_to_dom(node):
+    image_attrs = {name: node.attrs[name] for name in ('src', 'title', 'alt')}
+    surrounding_attrs = {}
+    if js_truthy(node.attrs['alignment']):
+        image_attrs['style'] = 'display: inline-block;'
+        surrounding_attrs['style'] = f"text-align: {js_string(node.attrs['alignment'])};"
+
+    if js_truthy(node.attrs['caption']):
+        if not isinstance(node.attrs['caption'], str):
+            raise ProsemirrorSerializationError('Unsupported image caption')
+        return ['figure', surrounding_attrs, ['img', image_attrs], ['figcaption', node.attrs['caption']]]
+    elif js_truthy(node.attrs['alignment']):
+        return ['div', surrounding_attrs, ['img', image_attrs]]
+    else:
+        return ['img', image_attrs]
+
+
+def ordered_list_to_dom(node):
+    order = node.attrs['order']
+    if order == 1 and isinstance(order, int) and not isinstance(order, bool):
+        return ['ol', 0]
+    return ['ol', {'start': order}, 0]
+
+
+class DOMSerializer:
+    nodes = {
+        'text': lambda node: node.text,
+        'paragraph': lambda node: ['p', 0],
+        'blockquote': lambda node: ['blockquote', 0],
+        'bullet_list': lambda node: ['ul', 0],
+        'code_block': lambda node: ['pre', ['code', 0]],
+        'hard_break': lambda node: ['br'],
+        'heading': lambda node: [f"h{js_int(node.attrs['level'])}", 0],
+        'horizontal_rule': lambda node: ['hr'],
+        'ordered_list': ordered_list_to_dom,
+        'image': image_to_dom,
+        'table': lambda node: ['table', ['tbody', 0]],
+        'table_row': lambda node: ['tr', 0],
+        'table_cell': lambda node: ['td', cell_attrs(node), 0],
+        'table_header': lambda node: ['th', cell_attrs(node), 0],
+    }
+
+    marks = {
+        'strong': lambda mark: ['strong', 0],
+        'code': lambda mark: ['code', 0],
+        'em': lambda mark: ['em', 0],
+        # During serialization, we add a target '_blank' to avoid an exit of the working context
+        'link': lambda mark: ['a', {'href': mark.attrs['href'], 'title': mark.attrs['title'], 'target': '_blank'}, 0],
+        'strike': lambda mark: ['s', 0],
+        'underline': lambda mark: ['u', 0],
+        'mention': lambda mark: ['span', {
+            'entity': mark.attrs['entity'],
+            'id': mark.attrs['id'],
+            'class': 'mention ' + js_string(mark.attrs['entity']),
+        }, 0],
+    }
+
+    def __init__(self, mention=True):
+        if not mention:
+            self.marks = {name: to_dom for name, to_dom in self.marks.items() if name != 'mention'}
+
+    def list_item_to_dom(self, node):
+        # We remove the <p> inside the <li> elements
+        # If the <li> has a single paragraph child, then we skip the <p> element and render directly its content
+        if len(node.content) == 1 and node.content[0].type.name == 'paragraph':
+            return ['li', self.serialize_fragment(node.content[0].content)]
+        return ['li', 0]
+
+    def serialize_fragment(self, nodes, target=None):
+        if target is None:
+            target = DomFragment()
+
+        top = target
+        active = None
+        for node in nodes:
+            if active is not None or node.marks:
+                if active is None:
+                    active = []
+                keep, rendered = 0, 0
+                while keep < len(active) and rendered < len(node.marks):
+                    next_mark = node.marks[rendered]
+                    if next_mark.type.name not in self.marks:
+                        rendered += 1
+                        continue
+                    if not next_mark.eq(active[keep]):
+                        break
+                    keep += 2
+                    rendered += 1
+                while keep < len(active):
+                    top = active.pop()
+                    active.pop()
+                while rendered < len(node.marks):
+                    add = node.marks[rendered]
+                    rendered += 1
+                    mark_dom = self.serialize_mark(add)
+                    if mark_dom:
+                        active.extend((add, top))
+                        dom, content_dom = mark_dom
+                        top.append_child(dom)
+                        top = content_dom or dom
+            top.append_child(self.serialize_node(node))
+
+        return target
+
+    def serialize_node(self, node):
+        if node.type.name == 'list_item':
+            to_dom = self.list_item_to_dom
+        else:
+            to_dom = self.nodes.get(node.type.name)
+        if not to_dom:
+            raise ProsemirrorSerializationError(f'No DOM spec for node {node.type.name}')
+
+        dom, content_dom = render_spec(to_dom(node))
+        if content_dom is not None:
+            if node.type.is_leaf:
+                raise ProsemirrorSerializationError('Content hole not allowed in a leaf node spec')
+            self.serialize_fragment(node.content, content_dom)
+        return dom
+
+    def serialize_mark(self, mark):
+        to_dom = self.marks.get(mark.type.name)
+        return to_dom and render_spec(to_dom(mark))
+
+
+def outer_html(dom):
+    return escape_html_text(dom) if isinstance(dom, str) else dom.outer_html()
+
+
+full_dom_serializer = DOMSerializer()
+# The markdown table serializer is bound to the last schema built in schema.js (wikiSchema, without mentions)
+markdown_table_dom_serializer = DOMSerializer(mention=False)
+
+
+def serialize_node_to_html(node, serializer, new_line=''):
+    html = new_line.join(outer_html(serializer.serialize_node(child)) for child in node.content)
+    # Ignore the document if it's composed of only one empty paragraphs
+    if html == '<p></p>':
+        html = ''
+    return html
+
+
+def doc_to_html(doc):
+    return full_dom_serializer.serialize_fragment(doc.content, DomElement('div')).inner_html()
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Markdown
+# ----------------------------------------------------------------------------------------------------------------------
+
+def backticks_for(node, side):
+    length = 0
+    if node.type.is_text:
+        for match in BACKTICKS_RE.finditer(node.text):
+            length = max(length, len(match.group(0)))
+    result = ' `' if length > 0 and side > 0 else '`'
+    result += '`' * length
+    if length > 0 and side < 0:
+        result += ' '
+    return result
+
+
+def is_plain_url(link, parent, index, side):
+    if js_truthy(link.attrs['title']):
+        return False
+    content = parent.child(index + (-1 if side < 0 else 0))
+    if not content.type.is_text or content.text != link.attrs['href'] or not content.marks \
+            or content.marks[-1] is not link:
+        return False
+    if index == (1 if side < 0 else parent.child_count - 1):
+        return True
+    next_node = parent.child(index + (-2 if side < 0 else 1))
+    return not link.is_in_set(next_node.marks)
+
+
+def link_close(state, mark, parent, index):
+    if is_plain_url(mark, parent, index, -1):
+        return '>'
+    title = f" {state.quote(mark.attrs['title'])}" if js_truthy(mark.attrs['title']) else ''
+    return f"]({state.esc(js_string(mark.attrs['href']))}{title})"
+
+
+MARKDOWN_MARKS = {
+    'em': {'open': '*', 'close': '*', 'mixable': True, 'expel_enclosing_whitespace': True},
+    'strong': {'open': '**', 'close': '**', 'mixable': True, 'expel_enclosing_whitespace': True},
+    'link': {
+        'open': lambda state, mark, parent, index: '<' if is_plain_url(mark, parent, index, 1) else '[',
+        'close': link_close,
+    },
+    'code': {
+        'open': lambda state, mark, parent, index: backticks_for(parent.child(index), -1),
+        'close': lambda state, mark, parent, index: backticks_for(parent.child(index - 1), 1),
+        'escape': False,
+    },
+    # There's not syntax for underline, strike and mentions in markdown, do nothing
+    'underline': {'open': '', 'close': ''},
+    'strike': {'open': '', 'close': ''},
+    'mention': {'open': '', 'close': ''},
+}
+
+
+class MarkdownSerializerState:
+    """
+    Port of prosemirror-markdown MarkdownSerializerState
+    """
+    def __init__(self):
+        self.marks = MARKDOWN_MARKS
+        self.delim = self.out = ''
+        self.closed = False
+        self.in_tight_list = False
+
+    def flush_close(self, size=2):
+        if self.closed:
+            if not self.at_blank():
+                self.out += '\n'
+            if size > 1:
+                delim = TRAILING_WHITESPACE_RE.sub('', self.delim)
+                for i in range(1, size):
+                    self.out += delim + '\n'
+            self.closed = False
+
+    def wrap_block(self, delim, first_delim, node, callback):
+        old = self.delim
+        self.write(first_delim or delim)
+        self.delim += delim
+        callback()
+        self.delim = old
+        self.close_block(node)
+
+    def at_blank(self):
+        return not self.out or self.out.endswith('\n')
+
+    def ensure_new_line(self):
+        if not self.at_blank():
+            self.out += '\n'
+
+    def write(self, content=None):
+        self.flush_close()
+        if self.delim and self.at_blank():
+            self.out += self.delim
+        if content:
+            self.out += content
+
+    def close_block(self, node):
+        self.closed = node
+
+    def text(self, text, escape=True):
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            start_of_line = self.at_blank() or bool(self.closed)
+            self.write()
+            self.out += self.esc(line, start_of_line) if escape else line
+            if i != len(lines) - 1:
+                self.out += '\n'
+
+    def render(self, node, parent, index):
+        render_node = MARKDOWN_NODES.get(node.type.name)
+        if not render_node:
+            raise ProsemirrorSerializationError(f'No markdown serializer for node {node.type.name}')
+        render_node(self, node, parent, index)
+
+    def render_content(self, parent):
+        for index, node in enumerate(parent.content):
+            self.render(node, parent, index)
+
+    def render_inline(self, parent):
+        active = []
+        trailing = ''
+
+        def progress(node, index):
+            nonlocal trailing
+            marks = node.marks if node else []
+
+            # Remove marks from `hard_break` that are the last node inside
+            # that mark to prevent parser edge cases with new lines just
+            # before closing marks.
+            if node and node.type.name == 'hard_break':
+                def keep_mark(mark):
+                    if index + 1 == parent.child_count:
+                        return False
+                    next_node = parent.child(index + 1)
+                    return mark.is_in_set(next_node.marks) and (
+                        not next_node.type.is_text or bool(NON_WHITESPACE_RE.search(next_node.text))
+                    )
+                marks = [mark for mark in marks if keep_mark(mark)]
+
+            leading = trailing
+            trailing = ''
+            # If whitespace has to be expelled from the node, adjust
+            # leading and trailing accordingly.
+            if node and node.type.is_text and any(
+                self.marks[mark.type.name].get('expel_enclosing_whitespace') for mark in marks
+            ):
+                match = ENCLOSING_WHITESPACE_RE.search(node.text)
+                lead, inner, trail = match.groups()
+                leading += lead
+                trailing = trail
+                if lead or trail:
+                    node = node.with_text(inner) if inner else None
+                    if not node:
+                        marks = active
+
+            inner_mark = marks[-1] if marks else None
+            no_esc = bool(inner_mark) and self.marks[inner_mark.type.name].get('escape') is False
+            length = len(marks) - (1 if no_esc else 0)
+
+            # Try to reorder 'mixable' marks, such as em and strong, which
+            # in Markdown may be opened and closed in different order, so
+            # that order of the marks for the token matches the order in
+            # active.
+            i = 0
+            while i < length:
+                mark = marks[i]
+                if not self.marks[mark.type.name].get('mixable'):
+                    break
+                for j, other in enumerate(active):
+                    if not self.marks[other.type.name].get('mixable'):
+                        break
+                    if mark.eq(other):
+                        if i > j:
+                            marks = marks[:j] + [mark] + marks[j:i] + marks[i + 1:length]
+                        elif j > i:
+                            marks = marks[:i] + marks[i + 1:j] + [mark] + marks[j:length]
+                        break
+                i += 1
+
+            # Find the prefix of the mark set that didn't change
+            keep = 0
+            while keep < min(len(active), length) and marks[keep].eq(active[keep]):
+                keep += 1
+
+            # Close the marks that need to be closed
+            while keep < len(active):
+                self.text(self.mark_string(active.pop(), False, parent, index), False)
+
+            # Output any previously expelled trailing whitespace outside the marks
+            if leading:
+                self.text(leading)
+
+            # Open the marks that need to be opened
+            if node:
+                while len(active) < length:
+                    add = marks[len(active)]
+                    active.append(add)
+                    self.text(self.mark_string(add, True, parent, index), False)
+
+                # Render the node. Special case code marks, since their content
+                # may not be escaped.
+                if no_esc and node.type.is_text:
+                    self.text(
+                        self.mark_string(inner_mark, True, parent, index)
+                        + node.text
+                        + self.mark_string(inner_mark, False, parent, index + 1),
+                        False
+                    )
+                else:
+                    self.render(node, parent, index)
+
+        for index, node in enumerate(parent.content):
+            progress(node, index)
+        progress(None, parent.child_count)
+
+    def render_list(self, node, delim, first_delim):
+        if self.closed and self.closed.type is node.type:
+            self.flush_close(3)
+        elif self.in_tight_list:
+            self.flush_close(1)
+
+        is_tight = node.attrs.get('tight', False)
+        prev_tight = self.in_tight_list
+        self.in_tight_list = is_tight
+        for index, child in enumerate(node.content):
+            if index and is_tight:
+                self.flush_close(1)
+            self.wrap_block(delim, first_delim(index), node, lambda: self.render(child, node, index))
+        self.in_tight_list = prev_tight
+
+    def esc(self, text, start_of_line=False):
+        text = MARKDOWN_ESCAPE_RE.sub(lambda match: '\\' + match.group(0), text)
+        if start_of_line:
+            text = MARKDOWN_LINE_START_ESCAPE_RE.sub(lambda match: '\\' + match.group(0), text, count=1)
+            text = MARKDOWN_ORDERED_LIST_ESCAPE_RE.sub(lambda match: match.group(1) + '\\.', text, count=1)
+        return text
+
+    def quote(self, text):
+        text = js_string(text)
+        if '"' not in text:
+            wrap = '""'
+        elif "'" not in text:
+            wrap = "''"
+        else:
+            wrap = '()'
+        return wrap[0] + text + wrap[1]
+
+    def mark_string(self, mark, open, parent, index):
+        info = self.marks[mark.type.name]
+        value = info['open'] if open else info['close']
+        return value if isinstance(value, str) else value(self, mark, parent, index)
+
+
+def markdown_blockquote(state, node, parent, index):
+    state.wrap_block('> ', None, node, lambda: state.render_content(node))
+
+
+def markdown_code_block(state, node, parent, index):
+    state.write('```\n')
+    state.text(node.text_content, False)
+    state.ensure_new_line()
+    state.write('```')
+    state.close_block(node)
+
+
+def markdown_heading(state, node, parent, index):
+    state.write('#' * js_int(node.attrs['level']) + ' ')
+    state.render_inline(node)
+    state.close_block(node)
+
+
+def markdown_horizontal_rule(state, node, parent, index):
+    state.write('---')
+    state.close_block(node)
+
+
+def markdown_bullet_list(state, node, parent, index):
+    state.render_list(node, '  ', lambda i: '* ')
+
+
+def markdown_ordered_list(state, node, parent, index):
+    start = node.attrs['order'] if js_truthy(node.attrs['order']) else 1
+    start = js_int(start)
+    max_width = len(str(start + node.child_count - 1))
+    space = ' ' * (max_width + 2)
+
+    def first_delim(i):
+        number = str(start + i)
+        return ' ' * (max_width - len(number)) + number + '. '
+
+    state.render_list(node, space, first_delim)
+
+
+def markdown_list_item(state, node, parent, index):
+    state.render_content(node)
+
+
+def markdown_paragraph(state, node, parent, index):
+    state.render_inline(node)
+    state.close_block(node)
+
+
+def markdown_image(state, node, parent, index):
+    alt = node.attrs['alt'] if js_truthy(node.attrs['alt']) else ''
+    title = f" {state.quote(node.attrs['title'])}" if js_truthy(node.attrs['title']) else ''
+    state.write(f"![{state.esc(js_string(alt))}]({state.esc(js_string(node.attrs['src']))}{title})")
+
+
+def markdown_hard_break(state, node, parent, index):
+    for i in range(index + 1, parent.child_count):
+        if parent.child(i).type is not node.type:
+            state.write('\\\n')
+            return
+
+
+def markdown_text(state, node, parent, index):
+    state.text(node.text)
+
+
+def markdown_table(state, node, parent, index):
+    # There is a extension syntax for tables in markdown, but it's not widely supported.
+    # Go for the safe path with embedded html
+    state.ensure_new_line()
+    state.write('<table>\n')
+    state.write(serialize_node_to_html(node, markdown_table_dom_serializer, '\n'))
+    state.ensure_new_line()
+    state.write('</table>\n')
+    state.close_block(node)
+
+
+MARKDOWN_NODES = {
+    'blockquote': markdown_blockquote,
+    'code_block': markdown_code_block,
+    'heading': markdown_heading,
+    'horizontal_rule': markdown_horizontal_rule,
+    'bullet_list': markdown_bullet_list,
+    'ordered_list': markdown_ordered_list,
+    'list_item': markdown_list_item,
+    'paragraph': markdown_paragraph,
+    'image': markdown_image,
+    'hard_break': markdown_hard_break,
+    'text': markdown_text,
+    'table': markdown_table,
+}
+
+
+def doc_to_markdown(doc):
+    state = MarkdownSerializerState()
+    state.render_content(doc)
+    return state.out
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Text
+# ----------------------------------------------------------------------------------------------------------------------
+
+def doc_to_text(doc, block_separator='\n\n'):
+    """
+    Port of Node.textBetween(0, doc.content.size, blockSeparator)
+    """
+    text_chunks = []
+    separated = True
+
+    def walk(nodes):
+        nonlocal separated
+        for node in nodes:
+            if node.type.is_text:
+                text_chunks.append(node.text)
+                separated = False
+            elif not separated and node.type.is_block:
+                text_chunks.append(block_separator)
+                separated = True
+            if node.content:
+                walk(node.content)
+
+    walk(doc.content)
+    return ''.join(text_chunks)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Entry point
+# ----------------------------------------------------------------------------------------------------------------------
+
+OUTPUT_FORMATS = {
+    'html': doc_to_html,
+    'markdown': doc_to_markdown,
+    'text': doc_to_text,
+}
+
+
+def serialize_prosemirror_document(pm_document_dict, output_format):
+    """
+    Serialize a Prosemirror document, with the same output than front/serializePmDoc/serializePmDoc.js
+
+    Args:
+        pm_document_dict: a python dict representing a Prosemirror document
+        output_format: 'html', 'markdown' or 'text'
+
+    Returns: The serialized string
+
+    Raises: ProsemirrorSerializationError when the document cannot be serialized
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ProsemirrorSerializationError(f'Incorrect output format {output_format}')
+
+    try:
+        return OUTPUT_FORMATS[output_format](node_from_json(pm_document_dict))
+    except ProsemirrorSerializationError:
+        raise
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError, RecursionError) as e:
+        raise ProsemirrorSerializationError(str(e)) from e
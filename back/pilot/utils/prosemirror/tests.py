@@ -0,0 +1,171 @@
+import json
+import os
+import signal
+
+import mock
+
+from django.test import SimpleTestCase
+
+from pilot.utils.prosemirror.cache import ByteSizeLRUCache, CONVERSION_CACHE_STATS_REDIS_KEY, \
+    ProsemirrorConversionCache
+from pilot.utils.prosemirror.nodejs_pool import NodeWorkerPool, NodeWorkerPoolFull
+from pilot.utils.prosemirror.prosemirror import prosemirror_json_to_html, prosemirror_json_to_markdown, \
+    prosemirror_json_to_text
+from pilot.utils.prosemirror.serializer import serialize_prosemirror_document, GOLDEN_CORPUS_PATH
+
+
+def load_golden_corpus():
+    with open(GOLDEN_CORPUS_PATH) as corpus_file:
+        return json.load(corpus_file)
+
+
+class PythonSerializerTests(SimpleTestCase):
+    def test_golden_corpus(self):
+        """
+        The python serializer must produce the exact same output than serializePmDoc.js
+        """
+        corpus = load_golden_corpus()
+
+        for i, entry in enumerate(corpus):
+            for output_format in ('html', 'markdown', 'text'):
+                with self.subTest(document=i, output_format=output_format):
+                    self.assertEqual(
+                        serialize_prosemirror_document(entry['document'], output_format),
+                        entry[output_format]
+                    )
+
+    @mock.patch('pilot.utils.prosemirror.prosemirror.call_nodejs_serialize_prosemirror_document')
+    def test_serialization(self, mock_nodejs):
+        pm_document = {'type': 'doc', 'content': [
+            {'type': 'paragraph', 'content': [
+                {'type': 'text', 'text': 'Hello'},
+                {'type': 'hard_break'},
+                {'type': 'text', 'text': 'world', 'marks': [{'type': 'strong'}]},
+            ]},
+            {'type': 'bullet_list', 'content': [
+                {'type': 'list_item', 'content': [{'type': 'paragraph', 'content': [{'type': 'text', 'text': 'item'}]}]}
+            ]},
+        ]}
+
+        self.assertEqual(prosemirror_json_to_html(pm_document), '<p>Hello<br><strong>world</strong></p><ul><li>item</li></ul>')
+        self.assertEqual(prosemirror_json_to_markdown(json.dumps(pm_document)), 'Hello\n**world**\n\n* item')
+        self.assertEqual(prosemirror_json_to_text(pm_document), 'Helloworld\n\nitem')
+        self.assertEqual(prosemirror_json_to_text({"content": [{"type": "paragraph"}], "type": "doc"}), '')
+        mock_nodejs.assert_not_called()
+
+    @mock.patch('pilot.utils.prosemirror.prosemirror.call_nodejs_serialize_prosemirror_document', return_value='')
+    def test_fallback_to_nodejs(self, mock_nodejs):
+        pm_document = {'type': 'doc', 'content': [{'type': 'unknown_node'}]}
+
+        prosemirror_json_to_html(pm_document)
+
+        mock_nodejs.assert_called_once_with(pm_document, 'html')
+
+
+class ConversionCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.redis = mock.Mock()
+        self.redis.get.return_value = None
+        self.redis.hgetall.return_value = {}
+        self.cache = ProsemirrorConversionCache(self.redis, local_max_bytes=1024, redis_ttl=60, redis_min_size=0)
+        self.convert = mock.Mock(side_effect=serialize_prosemirror_document)
+        self.pm_document = {'type': 'doc', 'content': [{'type': 'paragraph', 'content': [{'type': 'text', 'text': 'Hello'}]}]}
+
+    def test_local_hit(self):
+        self.assertEqual(self.cache.get_or_convert(self.pm_document, 'html', self.convert), '<p>Hello</p>')
+        # Same content, different key order
+        same_document = json.loads(json.dumps(self.pm_document, sort_keys=True))
+        self.assertEqual(self.cache.get_or_convert(same_document, 'html', self.convert), '<p>Hello</p>')
+        self.assertEqual(self.cache.get_or_convert(self.pm_document, 'text', self.convert), 'Hello')
+
+        self.assertEqual(self.convert.call_count, 2)
+        self.assertEqual(self.redis.get.call_count, 2)
+        stats = self.cache.get_stats()['process']
+        self.assertEqual((stats['local_hits'], stats['redis_hits'], stats['misses']), (1, 0, 2))
+
+    def test_redis_hit(self):
+        self.redis.get.return_value = b'<p>From redis</p>'
+
+        self.assertEqual(self.cache.get_or_convert(self.pm_document, 'html', self.convert), '<p>From redis</p>')
+        self.assertEqual(self.cache.get_or_convert(self.pm_document, 'html', self.convert), '<p>From redis</p>')
+
+        self.convert.assert_not_called()
+        self.redis.get.assert_called_once()
+        stats = self.cache.get_stats()['process']
+        self.assertEqual((stats['local_hits'], stats['redis_hits'], stats['misses']), (1, 1, 0))
+
+    def test_small_documents_stay_local(self):
+        self.cache.redis_min_size = 1000
+
+        self.cache.get_or_convert(self.pm_document, 'html', self.convert)
+
+        self.redis.get.assert_not_called()
+        self.redis.pipeline.assert_not_called()
+
+    def test_stats_flushed_on_hits(self):
+        self.cache.redis_min_size = 1000
+        self.cache.stats_flush_operations = 3
+        pipeline = self.redis.pipeline.return_value
+
+        self.cache.get_or_convert(self.pm_document, 'html', self.convert)
+        self.cache.get_or_convert(self.pm_document, 'html', self.convert)
+        self.redis.pipeline.assert_not_called()
+
+        # Only local hits, the counters are flushed after 3 operations
+        self.cache.get_or_convert(self.pm_document, 'html', self.convert)
+        pipeline.hincrby.assert_has_calls([
+            mock.call(CONVERSION_CACHE_STATS_REDIS_KEY, 'local_hits', 2),
+            mock.call(CONVERSION_CACHE_STATS_REDIS_KEY, 'misses', 1),
+        ], any_order=True)
+        pipeline.execute.assert_called_once()
+
+    def test_byte_size_eviction(self):
+        lru = ByteSizeLRUCache(max_bytes=10)
+        lru.set('a', 'aaaa')
+        lru.set('b', 'bbbb')
+        lru.get('a')
+        # 'b' is the least recently used
+        self.assertEqual(lru.set('c', 'cccc'), 1)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual(lru.get('a'), 'aaaa')
+        self.assertEqual(lru.size, 8)
+        # Values larger than the whole cache are not stored
+        self.assertEqual(lru.set('d', 'd' * 11), 0)
+        self.assertEqual(len(lru), 2)
+
+
+class NodeWorkerPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.pool = NodeWorkerPool(size=1, queue_size=0, max_memory_mb=256, timeout=30, health_check_interval=60)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_batch(self):
+        corpus = load_golden_corpus()
+
+        for output_format in ('html', 'markdown', 'text'):
+            self.assertEqual(
+                self.pool.serialize([entry['document'] for entry in corpus], output_format),
+                [entry[output_format] for entry in corpus]
+            )
+        # A single worker served all the batches
+        self.assertEqual(len(self.pool.workers), 1)
+
+    def test_restart_on_crash(self):
+        pm_document = {'type': 'doc', 'content': [{'type': 'paragraph', 'content': [{'type': 'text', 'text': 'Hello'}]}]}
+        self.assertEqual(self.pool.serialize([pm_document], 'text'), ['Hello'])
+
+        worker = next(iter(self.pool.workers))
+        os.kill(worker.process.pid, signal.SIGKILL)
+        worker.process.wait()
+
+        self.assertEqual(self.pool.serialize([pm_document], 'text'), ['Hello'])
+        self.assertNotIn(worker, self.pool.workers)
+
+    def test_bounded_queue(self):
+        # The single slot of the pool is already taken
+        self.pool.admission.acquire()
+
+        with self.assertRaises(NodeWorkerPoolFull):
+            self.pool.serialize([{'type': 'doc'}], 'text')
@@ -1,8 +1,10 @@
 import hashlib
 import json
 import hmac
+import threading
 from base64 import b64encode
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 
 from botocore.exceptions import ClientError
 import boto3
@@ -167,13 +169,62 @@ def s3_file_exists(key):
             raise
 
 
-def download_s3_file(key):
+def download_s3_file(key, if_match=None):
+    """
+    With `if_match`, fails if the ETag of the file has changed
+    """
+    extra_args = {'IfMatch': if_match} if if_match else {}
     return s3_client.get_object(
         Bucket=bucket_name,
         Key=key,
+        **extra_args
     )['Body']
 
 
+def download_s3_file_range(key, start, end):
+    """
+    Returns: the streamed body of the bytes from `start` to `end` ( included ) of the file,
+    and the total size of the file
+    """
+    try:
+        response = s3_client.get_object(
+            Bucket=bucket_name,
+            Key=key,
+            Range='bytes={}-{}'.format(start, end),
+        )
+    except ClientError as e:
+        # S3 refuses any range on an empty file
+        if e.response['Error']['Code'] != 'InvalidRange':
+            raise
+        response = s3_client.get_object(
+            Bucket=bucket_name,
+            Key=key,
+        )
+        return response['Body'], response['ContentLength']
+
+    # Content-Range: bytes 0-8388607/24715264
+    total_size = int(response['ContentRange'].split('/')[-1])
+    return response['Body'], total_size
+
+
+def get_s3_file_metadata(key):
+    """
+    Returns: the user-defined metadata and the ETag of the file, without downloading it,
+    or (None, None) if there's no such file
+    """
+    try:
+        response = s3_client.head_object(
+            Bucket=bucket_name,
+            Key=key,
+        )
+    except ClientError as e:
+        # A HEAD response has no body, hence no NoSuchKey error code
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+            return None, None
+        raise
+    return response['Metadata'], response['ETag']
+
+
 def upload_s3_file(key, file, file_name):
     s3_client.put_object(
         ACL='public-read',
@@ -184,6 +235,18 @@ def upload_s3_file(key, file, file_name):
     )
 
 
+def upload_private_s3_file(key, file, metadata=None):
+    """
+    Upload a file which is only read back by the backend, with some user-defined metadata
+    """
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Body=file,
+        Key=key,
+        Metadata=metadata or {},
+    )
+
+
 def upload_s3_file_multipart(key, file, file_name):
     """
     Transfer a big file to S3 with 8Mo chunks and up to 10 threads
@@ -206,6 +269,107 @@ def upload_s3_file_multipart(key, file, file_name):
     )
 
 
+class S3MultipartUploadWriter(object):
+    """
+    A write-only, non-seekable file, which uploads its content to S3 with a multipart upload, as it is written.
+    This allows to pipe an archive being built ( see BufferedZipFile ) directly to S3, without a temporary file.
+
+    The parts are uploaded by a thread pool while the next ones are written.
+    At most `max_concurrency` parts are held in RAM : the writes wait for an upload to finish beyond that.
+
+    close() completes the upload, abort() cancels it.
+    """
+    def __init__(self, key, file_name, part_size=1024 * 1024 * 8, max_concurrency=4):
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        self.part_results = []
+        self.part_slots = threading.BoundedSemaphore(max_concurrency)
+        self.thread_pool = ThreadPool(max_concurrency)
+        self.closed = False
+
+        self.upload_id = s3_client.create_multipart_upload(
+            ACL='public-read',
+            Bucket=bucket_name,
+            ContentDisposition='attachment;filename="{name}"'.format(name=file_name),
+            Key=key,
+        )['UploadId']
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self.upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def flush(self):
+        # The parts must be at least 5Mo ( but the last one ), they are only uploaded once full
+        pass
+
+    def upload_part(self, data):
+        part_number = len(self.part_results) + 1
+        self.part_slots.acquire()
+
+        def upload():
+            try:
+                response = s3_client.upload_part(
+                    Body=data,
+                    Bucket=bucket_name,
+                    Key=self.key,
+                    PartNumber=part_number,
+                    UploadId=self.upload_id,
+                )
+                return {'ETag': response['ETag'], 'PartNumber': part_number}
+            finally:
+                self.part_slots.release()
+
+        self.part_results.append(self.thread_pool.apply_async(upload))
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # The last part, which may be smaller. An empty file still needs one part.
+            if self.buffer or not self.part_results:
+                self.upload_part(bytes(self.buffer))
+                self.buffer = bytearray()
+
+            parts = [part_result.get() for part_result in self.part_results]
+            s3_client.complete_multipart_upload(
+                Bucket=bucket_name,
+                Key=self.key,
+                MultipartUpload={'Parts': parts},
+                UploadId=self.upload_id,
+            )
+        except:
+            self.abort()
+            raise
+        finally:
+            self.closed = True
+            self.thread_pool.close()
+
+    def abort(self):
+        """
+        Cancel the upload, so S3 does not keep the uploaded parts
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.thread_pool.terminate()
+        s3_client.abort_multipart_upload(
+            Bucket=bucket_name,
+            Key=self.key,
+            UploadId=self.upload_id,
+        )
+
+
 def update_s3_filename(key, new_name):
     s3_file = s3_resource.Object(bucket_name, key)
     s3_file.copy_from(
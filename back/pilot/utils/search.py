@@ -1,4 +1,6 @@
+import hashlib
 import logging
+import time
 
 import django_filters
 from django_filters.constants import EMPTY_VALUES
@@ -7,7 +9,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.indexes import GinIndex
 from django.contrib.postgres.search import SearchQuery, SearchVectorField, SearchVector
 from django.db.migrations.operations.base import Operation
-from django.db import models
+from django.db import connection, models
 from django.db.models.expressions import Func, Value
 from django.db.models.fields import TextField
 
@@ -18,6 +20,8 @@ logger = logging.getLogger(__name__)
 TS_HEADLINE_OPTIONS = 'StartSel="<span class=\'highlight\'>", StopSel=</span>, MaxFragments=2'
 
 SEARCH_VECTOR_UPDATE_REDIS_KEY = 'pilot:search_vector_update'
+# Number of elements popped from redis, and updated in a single query
+SEARCH_VECTOR_UPDATE_BATCH_SIZE = 500
 
 
 class UnaccentFunc(Func):
@@ -80,6 +84,8 @@ class TrigramIndex(GinIndex):
 class FullTextSearchModel(models.Model):
     search_vector = SearchVectorField(null=True)
     partial_search_document = models.TextField(blank=True)
+    # Digest of the search document used to compute the current search_vector
+    search_document_digest = models.CharField(max_length=40, blank=True)
 
     class Meta:
         abstract = True
@@ -94,23 +100,35 @@ class FullTextSearchModel(models.Model):
     def save(self, *args, **kwargs):
         super(FullTextSearchModel, self).save(*args, **kwargs)
 
-        # Obviously, don't schedule a search vector update if we're currently updating it
-        if not getattr(self, 'updating_search_vector', False):
+        # Obviously, don't schedule a search vector update if we're currently updating it.
+        # Most saves don't touch the searchable text (workflow state, annotations, ...), skip them too.
+        if not getattr(self, 'updating_search_vector', False) and self.search_document_changed():
             schedule_search_vector_update(self)
 
+    def search_document_changed(self):
+        search_document = get_search_document(self.get_current_search_values())
+        return get_search_document_digest(search_document) != self.search_document_digest
+
     def update_search_vector(self):
         # We need to force the django ORM to emit an explicit update on the search_vector field,
         # by using update_fields, so Postgres will re-calculate the new tsvector value.
-        self.search_vector = self.get_search_vector()
-        self.partial_search_document = UnaccentFunc(self.get_search_document())
+        search_values = self.get_current_search_values()
+        search_document = get_search_document(search_values)
+        self.search_vector = self.get_search_vector(search_values)
+        self.partial_search_document = UnaccentFunc(search_document)
+        self.search_document_digest = get_search_document_digest(search_document)
         self.updating_search_vector = True
         self.prevent_updated_at = True
-        super(FullTextSearchModel, self).save(update_fields=['search_vector', 'partial_search_document'])
+        super(FullTextSearchModel, self).save(
+            update_fields=['search_vector', 'partial_search_document', 'search_document_digest']
+        )
 
-    def get_search_vector(self):
+    def get_search_vector(self, search_values=None):
+        if search_values is None:
+            search_values = self.get_search_values()
         search_values = [
             models.Value(value, output_field=models.TextField())
-            for value in self.get_search_values()
+            for value in search_values
         ]
         return SearchVector(
             *search_values,
@@ -118,11 +136,44 @@ class FullTextSearchModel(models.Model):
         )
 
     def get_search_document(self):
-        return "\n".join(filter(None, self.get_search_values()))
+        return get_search_document(self.get_search_values())
 
     def get_search_values(self):
         raise NotImplementedError()
 
+    def get_current_search_values(self):
+        """
+        The subclasses memoize get_search_values on the instance id,
+        which returns stale values after a modification of the instance.
+        """
+        get_search_values = getattr(self.get_search_values, 'uncached', None)
+        if get_search_values:
+            return get_search_values(self)
+        return self.get_search_values()
+
+    @classmethod
+    def get_search_vector_update_queryset(cls):
+        """
+        The queryset used to load the instances in run_search_vector_update.
+        Should be re-implemented by subclasses which need related objects in get_search_values.
+        """
+        return cls._base_manager.all()
+
+
+def get_search_document(search_values):
+    return "\n".join(filter(None, search_values))
+
+
+def get_search_document_digest(search_document):
+    return hashlib.sha1(search_document.encode()).hexdigest()
+
+
+def get_search_vector_text(search_values):
+    """
+    The text given to to_tsvector, concatenated the same way than django's SearchVector does.
+    """
+    return " ".join(value or '' for value in search_values)
+
 
 class FreeSearchFilter(django_filters.CharFilter):
     def __init__(self, *args, **kwargs):
@@ -200,21 +251,96 @@ def schedule_search_vector_update(instance):
     )
 
 
-def run_search_vector_update():
-    try:
-        while True:
-            element_to_update = redis_client.spop(SEARCH_VECTOR_UPDATE_REDIS_KEY)
+def run_search_vector_update(batch_size=SEARCH_VECTOR_UPDATE_BATCH_SIZE):
+    """
+    Update the search vectors of the instances scheduled with `schedule_search_vector_update`.
+
+    The elements are popped from redis by batches, grouped by content type,
+    and each group is loaded with a single query and updated with a single query.
+
+    Returns: a dict of throughput stats
+    """
+    stats = {
+        'batches': 0,
+        'updated': 0,
+        'unchanged': 0,
+        'missing': 0,
+        'errors': 0,
+    }
+    start = time.monotonic()
+
+    while True:
+        elements_to_update = redis_client.spop(SEARCH_VECTOR_UPDATE_REDIS_KEY, batch_size)
+        if not elements_to_update:
+            break
+        stats['batches'] += 1
+
+        instance_ids_by_content_type = {}
+        for element_to_update in elements_to_update:
+            content_type_id, instance_id = element_to_update.decode().split(',')
+            instance_ids_by_content_type.setdefault(int(content_type_id), set()).add(int(instance_id))
+
+        for content_type_id, instance_ids in instance_ids_by_content_type.items():
+            try:
+                model = ContentType.objects.get_for_id(content_type_id).model_class()
+                updated, unchanged = bulk_update_search_vectors(model, instance_ids)
+            except:
+                stats['errors'] += len(instance_ids)
+                logger.error(
+                    f"Error in run_search_vector_update (content_type_id={content_type_id}, instance_ids={instance_ids})",
+                    exc_info=True
+                )
+                continue
+
+            stats['updated'] += updated
+            stats['unchanged'] += unchanged
+            stats['missing'] += len(instance_ids) - updated - unchanged
+
+    stats['duration'] = time.monotonic() - start
+    stats['rate'] = stats['updated'] / stats['duration'] if stats['duration'] else 0
+    if stats['batches']:
+        logger.info(
+            f"Search vectors updated : {stats['updated']} instances in {stats['batches']} batches, "
+            f"{stats['duration']:.2f}s ({stats['rate']:.1f} instances/s), "
+            f"{stats['unchanged']} unchanged, {stats['missing']} missing, {stats['errors']} errors"
+        )
+    return stats
 
-            if element_to_update is None:
-                break
 
-            element_to_update = element_to_update.decode()
-            content_type_id, instance_id = str(element_to_update).split(',')
-            content_type = ContentType.objects.get_for_id(content_type_id)
-            instance = content_type.get_object_for_this_type(id=instance_id)
-            instance.update_search_vector()
-    except:
-        logger.error(
-            f"Error in run_search_vector_update (element_to_update={element_to_update})",
-            exc_info=True
+def bulk_update_search_vectors(model, instance_ids):
+    """
+    Update the search vectors of a set of instances of the same model,
+    with a single multi-row UPDATE ... FROM (VALUES ...) query.
+    The instances whose search document did not change since the last update are skipped.
+
+    Returns: the number of instances updated, and the number of unchanged instances
+    """
+    rows = []
+    unchanged = 0
+    for instance in model.get_search_vector_update_queryset().filter(id__in=instance_ids):
+        search_values = instance.get_current_search_values()
+        search_document = get_search_document(search_values)
+        search_document_digest = get_search_document_digest(search_document)
+        if search_document_digest == instance.search_document_digest:
+            unchanged += 1
+            continue
+        rows.append((instance.id, get_search_vector_text(search_values), search_document, search_document_digest))
+
+    if not rows:
+        return 0, unchanged
+
+    table = connection.ops.quote_name(model._meta.db_table)
+    values_sql = ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+    params = [param for row in rows for param in row]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} SET "
+            f"search_vector = to_tsvector('unaccent'::regconfig, search_values.search_vector_text), "
+            f"partial_search_document = UNACCENT(search_values.search_document), "
+            f"search_document_digest = search_values.search_document_digest "
+            f"FROM (VALUES {values_sql}) "
+            f"AS search_values (id, search_vector_text, search_document, search_document_digest) "
+            f"WHERE {table}.id = search_values.id",
+            params
         )
+    return len(rows), unchanged
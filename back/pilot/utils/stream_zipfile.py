@@ -1,19 +1,236 @@
+import os
+import io
+import queue
+import shutil
+import tempfile
+import threading
 import zipfile, zlib, binascii, struct, time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Maximum size of the compressed entries waiting to be written in the archive, see ZipWriterPipeline
+MAX_BYTES_IN_FLIGHT = 64 * 1024 * 1024
+
+# Files already compressed, which would not shrink with DEFLATE, see get_compress_type
+INCOMPRESSIBLE_EXTENSIONS = {
+    # Images
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'psd',
+    # Videos
+    '3g2', '3gp', 'asf', 'avi', 'flv', 'm4v', 'mkv', 'mov', 'mp4', 'mpg', 'mpeg', 'rm', 'swf', 'vob', 'webm', 'wmv',
+    # Audio
+    'aac', 'm4a', 'mp3', 'mpa', 'ogg', 'ra', 'wma',
+    # Documents ( the OpenXML and OpenDocument formats are zip archives )
+    'pdf', 'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp', 'pages', 'key', 'numbers', 'indd',
+    # Archives
+    '7z', 'bz2', 'cbr', 'deb', 'gz', 'pkg', 'rar', 'rpm', 'sitx', 'tgz', 'xz', 'zip', 'zipx',
+    # Fonts
+    'woff', 'woff2',
+}
+# Uncompressed formats of the media types
+COMPRESSIBLE_EXTENSIONS = {'bmp', 'svg', 'tga', 'tif', 'tiff', 'aif', 'aiff', 'wav'}
+INCOMPRESSIBLE_MIME_PREFIXES = (
+    'image/', 'video/', 'audio/', 'application/pdf', 'application/zip', 'application/gzip',
+    'application/x-7z-compressed', 'application/x-rar-compressed', 'application/vnd.openxmlformats-officedocument.',
+)
+COMPRESSIBLE_MIMES = {'image/bmp', 'image/svg+xml', 'image/tiff', 'audio/wav', 'audio/x-wav', 'audio/aiff'}
+# The Asset.filetype of the media files
+INCOMPRESSIBLE_FILETYPES = {'image', 'video', 'audio', 'pdf'}
+
+
+def get_compress_type(arcname=None, extension=None, mime=None, filetype=None, default=zipfile.ZIP_DEFLATED):
+    """
+    Store the files already compressed ( images, videos, pdf, docx, archives, ... ) instead of deflating them again.
+    The most precise information is used first : the extension, then the mime type, then the file type.
+    """
+    if extension is None and arcname:
+        extension = os.path.splitext(arcname)[1]
+    extension = (extension or '').lower().lstrip('.')
+    if extension in INCOMPRESSIBLE_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    if extension in COMPRESSIBLE_EXTENSIONS:
+        return default
+
+    mime = (mime or '').lower()
+    if mime in COMPRESSIBLE_MIMES:
+        return default
+    if mime.startswith(INCOMPRESSIBLE_MIME_PREFIXES):
+        return zipfile.ZIP_STORED
+
+    if (filetype or '').lower() in INCOMPRESSIBLE_FILETYPES:
+        return zipfile.ZIP_STORED
+
+    return default
+
+
+def make_zip_info(arcname, compress_type, compresslevel=None):
+    zinfo = zipfile.ZipInfo(
+        filename=arcname,
+        date_time=time.localtime(time.time())[:6]
+    )
+    zinfo.compress_type = compress_type
+    zinfo._compresslevel = compresslevel
+    if zinfo.filename[-1] == '/':
+        zinfo.external_attr = 0o40775 << 16   # drwxrwxr-x
+        zinfo.external_attr |= 0x10           # MS-DOS directory flag
+    else:
+        zinfo.external_attr = 0o600 << 16     # ?rw-------
+    return zinfo
+
+
+class CompressedEntry(object):
+    """
+    An archive entry compressed outside of the archive, ready to be appended as is by BufferedZipFile.write_compressed
+    """
+    def __init__(self, zinfo, data):
+        self.zinfo = zinfo
+        self.data = data
+
+    @classmethod
+    def compress(cls, arcname, data, compress_type, compresslevel=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        zinfo = make_zip_info(arcname, compress_type, compresslevel)
+        zinfo.file_size = len(data)
+        zinfo.CRC = zlib.crc32(data) & 0xffffffff
+
+        if compress_type == zipfile.ZIP_DEFLATED:
+            if compresslevel is None:
+                compresslevel = zlib.Z_DEFAULT_COMPRESSION
+            # Raw deflate stream, without the zlib header, as stored in the zip archives
+            compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+            data = compressor.compress(data) + compressor.flush()
+        elif compress_type != zipfile.ZIP_STORED:
+            raise NotImplementedError("Unsupported compression method {}".format(compress_type))
+
+        zinfo.compress_size = len(data)
+        return cls(zinfo, data)
+
+    def copy(self, arcname):
+        """
+        The same compressed data under another name, to be appended to another archive
+        """
+        zinfo = make_zip_info(arcname, self.zinfo.compress_type, self.zinfo._compresslevel)
+        zinfo.file_size = self.zinfo.file_size
+        zinfo.compress_size = self.zinfo.compress_size
+        zinfo.CRC = self.zinfo.CRC
+        return CompressedEntry(zinfo, self.data)
+
+    @property
+    def size(self):
+        return self.zinfo.compress_size
+
+    def write_data(self, fp):
+        fp.write(self.data)
+
+    def close(self):
+        pass
+
+
+class FileEntry(CompressedEntry):
+    """
+    An entry whose data is in a file ( e.g. a downloaded asset ), see make_file_entry.
+    The file is closed once written.
+    """
+    def __init__(self, zinfo, file, on_close=None):
+        super(FileEntry, self).__init__(zinfo, None)
+        self.file = file
+        self.on_close = on_close
+
+    def copy(self, arcname):
+        raise NotImplementedError("The file of a FileEntry is written only once")
+
+    def write_data(self, fp):
+        self.file.seek(0)
+        shutil.copyfileobj(self.file, fp, 1024 * 1024)
+
+    def close(self):
+        self.file.close()
+        if self.on_close:
+            self.on_close()
+
+
+def make_file_entry(arcname, file, compress_type=zipfile.ZIP_STORED, compresslevel=None, on_close=None):
+    """
+    Compute the CRC of a file, and compress it in another file for ZIP_DEFLATED, in a single pass.
+    `file` is closed once compressed, the compressed file is kept in RAM when `file` is.
+
+    Returns: a FileEntry
+    """
+    zinfo = make_zip_info(arcname, compress_type, compresslevel)
+    if compress_type == zipfile.ZIP_DEFLATED:
+        if compresslevel is None:
+            compresslevel = zlib.Z_DEFAULT_COMPRESSION
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+        output_file = io.BytesIO() if isinstance(file, io.BytesIO) else tempfile.TemporaryFile()
+    elif compress_type == zipfile.ZIP_STORED:
+        compressor = None
+        output_file = file
+    else:
+        raise NotImplementedError("Unsupported compression method {}".format(compress_type))
+
+    file.seek(0)
+    crc = 0
+    file_size = 0
+    compress_size = 0
+    while True:
+        data = file.read(1024 * 1024)
+        if not data:
+            break
+        crc = zlib.crc32(data, crc)
+        file_size += len(data)
+        if compressor:
+            data = compressor.compress(data)
+            output_file.write(data)
+            compress_size += len(data)
+
+    if compressor:
+        data = compressor.flush()
+        output_file.write(data)
+        compress_size += len(data)
+        file.close()
+    else:
+        compress_size = file_size
+
+    zinfo.CRC = crc & 0xffffffff
+    zinfo.file_size = file_size
+    zinfo.compress_size = compress_size
+    return FileEntry(zinfo, output_file, on_close=on_close)
+
+
+def read_compressed_entries(file):
+    """
+    Read the entries of an archive without decompressing them.
+
+    Returns: a dict of CompressedEntry by name
+    """
+    entries = {}
+    with zipfile.ZipFile(file) as zip_file:
+        for zinfo in zip_file.infolist():
+            zip_file.fp.seek(zinfo.header_offset)
+            header = zip_file.fp.read(zipfile.sizeFileHeader)
+            if len(header) != zipfile.sizeFileHeader or header[0:4] != zipfile.stringFileHeader:
+                raise zipfile.BadZipFile("Bad magic number for file header")
+
+            header = struct.unpack(zipfile.structFileHeader, header)
+            # Skip the file name and the extra field of the local header
+            zip_file.fp.seek(header[zipfile._FH_FILENAME_LENGTH] + header[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+            data = zip_file.fp.read(zinfo.compress_size)
+
+            # With a new ZipInfo, detached from the read archive
+            entries[zinfo.filename] = CompressedEntry(zinfo, data).copy(zinfo.filename)
+    return entries
 
 
 class BufferedZipFile(zipfile.ZipFile):
-    def write_s3_streaming_body(self, arcname, streaming_body):
-        zinfo = zipfile.ZipInfo(
-            filename=arcname,
-            date_time=time.localtime(time.time())[:6]
-        )
-        zinfo.compress_type = self.compression
-        zinfo._compresslevel = self.compresslevel
-        if zinfo.filename[-1] == '/':
-            zinfo.external_attr = 0o40775 << 16   # drwxrwxr-x
-            zinfo.external_attr |= 0x10           # MS-DOS directory flag
-        else:
-            zinfo.external_attr = 0o600 << 16     # ?rw-------
+    def write_s3_streaming_body(self, arcname, streaming_body, compress_type=None):
+        """
+        Args:
+            compress_type: the compression of this entry, see get_compress_type. The archive compression by default.
+        """
+        if compress_type is None:
+            compress_type = get_compress_type(arcname, default=self.compression)
+        zinfo = make_zip_info(arcname, compress_type, self.compresslevel)
 
         if not self.fp:
             raise ValueError(
@@ -32,23 +249,41 @@ class BufferedZipFile(zipfile.ZipFile):
                         break
                     dest.write(data)
 
+    def write_compressed(self, entry):
+        """
+        Append a CompressedEntry : the data is written as is, without compressing it again.
+        """
+        zinfo = entry.zinfo
+        if not self.fp:
+            raise ValueError(
+                "Attempt to write to ZIP archive that was already closed")
+        if self._writing:
+            raise ValueError(
+                "Can't write to ZIP archive while an open writing handle exists."
+            )
+
+        with self._lock:
+            if self._seekable:
+                self.fp.seek(self.start_dir)
+            zinfo.header_offset = self.fp.tell()
+            self._writecheck(zinfo)
+            self._didModify = True
+
+            zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+            self.fp.write(zinfo.FileHeader(zip64))
+            entry.write_data(self.fp)
+
+            self.filelist.append(zinfo)
+            self.NameToInfo[zinfo.filename] = zinfo
+            self.start_dir = self.fp.tell()
+
     """
     Inspired by :
     https://stackoverflow.com/questions/297345/create-a-zip-file-from-a-generator-in-python/299830#299830
     """
     def write_buffered(self, zinfo_or_arcname, buffer):
         if not isinstance(zinfo_or_arcname, zipfile.ZipInfo):
-            zinfo = zipfile.ZipInfo(
-                filename=zinfo_or_arcname,
-                date_time=time.localtime(time.time())[:6]
-            )
-            zinfo.compress_type = self.compression
-            zinfo._compresslevel = self.compresslevel
-            if zinfo.filename[-1] == '/':
-                zinfo.external_attr = 0o40775 << 16   # drwxrwxr-x
-                zinfo.external_attr |= 0x10           # MS-DOS directory flag
-            else:
-                zinfo.external_attr = 0o600 << 16     # ?rw-------
+            zinfo = make_zip_info(zinfo_or_arcname, self.compression, self.compresslevel)
         else:
             zinfo = zinfo_or_arcname
 
@@ -96,4 +331,172 @@ class BufferedZipFile(zipfile.ZipFile):
         self.fp.write(struct.pack("<LLL", zinfo.CRC, zinfo.compress_size, zinfo.file_size))
         self.fp.seek(position, 0)
         self.filelist.append(zinfo)
-        self.NameToInfo[zinfo.filename] = zinfo
\ No newline at end of file
+        self.NameToInfo[zinfo.filename] = zinfo
+
+class StageTimings(object):
+    """
+    Cumulated durations of the stages of an export, in seconds.
+    The stages run concurrently in several threads, so their sum may exceed the wall-clock time.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, duration):
+        with self.lock:
+            self.durations[name] += duration
+
+    def increment(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def as_dict(self):
+        with self.lock:
+            timings = {name: round(duration, 3) for name, duration in self.durations.items()}
+            timings.update(self.counters)
+            return timings
+
+
+class ByteBudget(object):
+    """
+    Bound the size of the data held at the same time by several threads, in RAM or on disk.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.condition = threading.Condition()
+        self.error = None
+
+    def acquire(self, size, blocking=True):
+        """
+        Returns: False if `blocking` is False and there's not enough room left
+        """
+        with self.condition:
+            # A size bigger than the whole budget is still accepted, once alone
+            while (
+                self.error is None and
+                self.used_bytes > 0 and
+                self.used_bytes + size > self.max_bytes
+            ):
+                if not blocking:
+                    return False
+                self.condition.wait()
+
+            if self.error is not None:
+                raise RuntimeError("The budget has been aborted") from self.error
+
+            self.used_bytes += size
+            return True
+
+    def release(self, size):
+        with self.condition:
+            self.used_bytes -= size
+            self.condition.notify_all()
+
+    def abort(self, error):
+        """
+        Wake up and fail the waiting threads, when the consumer has failed
+        """
+        with self.condition:
+            self.error = error
+            self.condition.notify_all()
+
+
+class ZipWriterPipeline(object):
+    """
+    Producer/consumer pipeline to build an archive from several threads.
+
+    The producers compress their entries themselves ( zlib releases the GIL, so the compression runs in parallel ),
+    and put them on a queue.
+    A single writer thread appends the compressed entries to the archive, so no producer ever waits on a lock
+    held during a compression.
+
+    The queue is bounded by the size of the entries in flight :
+    a producer blocks until the writer has freed enough room for its entry,
+    so a slow disk cannot make the pending entries exhaust the RAM.
+
+    Usage :
+        pipeline = ZipWriterPipeline(zip_file)
+        pipeline.start()
+        pipeline.write(arcname, data)  # From any thread
+        pipeline.close()  # Wait for the pending entries to be written
+    """
+    def __init__(self, zip_file, max_bytes_in_flight=MAX_BYTES_IN_FLIGHT, timings=None):
+        self.zip_file = zip_file
+        self.budget = ByteBudget(max_bytes_in_flight)
+        self.timings = timings or StageTimings()
+
+        self.queue = queue.Queue()
+        self.writer_thread = threading.Thread(target=self.run_writer, name='zip-writer', daemon=True)
+        self.writer_error = None
+
+    def start(self):
+        self.writer_thread.start()
+
+    def write(self, arcname, data):
+        """
+        Compress the entry in the calling thread ( see get_compress_type ), then wait for room in the queue
+
+        Returns: the CompressedEntry
+        """
+        with self.timings.stage('compress'):
+            compress_type = get_compress_type(arcname, default=self.zip_file.compression)
+            entry = CompressedEntry.compress(arcname, data, compress_type, self.zip_file.compresslevel)
+
+        self.write_compressed(entry)
+        return entry
+
+    def write_compressed(self, entry):
+        """
+        Wait for room in the queue for an entry already compressed
+        """
+        with self.timings.stage('backpressure'):
+            self.budget.acquire(entry.size)
+
+        self.put(entry, entry.size)
+
+    def put(self, entry, reserved_size):
+        """
+        Queue an entry whose room has already been acquired from the budget,
+        by a producer which needs to reserve the room before getting the data ( see AssetExportJob )
+        """
+        self.queue.put((entry, reserved_size))
+
+    def run_writer(self):
+        while True:
+            queued = self.queue.get()
+            if queued is None:
+                return
+            entry, reserved_size = queued
+
+            try:
+                if self.writer_error is None:
+                    with self.timings.stage('write'):
+                        self.zip_file.write_compressed(entry)
+            except Exception as e:
+                # Keep consuming the queue, so the producers are not blocked forever
+                self.writer_error = e
+                self.budget.abort(e)
+            finally:
+                entry.close()
+                self.budget.release(reserved_size)
+
+    def close(self):
+        """
+        Wait for all the entries to be written.
+        Must be called once all the producers are done.
+        """
+        self.queue.put(None)
+        self.writer_thread.join()
+
+        if self.writer_error is not None:
+            raise self.writer_error
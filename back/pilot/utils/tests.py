@@ -1,9 +1,18 @@
 import datetime
 import copy
+import io
+import threading
+import zipfile
 
 from unittest.case import skip
 
-from django.test import TestCase
+import mock
+from django.contrib.postgres.search import SearchQuery
+from django.utils.encoding import force_text
+from openpyxl import load_workbook
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
 from pilot.desks.tests import factories as desks_factories
 from pilot.items.tests import factories as items_factories
@@ -14,6 +23,24 @@ from pilot.utils import pilot_languages
 from pilot.utils.test import PilotAdminUserMixin, prosemirror_body, WorkflowStateTestingMixin
 from pilot.item_types.tests.testing_item_type_definition import ADVANCED_TEST_SCHEMA
 from pilot.item_types.tests import factories as item_types_factories
+from pilot.items.export_item import ItemXLSExporter
+from pilot.items.models import Item
+from pilot.itemsfilters.models import SavedFilter
+from pilot.itemsfilters.saved_filter import export_saved_filter_to_xls
+from pilot.pilot_users.jobs import UserXLSExporter
+from pilot.pilot_users.models import PilotUser
+from pilot.projects.jobs import ProjectXLSExporter
+from pilot.projects.models import Project
+from pilot.utils.export_utils import ITEM_METADATA_FIELDS, PROJECT_METADATA_FIELDS, USER_METADATA_FIELDS, \
+    iterate_by_chunks
+from pilot.queue.jobs import Job
+from pilot.utils.projel.hierarchy import HierarchyConsistencyJob, NodeTypes, ensure_consistent_hierarchy, \
+    get_projel_key, pop_hierarchy_changes, record_hierarchy_changes
+from pilot.utils.redis import redis_client
+from pilot.utils.search import run_search_vector_update, schedule_search_vector_update, \
+    SEARCH_VECTOR_UPDATE_REDIS_KEY
+from pilot.utils.stream_zipfile import BufferedZipFile, ZipWriterPipeline, get_compress_type, make_file_entry, \
+    read_compressed_entries
 
 
 class UtilsTest(PilotAdminUserMixin, TestCase):
@@ -142,3 +169,358 @@ class DiffHistoryTests(WorkflowStateTestingMixin, TestCase):
         for field_name in field_names:
             result = filter(lambda x: x['field_name'] == field_name, diff)[0]['field_diff']
             self.assertEqual(expected_diff[field_name], result)
+
+
+class SearchVectorUpdateTests(TestCase):
+    def setUp(self):
+        redis_client.delete(SEARCH_VECTOR_UPDATE_REDIS_KEY)
+
+    def test_batched_update(self):
+        desk = desks_factories.DeskFactory.create()
+        items = [
+            items_factories.ItemFactory.create(desk=desk, json_content={
+                'title': f'Article numéro {i}',
+                'body': prosemirror_body(f'Corps {i}')
+            })
+            for i in range(5)
+        ]
+        project = projects_factories.ProjectFactory.create(desk=desk, name='Projet éphémère')
+
+        stats = run_search_vector_update(batch_size=2)
+
+        self.assertEqual(stats['errors'], 0)
+        self.assertGreaterEqual(stats['batches'], 3)
+        self.assertEqual(redis_client.scard(SEARCH_VECTOR_UPDATE_REDIS_KEY), 0)
+
+        found_items = Item.objects.filter(search_vector=SearchQuery('numero', config='unaccent'))
+        self.assertEqual(set(found_items), set(items))
+        self.assertTrue(
+            Item.objects.get(id=items[0].id).partial_search_document.startswith('Article numero 0\nCorps 0')
+        )
+        self.assertEqual(
+            list(Project.objects.filter(search_vector=SearchQuery('ephemere', config='unaccent'))),
+            [project]
+        )
+
+    def test_skip_unchanged_search_document(self):
+        item = items_factories.ItemFactory.create()
+        run_search_vector_update()
+        item = Item.objects.get(id=item.id)
+
+        # The searchable text did not change
+        item.publication_dt = item.publication_dt + datetime.timedelta(days=1)
+        item.save()
+        self.assertEqual(redis_client.scard(SEARCH_VECTOR_UPDATE_REDIS_KEY), 0)
+
+        # The indexer skips the documents already indexed
+        schedule_search_vector_update(item)
+        stats = run_search_vector_update()
+        self.assertEqual((stats['updated'], stats['unchanged']), (0, 1))
+
+        item.json_content['title'] = 'Nouveau titre'
+        item.save()
+        self.assertEqual(redis_client.scard(SEARCH_VECTOR_UPDATE_REDIS_KEY), 1)
+        stats = run_search_vector_update()
+        self.assertEqual((stats['updated'], stats['unchanged']), (1, 0))
+
+
+class HierarchyConsistencyTests(PilotAdminUserMixin, TestCase):
+    def setUp(self):
+        super(HierarchyConsistencyTests, self).setUp()
+        self.project = projects_factories.ProjectFactory.create(desk=self.desk)
+        self.items = [
+            self.create_item(title) for title in ('B', 'C', 'A')
+        ]
+        self.projel_key = get_projel_key(self.project)
+
+    def create_item(self, title):
+        return items_factories.ItemFactory.create(
+            desk=self.desk,
+            project=self.project,
+            json_content={'title': title, 'body': prosemirror_body(title)}
+        )
+
+    def tearDown(self):
+        pop_hierarchy_changes(self.projel_key)
+
+    def get_root_item_ids(self):
+        self.project.refresh_from_db()
+        return [node['id'] for node in self.project.hierarchy if node['type'] == NodeTypes.ITEM]
+
+    def test_incremental_consistency(self):
+        ensure_consistent_hierarchy(self.project)
+        self.assertEqual(self.get_root_item_ids(), [self.items[2].id, self.items[0].id, self.items[1].id])
+
+        new_item = self.create_item('AB')
+        self.items[0].project = None
+        self.items[0].save()
+
+        ensure_consistent_hierarchy(self.project, item_ids=[new_item.id, self.items[0].id])
+        self.assertEqual(self.get_root_item_ids(), [self.items[2].id, new_item.id, self.items[1].id])
+
+        # Nothing to change, nothing saved
+        with self.assertNumQueries(4):
+            ensure_consistent_hierarchy(self.project, item_ids=[new_item.id])
+
+    def test_changes_are_coalesced(self):
+        self.assertEqual(record_hierarchy_changes({self.projel_key: {self.items[0].id}}), [self.projel_key])
+        # Already scheduled, the changes are absorbed by the scheduled consistency
+        self.assertEqual(record_hierarchy_changes({self.projel_key: {self.items[1].id}}), [])
+        self.assertEqual(pop_hierarchy_changes(self.projel_key), {self.items[0].id, self.items[1].id})
+
+        # A full consistency absorbs the items changes
+        record_hierarchy_changes({self.projel_key: None})
+        record_hierarchy_changes({self.projel_key: {self.items[2].id}})
+        self.assertIsNone(pop_hierarchy_changes(self.projel_key))
+        self.assertEqual(pop_hierarchy_changes(self.projel_key), set())
+
+
+class HierarchyConsistencyJobTests(PilotAdminUserMixin, TransactionTestCase):
+    # The data migrations are restored after the flush of the database
+    serialized_rollback = True
+
+    def setUp(self):
+        super(HierarchyConsistencyJobTests, self).setUp()
+        self.project = projects_factories.ProjectFactory.create(desk=self.desk)
+        self.projel_key = get_projel_key(self.project)
+        # The consistencies scheduled by the creation of the project
+        pop_hierarchy_changes(self.projel_key)
+        Job.reset_pending_jobs()
+
+    def tearDown(self):
+        pop_hierarchy_changes(self.projel_key)
+
+    @mock.patch.object(HierarchyConsistencyJob.queue, 'enqueue_call')
+    def test_launch_without_transaction(self, mock_enqueue_call):
+        # No atomic block, as in the requests : the pending job is flushed right away by the launch
+        HierarchyConsistencyJob.launch(self.desk, projels=self.project, item_ids=[1])
+
+        mock_enqueue_call.assert_called_once()
+        self.assertEqual(mock_enqueue_call.call_args[1]['kwargs'], {'projel_keys': [self.projel_key]})
+        self.assertEqual(pop_hierarchy_changes(self.projel_key), {1})
+
+
+class XLSExportersTests(PilotAdminUserMixin, TestCase):
+    def setUp(self):
+        super(XLSExportersTests, self).setUp()
+        self.project = projects_factories.ProjectFactory.create(desk=self.desk, name='Illegal\x0b project')
+        self.items = [
+            items_factories.ItemFactory.create(
+                desk=self.desk,
+                project=self.project,
+                language='fr',
+                json_content={'title': title, 'body': prosemirror_body(title)}
+            )
+            for title in ('First', 'Illegal\x0b title')
+        ]
+
+    def export(self, exporter_class, queryset, **kwargs):
+        output_file = io.BytesIO()
+        exporter_class(queryset, output_file, **kwargs).do_export()
+        output_file.seek(0)
+        return load_workbook(output_file).active
+
+    def get_rows(self, worksheet):
+        return [list(row) for row in worksheet.iter_rows(values_only=True)]
+
+    def get_verbose_names(self, model, field_names):
+        return [force_text(model._meta.get_field(field_name).verbose_name) for field_name in field_names]
+
+    def get_items(self):
+        return (
+            Item.objects
+            .filter(desk=self.desk)
+            .order_by('id')
+            .select_related('project', 'created_by', 'updated_by', 'workflow_state', 'item_type')
+            .prefetch_related('channels', 'tasks', 'targets', 'owners', 'tags')
+        )
+
+    def test_item_export(self):
+        worksheet = self.export(ItemXLSExporter, self.get_items())
+        rows = self.get_rows(worksheet)
+
+        header_length = len(ITEM_METADATA_FIELDS) + 3
+        self.assertEqual(rows[0][1:header_length - 2], self.get_verbose_names(Item, ITEM_METADATA_FIELDS))
+        self.assertEqual(len(rows), 3)
+        # The illegal characters are removed
+        self.assertEqual([row[0] for row in rows[1:]], ['First', 'Illegal title'])
+        self.assertEqual([row[1] for row in rows[1:]], [str(item.id) for item in self.items])
+
+        self.assertEqual(worksheet.column_dimensions['A'].width, 50)
+        self.assertEqual(worksheet.column_dimensions['B'].width, 10)
+        self.assertEqual(worksheet.column_dimensions['C'].width, 25)
+        # The title and the many-to-many columns are wrapped
+        self.assertTrue(worksheet['A2'].alignment.wrap_text)
+        channels_column = ITEM_METADATA_FIELDS.index('channels') + 2
+        self.assertTrue(worksheet.cell(row=2, column=channels_column).alignment.wrap_text)
+        self.assertFalse(worksheet['B2'].alignment.wrap_text)
+
+    def test_saved_filter_export(self):
+        saved_filter = SavedFilter.objects.create(
+            desk=self.desk,
+            user=self.user,
+            title='French',
+            query='language=fr',
+            type=SavedFilter.TYPE_LIST
+        )
+        output_file = io.BytesIO()
+        export_saved_filter_to_xls(saved_filter, output_file)
+        output_file.seek(0)
+        worksheet = load_workbook(output_file).active
+        rows = self.get_rows(worksheet)
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual([row[1] for row in rows[1:]], [str(item.id) for item in self.items])
+        self.assertIn('Illegal title', rows[2][0])
+        self.assertNotIn('\x0b', rows[2][0])
+        # The content column is wider than the title one
+        self.assertEqual(worksheet.column_dimensions['A'].width, 100)
+
+    def test_project_export(self):
+        projects = Project.objects.filter(id=self.project.id).prefetch_related('channels', 'owners', 'targets', 'tags')
+        worksheet = self.export(ProjectXLSExporter, projects)
+        rows = self.get_rows(worksheet)
+
+        self.assertEqual(rows[0][:-1], self.get_verbose_names(Project, PROJECT_METADATA_FIELDS))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][0], str(self.project.id))
+        self.assertEqual(rows[1][1], 'Illegal project')
+        # The items count
+        self.assertEqual(rows[1][-1], 2)
+
+        self.assertEqual(worksheet.column_dimensions['A'].width, 10)
+        self.assertEqual(worksheet.column_dimensions['B'].width, 25)
+
+    def test_user_export(self):
+        users = PilotUser.objects.filter(desks=self.desk).order_by('id').prefetch_related('teams')
+        worksheet = self.export(UserXLSExporter, users)
+        rows = self.get_rows(worksheet)
+
+        self.assertEqual(rows[0], self.get_verbose_names(PilotUser, USER_METADATA_FIELDS))
+        self.assertEqual([row[0] for row in rows[1:]], [self.user.username])
+        self.assertEqual(worksheet.column_dimensions['A'].width, 25)
+        teams_column = USER_METADATA_FIELDS.index('teams') + 1
+        self.assertTrue(worksheet.cell(row=2, column=teams_column).alignment.wrap_text)
+
+
+class ExportChunksTests(PilotAdminUserMixin, TestCase):
+    def get_items(self):
+        return (
+            Item.objects
+            .filter(desk=self.desk)
+            .order_by('id')
+            .select_related('project', 'created_by', 'updated_by', 'workflow_state', 'item_type')
+            .prefetch_related('channels', 'tasks', 'targets', 'owners', 'tags')
+        )
+
+    def count_export_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            ItemXLSExporter(self.get_items(), io.BytesIO(), with_content=True).do_export()
+        return len(context.captured_queries)
+
+    def test_queries_do_not_depend_on_the_number_of_items(self):
+        items_factories.ItemFactory.create_batch(2, desk=self.desk)
+        queries_count = self.count_export_queries()
+
+        items_factories.ItemFactory.create_batch(5, desk=self.desk)
+        self.assertEqual(self.count_export_queries(), queries_count)
+
+    def test_prefetch_by_chunks(self):
+        items_factories.ItemFactory.create_batch(5, desk=self.desk)
+
+        items = list(iterate_by_chunks(self.get_items(), chunk_size=2))
+        self.assertEqual(len(items), 5)
+        with self.assertNumQueries(0):
+            for item in items:
+                list(item.channels.all())
+                item.publication_task
+
+
+class ZipWriterPipelineTests(SimpleTestCase):
+    def test_concurrent_writes(self):
+        output_file = io.BytesIO()
+        zip_file = BufferedZipFile(output_file, mode='w', compression=zipfile.ZIP_DEFLATED)
+        zip_file.writestr('first.txt', 'first')
+
+        # A budget smaller than the total size of the entries, so the producers have to wait for the writer
+        pipeline = ZipWriterPipeline(zip_file, max_bytes_in_flight=1024)
+        pipeline.start()
+
+        def produce(producer_index):
+            for file_index in range(20):
+                pipeline.write(f'{producer_index}/{file_index}.txt', f'{producer_index}-{file_index} ' * 100)
+
+        producers = [threading.Thread(target=produce, args=[i]) for i in range(4)]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+        pipeline.close()
+
+        zip_file.writestr('last.txt', 'last')
+        zip_file.close()
+
+        self.assertEqual(pipeline.budget.used_bytes, 0)
+        self.assertIn('write', pipeline.timings.as_dict())
+
+        archive = zipfile.ZipFile(io.BytesIO(output_file.getvalue()))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(len(archive.namelist()), 4 * 20 + 2)
+        self.assertEqual(archive.read('3/7.txt').decode(), '3-7 ' * 100)
+        self.assertEqual(archive.read('last.txt').decode(), 'last')
+
+    def test_read_compressed_entries(self):
+        cache_file = io.BytesIO()
+        with BufferedZipFile(cache_file, mode='w', compression=zipfile.ZIP_DEFLATED) as cache_zip_file:
+            cache_zip_file.writestr('content.html', '<p>Content</p>' * 100)
+            cache_zip_file.writestr('content.docx', b'docx')
+
+        entries = read_compressed_entries(io.BytesIO(cache_file.getvalue()))
+        self.assertEqual(set(entries), {'content.html', 'content.docx'})
+
+        # Appended as is, under another name
+        output_file = io.BytesIO()
+        with BufferedZipFile(output_file, mode='w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.write_compressed(entries['content.html'].copy('items/1-title/title.html'))
+
+        archive = zipfile.ZipFile(io.BytesIO(output_file.getvalue()))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.read('items/1-title/title.html').decode(), '<p>Content</p>' * 100)
+
+    def test_compression_policy(self):
+        self.assertEqual(get_compress_type('files/2020/1-photo.JPG'), zipfile.ZIP_STORED)
+        self.assertEqual(get_compress_type('items/1-title/title.docx'), zipfile.ZIP_STORED)
+        self.assertEqual(get_compress_type('items/1-title/title.html'), zipfile.ZIP_DEFLATED)
+        self.assertEqual(get_compress_type(extension='svg', filetype='image'), zipfile.ZIP_DEFLATED)
+        self.assertEqual(get_compress_type(extension='', mime='video/mp4'), zipfile.ZIP_STORED)
+        self.assertEqual(get_compress_type(extension='', mime='', filetype='image'), zipfile.ZIP_STORED)
+
+    @mock.patch('zipfile.ZIP64_LIMIT', 1000)
+    def test_non_seekable_output(self):
+        class NonSeekableOutput(object):
+            def __init__(self):
+                self.data = bytearray()
+
+            def write(self, data):
+                self.data += data
+                return len(data)
+
+            def flush(self):
+                pass
+
+        output = NonSeekableOutput()
+        zip_file = BufferedZipFile(output, mode='w', compression=zipfile.ZIP_DEFLATED)
+        pipeline = ZipWriterPipeline(zip_file)
+        pipeline.start()
+        pipeline.write('content.html', '<p>Content</p>' * 1000)
+        pipeline.put(make_file_entry('photo.jpg', io.BytesIO(b'jpeg' * 1000)), 4000)
+        pipeline.close()
+        zip_file.writestr('index.html', '<p>Index</p>' * 1000)
+        zip_file.close()
+
+        # Above the ( patched ) zip64 limit
+        archive = zipfile.ZipFile(io.BytesIO(bytes(output.data)))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.getinfo('photo.jpg').compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archive.read('photo.jpg'), b'jpeg' * 1000)
+        self.assertEqual(archive.read('content.html').decode(), '<p>Content</p>' * 1000)
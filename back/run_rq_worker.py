@@ -46,7 +46,8 @@ if settings.SENTRY_WORKER_DSN:
 
 def start_worker():
     with Connection(redis_client):
-        Worker(RQ_QUEUES).work()
+        # The scheduler is required for the jobs enqueued with a delay ( see pilot.realtime.items )
+        Worker(RQ_QUEUES).work(with_scheduler=True)
 
 
 if __name__ == '__main__':
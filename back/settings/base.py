@@ -165,6 +165,22 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Where the presence of the users connected to the realtime server is kept : 'redis' or 'memory'.
+# The 'memory' store is local to the process, and should be used only with a single realtime server process.
+REALTIME_PRESENCE_STORE = 'redis'
+
+# The live-edit changes are applied on the items at most once per interval ( in seconds ).
+# With 0, they are applied synchronously.
+REALTIME_COMPACTION_INTERVAL = 2
+
+# The broadcasts of the users and of the changes on an item are coalesced within this window ( in seconds ).
+# With 0, they are broadcasted right away.
+REALTIME_BROADCAST_WINDOW = 0.05
+
+# The hierarchy consistency of a projel runs this delay ( in seconds ) after a change,
+# and absorbs all the changes made in the meantime. With 0, it runs right after the transaction.
+HIERARCHY_CONSISTENCY_DEBOUNCE = 2
+
 # ----------------------------------------------------------------------------------------------------------------------
 # Templates
 # ----------------------------------------------------------------------------------------------------------------------
@@ -541,6 +557,31 @@ ES_SERVER = os.environ.get('FOUNDELASTICSEARCH_URL', 'http://localhost:9200')
 ES_ITEM_INDEX = 'items'
 ES_PROJECT_INDEX = 'projects'
 ES_CLIENT = Elasticsearch(ES_SERVER)
+# Seconds between a save and the indexing of the instance, so the saves in a row are indexed in a single _bulk request
+# ( see pilot.search.indexing )
+ES_INDEXING_DELAY = 2
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Prosemirror node.js serializer
+# ----------------------------------------------------------------------------------------------------------------------
+
+# Long-lived serializePmDocWorker.js processes, used when the python serializer cannot handle a document
+PROSEMIRROR_NODEJS_POOL_SIZE = int(os.environ.get('PROSEMIRROR_NODEJS_POOL_SIZE', 2))
+# Number of callers allowed to wait for a free worker, the next ones will fail right away
+PROSEMIRROR_NODEJS_QUEUE_SIZE = 20
+# A worker is recycled when its memory (RSS) exceeds this limit
+PROSEMIRROR_NODEJS_WORKER_MAX_MEMORY_MB = 256
+# Seconds
+PROSEMIRROR_NODEJS_TIMEOUT = 30
+PROSEMIRROR_NODEJS_HEALTH_CHECK_INTERVAL = 60
+
+# Cache of the conversions, keyed by the document content ( see pilot/utils/prosemirror/cache.py )
+PROSEMIRROR_CONVERSION_CACHE_ENABLED = True
+PROSEMIRROR_CONVERSION_CACHE_LOCAL_MAX_BYTES = 16 * 1024 * 1024
+# Seconds
+PROSEMIRROR_CONVERSION_CACHE_REDIS_TTL = 7 * 24 * 3600
+# Documents whose json is smaller than this (in chars) are only cached locally
+PROSEMIRROR_CONVERSION_CACHE_REDIS_MIN_SIZE = 2048
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Django impersonate.
@@ -57,6 +57,11 @@ TEMPLATES[0]['OPTIONS']['loaders'] = (
 # Do not try to connect to the ElasticSearch service during the tests
 ES_DISABLED = True
 
+REALTIME_PRESENCE_STORE = 'memory'
+REALTIME_COMPACTION_INTERVAL = 0
+REALTIME_BROADCAST_WINDOW = 0
+HIERARCHY_CONSISTENCY_DEBOUNCE = 0
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
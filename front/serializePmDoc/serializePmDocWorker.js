@@ -0,0 +1,67 @@
+/**
+ * Long-lived version of serializePmDoc.js, used by the python NodeWorkerPool
+ * ( see back/pilot/utils/prosemirror/nodejs_pool.py ).
+ *
+ * Line-delimited JSON protocol over stdin/stdout, one request and one response per line :
+ *  - {"id": 1, "format": "html", "documents": [...]}
+ *    => {"id": 1, "results": [{"output": "..."}, {"error": "..."}], "rss": 123456}
+ *  - {"id": 2, "ping": true}
+ *    => {"id": 2, "pong": true, "rss": 123456}
+ *
+ * Need the transpiled pmjtmdES6.js file
+ * ( see serializePmDocES6.src.js for instructions )
+ */
+require('./serializePmDocES6.js')
+let readline = require('readline')
+
+let serializers = {
+    html: global.prosemirrorJsonToHTML,
+    markdown: global.prosemirrorJsonToMarkdown,
+    text: global.prosemirrorJsonToText,
+}
+
+// prosemirrorJsonToHTML append to the same element on each call, we need to clean it between documents
+let renderer = global.window.document.getElementById('content')
+
+function serialize(jsonDocument, outputFormat) {
+    let serializer = serializers[outputFormat]
+    if (!serializer) {
+        throw new Error("Incorrect output format " + outputFormat)
+    }
+    renderer.innerHTML = ''
+    return serializer(jsonDocument)
+}
+
+function handleRequest(request) {
+    if (request.ping) {
+        return {id: request.id, pong: true}
+    }
+
+    let results = request.documents.map(jsonDocument => {
+        try {
+            return {output: serialize(jsonDocument, request.format)}
+        } catch (e) {
+            return {error: String(e && e.stack || e)}
+        }
+    })
+    return {id: request.id, results}
+}
+
+let lines = readline.createInterface({input: process.stdin, terminal: false})
+
+lines.on('line', line => {
+    if (!line.trim()) {
+        return
+    }
+
+    let response
+    try {
+        response = handleRequest(JSON.parse(line))
+    } catch (e) {
+        response = {id: null, error: String(e && e.stack || e)}
+    }
+    response.rss = process.memoryUsage().rss
+    process.stdout.write(JSON.stringify(response) + '\n')
+})
+
+lines.on('close', () => process.exit(0))